@@ -1,14 +1,40 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
+from flask import (
+    Flask, render_template, request, jsonify, redirect, url_for, session, g, make_response, send_from_directory
+)
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_bcrypt import Bcrypt
 from werkzeug.utils import secure_filename
 import os
-import face_recognition
+import io
+import atexit
+import zipfile
+from functools import wraps
 from datetime import datetime, timedelta, time, date
 from sqlalchemy import func
-
-from backend.models.models import db, User, Student, Payment, Attendance, Expense, Group, Tariff, ClubSettings, RewardType, StudentReward
-from backend.services.face_service import FaceRecognitionService
+from sqlalchemy.orm import joinedload
+
+from backend.models.models import db, User, Student, Payment, Attendance, Expense, Group, Tariff, ClubSettings, RewardType, StudentReward, StudentLedger, StudentMonthDue
+from backend.models.face_encoding import decode_legacy_face_encoding
+from backend.services.face_service import FaceRecognitionService, parse_roi, BURST_MAX_FRAMES
+from backend.services.face_index import create_face_index
+from backend.services.recognition_pool import RecognitionExecutor, RecognitionBusy, FrameUnchanged
+from backend.services.student_import import (
+    DEFAULT_BATCH_SIZE as DEFAULT_IMPORT_BATCH_SIZE, PhotoSource, StudentImporter, read_roster, summarize_report,
+    process_photo
+)
+from backend.services.photo_variants import VARIANTS_FOLDER, photo_digest, remove_photo_variants, save_photo_variants
+from backend.services.jobs import JobQueue, JobFailed, fail_stale_jobs
+from backend.services.metrics import LatencyMetrics, StageTimer
+from backend.services.lazy_import import preload_recognition_modules, recognition_modules_loaded
+from backend.services.gallery_snapshot import GallerySnapshotStore, GallerySync
+from backend.services.ledger import (
+    history_totals, ledger_add, ledger_needs_rebuild, lesson_balance, rebuild_ledger, refresh_balances
+)
+from backend.services.month_dues import (
+    billable_start_period, dues_add, ensure_current_month, month_dues_need_rebuild, month_paid, month_period,
+    rebuild_month_dues, sync_month_dues
+)
+from backend.services.summary_cache import DEFAULT_TTL as DEFAULT_SUMMARY_TTL, SummaryCache
 from backend.data.locations import get_cities, get_districts
 
 # Получить абсолютный путь к папке проекта
@@ -36,13 +62,69 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = os.path.join(basedir, 'frontend', 'static', 'uploads')
 
 UPLOAD_FOLDER = app.config['UPLOAD_FOLDER']
+# Баланс (в занятиях), начиная с которого ученик попадает в список "заканчиваются занятия"
+LOW_BALANCE_THRESHOLD = int(os.environ.get('LOW_BALANCE_THRESHOLD', 2))
+WATCHLIST_PAGE_SIZE = 20
+WATCHLIST_MAX_PAGE_SIZE = 100
+DEBTORS_PAGE_SIZE = 50
+DEBTORS_MAX_PAGE_SIZE = 500
+# Уменьшенные копии фото отдаются с бессрочным кешем: имя файла меняется вместе с содержимым
+PHOTO_CACHE_SECONDS = 365 * 24 * 3600
 
 db.init_app(app)
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
-face_service = FaceRecognitionService()
+# Пропуск неизменившихся кадров камеры (FRAME_GATE=0 - выключить)
+frame_gate_options = None
+if os.environ.get('FRAME_GATE', '1') != '0':
+    frame_gate_options = {
+        'pixel_delta': int(os.environ.get('FRAME_GATE_PIXEL_DELTA', 20)),
+        'changed_fraction': float(os.environ.get('FRAME_GATE_CHANGED_FRACTION', 0.02)),
+        'refresh_interval': float(os.environ.get('FRAME_GATE_REFRESH', 10))
+    }
+
+# Детекция лиц: масштаб уменьшенной копии кадра, апсемплинг HOG и область интереса
+# (FACE_DETECTION_ROI="left,top,right,bottom" в долях кадра, например "0.25,0,0.75,1" - только дверной проём)
+face_service = FaceRecognitionService(
+    detection_scale=float(os.environ.get('FACE_DETECTION_SCALE', 1.0)),
+    detection_upsample=int(os.environ.get('FACE_DETECTION_UPSAMPLE', 1)),
+    detection_roi=os.environ.get('FACE_DETECTION_ROI'),
+    # Индекс галереи: brute - точный перебор, ivf - кластеры для десятков тысяч лиц
+    index=create_face_index(
+        os.environ.get('FACE_INDEX', 'brute'),
+        nprobe=int(os.environ.get('FACE_INDEX_NPROBE', 8))
+    ),
+    frame_gate=frame_gate_options
+)
+
+# Пул процессов распознавания (RECOGNITION_WORKERS=0 - распознавание в потоке запроса)
+recognition_executor = RecognitionExecutor(
+    face_service,
+    workers=int(os.environ.get('RECOGNITION_WORKERS', 0)),
+    queue_size=int(os.environ.get('RECOGNITION_QUEUE_SIZE', 0)) or None,
+    timeout=float(os.environ.get('RECOGNITION_TIMEOUT', 20))
+)
+atexit.register(recognition_executor.shutdown)
+
+# dlib и OpenCV загружаются при первом кадре; FACE_PRELOAD=1 - сразу при старте
+# (процесс, который обслуживает камеру, не тратит секунды на первом кадре)
+if os.environ.get('FACE_PRELOAD', '0') == '1':
+    preload_recognition_modules()
+
+# Скользящие перцентили времени этапов распознавания (см. /api/recognition/stats);
+# RECOGNITION_TIMING_HEADER=1 - добавлять разбивку в заголовок X-Recognition-Timing каждого ответа
+recognition_metrics = LatencyMetrics(window=int(os.environ.get('RECOGNITION_METRICS_WINDOW', 1000)))
+RECOGNITION_TIMING_HEADER = os.environ.get('RECOGNITION_TIMING_HEADER', '0') == '1'
+
+# Фоновые задачи: encoding фото при добавлении/редактировании ученика считается вне HTTP-запроса
+job_queue = JobQueue(
+    app,
+    workers=int(os.environ.get('JOB_WORKERS', 2)),
+    processes=int(os.environ.get('ENROLLMENT_PROCESSES', 1))
+)
+atexit.register(job_queue.shutdown)
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -84,6 +166,44 @@ def ensure_club_settings_columns():
             conn.execute(db.text("ALTER TABLE club_settings ADD COLUMN podium_display_count INTEGER DEFAULT 20"))
 
 
+def ensure_student_columns():
+    """Добавляет отсутствующие колонки в students (на случай старой БД)"""
+    inspector = db.inspect(db.engine)
+    if 'students' not in inspector.get_table_names():
+        return
+
+    columns = {col['name'] for col in inspector.get_columns('students')}
+    binary_type = 'BYTEA' if db.engine.dialect.name == 'postgresql' else 'BLOB'
+    with db.engine.begin() as conn:
+        if 'face_encoding_bin' not in columns:
+            conn.execute(db.text(f"ALTER TABLE students ADD COLUMN face_encoding_bin {binary_type}"))
+        if 'photo_variants' not in columns:
+            conn.execute(db.text("ALTER TABLE students ADD COLUMN photo_variants TEXT"))
+
+    # Баланс в итогах учеников (заполняется rebuild_ledger при запуске)
+    if 'student_ledger' in inspector.get_table_names():
+        ledger_columns = {col['name'] for col in inspector.get_columns('student_ledger')}
+        if 'balance' not in ledger_columns:
+            with db.engine.begin() as conn:
+                conn.execute(db.text("ALTER TABLE student_ledger ADD COLUMN balance INTEGER"))
+                conn.execute(db.text("CREATE INDEX ix_student_ledger_balance ON student_ledger (balance)"))
+
+    # Подробный результат фоновой задачи (отчёт импорта), процесс-владелец и отметка о ходе работы
+    if 'background_jobs' in inspector.get_table_names():
+        job_columns = {col['name'] for col in inspector.get_columns('background_jobs')}
+        with db.engine.begin() as conn:
+            if 'result' not in job_columns:
+                conn.execute(db.text("ALTER TABLE background_jobs ADD COLUMN result TEXT"))
+            if 'worker' not in job_columns:
+                conn.execute(db.text("ALTER TABLE background_jobs ADD COLUMN worker VARCHAR(100)"))
+            if 'heartbeat_at' not in job_columns:
+                conn.execute(db.text("ALTER TABLE background_jobs ADD COLUMN heartbeat_at TIMESTAMP"))
+
+
+# Больше id в одном IN (...) не передаётся (ограничение SQLite на число параметров)
+BALANCE_QUERY_CHUNK = 500
+
+
 def calculate_student_balance(student):
     """
     Расчёт баланса ученика в занятиях.
@@ -92,31 +212,134 @@ def calculate_student_balance(student):
     """
     if not student:
         return 0
+    return student_balances([student.id]).get(student.id, 0)
+
+
+def calculate_student_balances(students):
+    """Балансы нескольких учеников (см. student_balances); Returns: словарь {student_id: баланс}"""
+    return student_balances([s.id for s in students if s is not None])
+
+
+def student_balances(student_ids=None, status=None):
+    """
+    Балансы учеников одним запросом: ученик + тариф + итоги из student_ledger
+    (формула - lesson_balance)
+    student_ids: id учеников (None - все ученики)
+    status: только ученики с этим статусом
+    Returns: словарь {student_id: баланс}
+    """
+    if student_ids is None:
+        return _query_balances(None, status)
+    student_ids = sorted(set(student_ids))
+    balances = {}
+    for start in range(0, len(student_ids), BALANCE_QUERY_CHUNK):
+        balances.update(_query_balances(student_ids[start:start + BALANCE_QUERY_CHUNK], status))
+    return balances
+
+
+def _query_balances(student_ids, status=None):
+    # Итоги оплат и посещений берутся из student_ledger (строка по первичному ключу)
+    query = db.session.query(
+        Student.id, Student.balance, Tariff.price, Tariff.lessons_count,
+        StudentLedger.student_id, StudentLedger.total_paid, StudentLedger.lessons_attended
+    ).outerjoin(Tariff, Tariff.id == Student.tariff_id) \
+     .outerjoin(StudentLedger, StudentLedger.student_id == Student.id)
+    if student_ids is not None:
+        query = query.filter(Student.id.in_(student_ids))
+    if status is not None:
+        query = query.filter(Student.status == status)
+    rows = query.all()
+    
+    # Ученики без строки итогов (итоги ещё не заполнены) - по истории
+    missing = [row[0] for row in rows if row[4] is None]
+    history = history_totals(missing) if missing else {}
+    
+    balances = {}
+    for student_id, legacy_balance, price, lessons_count, ledger_id, total_paid, lessons_attended in rows:
+        if ledger_id is None:
+            total_paid, lessons_attended = history[student_id]
+        balances[student_id] = lesson_balance(total_paid, lessons_attended, price, lessons_count, legacy_balance)
+    return balances
+
+
+def check_in_students(students):
+    """
+    Отметить приход нескольких учеников одной транзакцией
+    (повторная отметка за день пропускается)
+    Returns: список словарей на каждого ученика: 'checked_in', баланс до и после, опоздание
+    """
+    students = list({s.id: s for s in students if s is not None}.values())
+    if not students:
+        return []
+    today = datetime.utcnow().date()
+    now = datetime.utcnow()
+    student_ids = [s.id for s in students]
+    
+    already = {row[0] for row in db.session.query(Attendance.student_id).filter(
+        Attendance.student_id.in_(student_ids),
+        Attendance.date == today
+    ).all()}
+    balances = calculate_student_balances(students)
+    group_ids = {s.group_id for s in students if s.group_id}
+    groups = {g.id: g for g in Group.query.filter(Group.id.in_(group_ids)).all()} if group_ids else {}
+    
+    results = []
+    for student in students:
+        result = {
+            'student_id': student.id,
+            'student_name': student.full_name,
+            'photo': student.photo_path,
+            'photo_url': student_photo_url(student, 'face'),
+            'club_funded': student.club_funded,
+            'balance': balances[student.id],
+            'checked_in': False,
+            'is_late': False,
+            'late_minutes': 0
+        }
+        results.append(result)
+        if student.id in already:
+            continue
+        
+        # Определить опоздание
+        group = groups.get(student.group_id)
+        if group and group.schedule_time:
+            scheduled_time = datetime.combine(today, group.schedule_time)
+            time_diff = (now - scheduled_time).total_seconds() / 60
+            if time_diff > group.late_threshold:
+                result['is_late'] = True
+                result['late_minutes'] = int(time_diff)
+        
+        db.session.add(Attendance(
+            student_id=student.id,
+            date=today,
+            lesson_deducted=not student.club_funded,
+            is_late=result['is_late'],
+            late_minutes=result['late_minutes']
+        ))
+        ledger_add(student.id, lessons=1)
+        result['checked_in'] = True
     
-    # Получаем стоимость одного занятия из тарифа
-    lesson_price = 0
-    if student.tariff_id:
-        tariff = Tariff.query.get(student.tariff_id)
-        if tariff and tariff.price and tariff.lessons_count and tariff.lessons_count > 0:
-            lesson_price = float(tariff.price) / float(tariff.lessons_count)
-    
-    if lesson_price <= 0:
-        # Если тариф не задан или некорректный, возвращаем старый баланс
-        return student.balance if student.balance else 0
-    
-    # Сумма всех оплат ученика
-    total_paid = db.session.query(db.func.sum(Payment.amount_paid)).filter(
-        Payment.student_id == student.id
-    ).scalar() or 0
-    
-    # Количество посещений (занятий)
-    attendance_count = Attendance.query.filter_by(student_id=student.id).count()
+    checked_ids = [s.id for s in students if s.id not in already]
     
-    # Баланс в занятиях = оплачено занятий - посещено занятий
-    paid_lessons = int(total_paid / lesson_price)
-    balance = paid_lessons - attendance_count
+    # Баланс рассчитывается динамически (оплачено занятий - посещено)
+    db.session.commit()
     
-    return balance
+    remaining = student_balances(checked_ids)
+    for result in results:
+        result['remaining_balance'] = remaining.get(result['student_id'], result['balance'])
+        # Проверка баланса: пропускаем даже при нуле/минусе, админ решает
+        result['low_balance'] = not result['club_funded'] and result['balance'] <= 0
+    return results
+
+
+def parse_month_param(value):
+    """Месяц из параметра 'YYYY-MM'; Returns: (год, месяц) или None; Raises: ValueError"""
+    if not value:
+        return None
+    year, month = (int(part) for part in value.split('-'))
+    if not 1 <= month <= 12:
+        raise ValueError(value)
+    return year, month
 
 
 def parse_days_list(raw_days):
@@ -184,6 +407,30 @@ def format_date(value, fmt='%d.%m.%Y'):
         return value
 
 
+def student_photo_url(student, variant='avatar'):
+    """
+    URL уменьшенной копии фото ученика (avatar, card или face, см. photo_variants.py);
+    пока копий нет - URL оригинала
+    """
+    filename = student.get_photo_variants().get(variant)
+    if filename:
+        return url_for('student_photo_variant', filename=filename)
+    if student.photo_path:
+        return url_for('static', filename=student.photo_path.replace('frontend/static/', '').replace('\\', '/').lstrip('/'))
+    return None
+
+
+app.jinja_env.globals['student_photo_url'] = student_photo_url
+
+
+@app.route('/photos/<filename>')
+def student_photo_variant(filename):
+    """Уменьшенная копия фото ученика (имя содержит хеш содержимого)"""
+    response = send_from_directory(VARIANTS_FOLDER, filename, max_age=PHOTO_CACHE_SECONDS)
+    response.headers['Cache-Control'] = f'public, max-age={PHOTO_CACHE_SECONDS}, immutable'
+    return response
+
+
 @app.context_processor
 def inject_system_name():
     """Добавляет название системы во все шаблоны"""
@@ -236,36 +483,57 @@ def logout():
 
 # ===== ГЛАВНАЯ ПАНЕЛЬ =====
 
+def compute_dashboard_summary():
+    """Цифры главной панели: два запроса при любом числе учеников"""
+    # Активные ученики и ученики с низким балансом (<= LOW_BALANCE_THRESHOLD занятий)
+    balances = student_balances(status='active')
+    
+    today = datetime.utcnow().date()
+    month_start = datetime.combine(today.replace(day=1), time.min)
+    today_attendance, month_income, month_expenses = db.session.query(
+        db.session.query(db.func.count(Attendance.id)).filter(Attendance.date == today).scalar_subquery(),
+        # Доходы за месяц
+        db.session.query(db.func.sum(Payment.amount_paid)).filter(
+            Payment.payment_date >= month_start
+        ).scalar_subquery(),
+        # Расходы за месяц
+        db.session.query(db.func.sum(Expense.amount)).filter(
+            Expense.expense_date >= month_start
+        ).scalar_subquery()
+    ).one()
+    month_income = month_income or 0
+    month_expenses = month_expenses or 0
+    
+    return {
+        'total_students': len(balances),
+        'students_low_balance': sum(1 for balance in balances.values() if balance <= LOW_BALANCE_THRESHOLD),
+        'today_attendance': today_attendance or 0,
+        'month_income': month_income,
+        'month_expenses': month_expenses,
+        'profit': month_income - month_expenses
+    }
+
+
+# Сводка сбрасывается коммитом, в котором изменились эти объекты (поля)
+dashboard_cache = SummaryCache(
+    'dashboard',
+    compute_dashboard_summary,
+    sources={
+        Payment: None,
+        Expense: None,
+        Attendance: None,
+        Student: ('status', 'tariff_id', 'balance'),
+        Tariff: ('price', 'lessons_count')
+    },
+    ttl=float(os.environ.get('DASHBOARD_CACHE_TTL', DEFAULT_SUMMARY_TTL))
+)
+dashboard_cache.watch(db.session)
+
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    # Статистика
-    total_students = Student.query.filter_by(status='active').count()
-    # Подсчет студентов с низким балансом (<=2 занятия)
-    active_students = Student.query.filter_by(status='active').all()
-    students_low_balance = sum(1 for s in active_students if calculate_student_balance(s) <= 2)
-    
-    today = datetime.utcnow().date()
-    today_attendance = Attendance.query.filter_by(date=today).count()
-    
-    # Доходы за месяц
-    month_start = datetime.utcnow().replace(day=1)
-    month_income = db.session.query(db.func.sum(Payment.amount_paid)).filter(
-        Payment.payment_date >= month_start
-    ).scalar() or 0
-    
-    # Расходы за месяц
-    month_expenses = db.session.query(db.func.sum(Expense.amount)).filter(
-        Expense.expense_date >= month_start
-    ).scalar() or 0
-    
-    return render_template('dashboard.html',
-                         total_students=total_students,
-                         students_low_balance=students_low_balance,
-                         today_attendance=today_attendance,
-                         month_income=month_income,
-                         month_expenses=month_expenses,
-                         profit=month_income - month_expenses)
+    return render_template('dashboard.html', **dashboard_cache.get())
 
 
 # ===== УЧЕНИКИ =====
@@ -274,8 +542,8 @@ def dashboard():
 @login_required
 def students():
     from datetime import date
-    all_students = Student.query.order_by(Student.full_name.asc()).all()
-    balances = {s.id: calculate_student_balance(s) for s in all_students}
+    all_students = Student.query.options(joinedload(Student.group)).order_by(Student.full_name.asc()).all()
+    balances = student_balances()
 
     latest_payment_subquery = db.session.query(
         Payment.student_id,
@@ -298,14 +566,11 @@ def students():
     # Подсчет баллов для текущего месяца
     current_month = date.today().month
     current_year = date.today().year
-    student_points = {}
-    for student in all_students:
-        total_points = db.session.query(func.sum(StudentReward.points)).filter(
-            StudentReward.student_id == student.id,
-            StudentReward.month == current_month,
-            StudentReward.year == current_year
-        ).scalar() or 0
-        student_points[student.id] = total_points
+    student_points = dict(db.session.query(StudentReward.student_id, func.sum(StudentReward.points)).filter(
+        StudentReward.month == current_month,
+        StudentReward.year == current_year
+    ).group_by(StudentReward.student_id).all())
+    student_points = {student.id: student_points.get(student.id) or 0 for student in all_students}
 
     return render_template('students.html',
                            students=all_students,
@@ -324,7 +589,7 @@ def groups_page():
 @login_required
 def get_students_list():
     """Возвращает всех учеников для фильтров"""
-    students = Student.query.order_by(Student.full_name.asc()).all()
+    students = Student.query.options(joinedload(Student.group)).order_by(Student.full_name.asc()).all()
     result = []
     for student in students:
         result.append({
@@ -335,11 +600,60 @@ def get_students_list():
             'group_name': student.group.name if student.group else None,
             'status': student.status,
             'photo_path': student.photo_path,
+            'photo_url': student_photo_url(student),
             'admission_date': student.admission_date.isoformat() if student.admission_date else None
         })
     return jsonify(result)
 
 
+@app.route('/api/students/watchlist', methods=['GET'])
+@login_required
+def students_watchlist():
+    """
+    Ученики, у которых заканчиваются занятия: баланс не выше порога (по умолчанию
+    LOW_BALANCE_THRESHOLD), по возрастанию баланса; фильтр group_id, страницы page/per_page.
+    Ученики за счёт клуба и неактивные не показываются.
+    """
+    threshold = request.args.get('threshold', LOW_BALANCE_THRESHOLD, type=int)
+    group_id = request.args.get('group_id', type=int)
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = min(max(1, request.args.get('per_page', WATCHLIST_PAGE_SIZE, type=int)), WATCHLIST_MAX_PAGE_SIZE)
+    
+    # Индекс по student_ledger.balance: сохранённый баланс обновляется вместе с оплатами и приходами
+    query = db.session.query(Student, StudentLedger.balance) \
+        .join(StudentLedger, StudentLedger.student_id == Student.id) \
+        .filter(
+            StudentLedger.balance <= threshold,
+            Student.status == 'active',
+            db.or_(Student.club_funded.is_(False), Student.club_funded.is_(None))
+        )
+    if group_id:
+        query = query.filter(Student.group_id == group_id)
+    
+    total = query.count()
+    rows = query.options(joinedload(Student.group)) \
+        .order_by(StudentLedger.balance.asc(), Student.full_name.asc()) \
+        .offset((page - 1) * per_page).limit(per_page).all()
+    
+    return jsonify({
+        'success': True,
+        'threshold': threshold,
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages': (total + per_page - 1) // per_page,
+        'students': [{
+            'student_id': student.id,
+            'student_name': student.full_name,
+            'group_id': student.group_id,
+            'group_name': student.group.name if student.group else None,
+            'parent_phone': student.parent_phone,
+            'balance': balance,
+            'photo_url': student_photo_url(student)
+        } for student, balance in rows]
+    })
+
+
 @app.route('/api/students/add', methods=['POST'])
 @login_required
 def add_student():
@@ -423,30 +737,84 @@ def add_student():
         )
         db.session.add(student)
         db.session.flush()
+        refresh_balances([student.id])
+        sync_month_dues([student.id])
         
-        # Сохранить фото и извлечь face encoding
+        # Сохранить фото; face encoding посчитает фоновая задача
         if photo:
-            photo_path = face_service.save_student_photo(photo, student.id)
-            student.photo_path = photo_path
-            
-            encoding = face_service.extract_face_encoding(photo_path)
-            if encoding is not None:
-                student.set_face_encoding(encoding)
-            else:
-                return jsonify({'success': False, 'message': 'Лицо не обнаружено на фото'}), 400
+            student.photo_path = face_service.save_student_photo(photo, student.id)
         
         db.session.commit()
         
-        # Перезагрузить encodings
-        reload_face_encodings()
+        job_id = None
+        if student.photo_path:
+            job_id = job_queue.submit('enroll_photo', enroll_student_photo, student.id, student.photo_path,
+                                      student_id=student.id)
         
-        return jsonify({'success': True, 'student_id': student.id, 'student_number': student_number})
+        return jsonify({'success': True, 'student_id': student.id, 'student_number': student_number, 'job_id': job_id})
     
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+@app.route('/api/students/import', methods=['POST'])
+@login_required
+def import_students():
+    """
+    Массовый импорт учеников: поле 'roster' - CSV-список, 'photos' - zip-архив с фотографиями.
+    Файлы проверяются сразу, сам импорт выполняется фоновой задачей (сотни фото не укладываются
+    в таймаут запроса); отчёт - в result задачи /api/jobs/<job_id>
+    """
+    try:
+        roster = request.files.get('roster')
+        if roster is None:
+            return jsonify({'success': False, 'message': 'Нет файла со списком учеников'}), 400
+        
+        rows = read_roster(roster.read())
+        photos_file = request.files.get('photos')
+        photos_data = photos_file.read() if photos_file else None
+        if photos_data is not None:
+            # Проверить архив до постановки задачи
+            PhotoSource(io.BytesIO(photos_data)).close()
+        batch_size = request.form.get('batch_size', type=int) or DEFAULT_IMPORT_BATCH_SIZE
+        
+        job_id = job_queue.submit('import_students', import_students_job, rows, photos_data, batch_size)
+        return jsonify({'success': True, 'total': len(rows), 'job_id': job_id}), 202
+    
+    except (ValueError, zipfile.BadZipFile) as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'Некорректный файл: {e}'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+def import_students_job(rows, photos_data, batch_size):
+    """Фоновая задача: импорт учеников; галерея распознавания перезагружается один раз в конце"""
+    photos = PhotoSource(io.BytesIO(photos_data)) if photos_data else None
+    importer = StudentImporter(
+        face_service,
+        workers=int(os.environ.get('IMPORT_WORKERS', 2)),
+        batch_size=batch_size,
+        # Каждая записанная пачка - отметка о ходе работы: живой долгий импорт не считается прерванным
+        on_progress=lambda done, total: job_queue.progress(f'Обработано {done} из {total}')
+    )
+    try:
+        report = importer.run(rows, photos)
+    finally:
+        if photos is not None:
+            photos.close()
+    
+    summary = summarize_report(report)
+    if summary['created']:
+        gallery_sync.invalidate()
+    return {
+        'message': f"Добавлено: {summary['created']}, уже есть: {summary['exists']}, ошибок: {summary['error']}",
+        'result': {'total': len(rows), **summary, 'rows': report}
+    }
+
+
 @app.route('/api/students/<int:student_id>', methods=['GET'])
 @login_required
 def get_student(student_id):
@@ -477,7 +845,8 @@ def get_student(student_id):
         'passport_expiry_date': student.passport_expiry_date.isoformat() if student.passport_expiry_date else None,
         'admission_date': student.admission_date.isoformat() if student.admission_date else None,
         'club_funded': student.club_funded,
-        'photo_path': student.photo_path
+        'photo_path': student.photo_path,
+        'photo_url': student_photo_url(student, 'card')
     })
 
 
@@ -486,6 +855,7 @@ def get_student(student_id):
 def update_student(student_id):
     try:
         student = Student.query.get_or_404(student_id)
+        old_status = student.status
         
         if 'student_number' in request.form:
             new_student_number = request.form['student_number'].strip()
@@ -559,12 +929,15 @@ def update_student(student_id):
         student.club_funded = 'club_funded' in request.form and request.form['club_funded'] == 'true'
         
         # Обработать новое фото (если загружено)
+        new_photo = False
         if 'photo' in request.files:
             photo = request.files['photo']
             if photo and photo.filename:
-                # Удалить старое фото
+                # Удалить старое фото и его копии (новые сделает фоновая задача)
                 if student.photo_path and os.path.exists(student.photo_path):
                     os.remove(student.photo_path)
+                remove_photo_variants(student.get_photo_variants())
+                student.set_photo_variants(None)
                 
                 # Сохранить новое фото
                 filename = secure_filename(photo.filename)
@@ -572,19 +945,26 @@ def update_student(student_id):
                 photo_path = os.path.join(UPLOAD_FOLDER, photo_filename)
                 photo.save(photo_path)
                 student.photo_path = photo_path
-                
-                # Создать новый face encoding
-                try:
-                    image = face_recognition.load_image_file(photo_path)
-                    encodings = face_recognition.face_encodings(image)
-                    if encodings:
-                        student.face_encoding = encodings[0].tobytes()
-                        reload_face_encodings()
-                except Exception as e:
-                    print(f"Ошибка обработки фото: {e}")
+                new_photo = True
+        
+        # Другой тариф - другая стоимость занятия
+        if 'tariff_id' in request.form:
+            refresh_balances([student.id])
+        # Цена тарифа и оплачиваемые месяцы - в помесячных начислениях
+        if any(field in request.form for field in ('tariff_id', 'admission_date', 'status')):
+            sync_month_dues([student.id])
         
         db.session.commit()
-        return jsonify({'success': True})
+        
+        # Смена статуса меняет только запись этого ученика в галерее;
+        # новый face encoding посчитает фоновая задача, остальные поля галерею не трогают
+        if student.status != old_status:
+            sync_student_face(student)
+        job_id = None
+        if new_photo:
+            job_id = job_queue.submit('enroll_photo', enroll_student_photo, student.id, student.photo_path,
+                                      student_id=student.id)
+        return jsonify({'success': True, 'job_id': job_id})
     
     except Exception as e:
         db.session.rollback()
@@ -597,12 +977,17 @@ def delete_student(student_id):
     try:
         student = Student.query.get_or_404(student_id)
         student_name = student.full_name
+        had_face = student_has_face(student)
+        variants = student.get_photo_variants()
         
         db.session.delete(student)
         db.session.commit()
+        remove_photo_variants(variants)
         
-        # Перезагрузить encodings
-        reload_face_encodings()
+        # Убрать ученика из галереи распознавания (и из галерей остальных процессов)
+        face_service.remove_student_encoding(student_id)
+        if had_face:
+            gallery_sync.changed()
         
         return jsonify({'success': True, 'message': f'Ученик {student_name} удалён'})
     
@@ -642,6 +1027,7 @@ def add_payment():
             created_by=current_user.id
         )
         db.session.add(payment)
+        ledger_add(student.id, paid=amount_paid)
         
         # Обновить тип тарифа при полной оплате
         if is_full_payment:
@@ -677,57 +1063,19 @@ def attendance_checkin():
         student_id = data.get('student_id')
         
         student = Student.query.get_or_404(student_id)
-        today = datetime.utcnow().date()
-        now = datetime.utcnow()
-        
-        # Проверить, был ли уже чекин сегодня
-        existing = Attendance.query.filter_by(
-            student_id=student_id,
-            date=today
-        ).first()
+        result = check_in_students([student])[0]
         
-        if existing:
+        if not result['checked_in']:
             return jsonify({'success': False, 'message': 'Уже отмечен сегодня'})
         
-        # Проверка баланса: пропускаем даже при нуле/минусе, админ решает
-        current_balance = calculate_student_balance(student)
-        low_balance = (not student.club_funded and current_balance <= 0)
-        
-        # Определить опоздание
-        is_late = False
-        late_minutes = 0
-        
-        if student.group_id:
-            group = db.session.get(Group, student.group_id)
-            if group and group.schedule_time:
-                scheduled_time = datetime.combine(today, group.schedule_time)
-                time_diff = (now - scheduled_time).total_seconds() / 60
-                
-                if time_diff > group.late_threshold:
-                    is_late = True
-                    late_minutes = int(time_diff)
-        
-        # Создать запись посещения
-        attendance = Attendance(
-            student_id=student_id,
-            date=today,
-            lesson_deducted=not student.club_funded,
-            is_late=is_late,
-            late_minutes=late_minutes
-        )
-        db.session.add(attendance)
-        
-        # Баланс теперь рассчитывается динамически (оплачено занятий - посещено)
-        db.session.commit()
-        
         return jsonify({
             'success': True,
             'student_name': student.full_name,
-            'remaining_balance': calculate_student_balance(student),
-            'is_late': is_late,
-            'late_minutes': late_minutes,
+            'remaining_balance': result['remaining_balance'],
+            'is_late': result['is_late'],
+            'late_minutes': result['late_minutes'],
             'club_funded': student.club_funded,
-            'low_balance': low_balance
+            'low_balance': result['low_balance']
         })
     
     except Exception as e:
@@ -740,16 +1088,16 @@ def attendance_checkin():
 def today_attendance():
     """Список присутствующих сегодня"""
     today = datetime.utcnow().date()
-    records = Attendance.query.filter_by(date=today).all()
+    records = Attendance.query.filter_by(date=today).options(
+        joinedload(Attendance.student).joinedload(Student.group)
+    ).all()
+    balances = student_balances([record.student_id for record in records])
     
     result = []
     for record in records:
-        photo_url = None
-        if record.student.photo_path:
-            normalized_path = record.student.photo_path.replace('frontend/static/', '').replace('\\', '/').lstrip('/')
-            photo_url = url_for('static', filename=normalized_path)
+        photo_url = student_photo_url(record.student)
         group_name = record.student.group.name if record.student.group else 'Без группы'
-        student_balance = calculate_student_balance(record.student)
+        student_balance = balances.get(record.student_id, 0)
         low_balance = (not record.student.club_funded) and (student_balance <= 0)
         result.append({
             'id': record.id,
@@ -812,7 +1160,11 @@ def all_attendance():
         query = query.filter(Student.group_id == int(group_id))
     
     # Сортировка по дате (сначала новые)
-    records = query.order_by(Attendance.check_in.desc()).all()
+    records = query.options(
+        joinedload(Attendance.student).joinedload(Student.group)
+    ).order_by(Attendance.check_in.desc()).all()
+    # Баланс считается один раз на ученика, а не на каждую запись
+    balances = student_balances({record.student_id for record in records})
     
     result = []
     for record in records:
@@ -822,7 +1174,7 @@ def all_attendance():
             'student_name': record.student.full_name,
             'group_name': record.student.group.name if record.student.group else None,
             'check_in_time': record.check_in.isoformat(),
-            'balance': calculate_student_balance(record.student)
+            'balance': balances.get(record.student_id, 0)
         })
     
     return jsonify(result)
@@ -930,6 +1282,7 @@ def delete_attendance(attendance_id):
     student = record.student
     
     db.session.delete(record)
+    ledger_add(student.id, lessons=-1)
     db.session.commit()
     
     # Баланс пересчитывается автоматически после удаления посещения
@@ -1121,6 +1474,11 @@ def teacher_mark_attendance():
         
         if not all([student_id, status, date_str]):
             return jsonify({'error': 'Недостаточно данных'}), 400
+        try:
+            # В JSON id может прийти строкой - в журнал занятий пишется число
+            student_id = int(student_id)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Некорректный ученик'}), 400
         
         # Проверить, существует ли уже запись на сегодня
         attendance_date = datetime.strptime(date_str, '%Y-%m-%d').date()
@@ -1142,6 +1500,7 @@ def teacher_mark_attendance():
                 check_in_time=datetime.now().time() if status == 'present' else None
             )
             db.session.add(attendance)
+            ledger_add(student_id, lessons=1)
         
         db.session.commit()
         
@@ -1237,77 +1596,78 @@ def get_income_stats():
 @app.route('/api/finances/debtors', methods=['GET'])
 @login_required
 def get_debtors():
-    """Список должников с помесячной детализацией"""
-    from datetime import date, datetime
-    from sqlalchemy import func, extract
+    """
+    Список должников с помесячной детализацией
+    Фильтры: group_id, from/to (месяцы 'YYYY-MM'), min_debt; страницы page/per_page.
+    Остатки по месяцам берутся из student_month_dues (строки текущего месяца создаются при первом запросе).
+    """
+    try:
+        group_id = request.args.get('group_id', type=int)
+        range_start = parse_month_param(request.args.get('from'))
+        range_end = parse_month_param(request.args.get('to'))
+        min_debt = request.args.get('min_debt', 0, type=float)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Месяц указывается в формате YYYY-MM'}), 400
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = min(max(1, request.args.get('per_page', DEBTORS_PAGE_SIZE, type=int)), DEBTORS_MAX_PAGE_SIZE)
     
-    # Получить всех активных учеников с тарифами
-    students = Student.query.filter(
+    ensure_current_month()
+    today = date.today()
+    current = (today.year, today.month)
+    if range_end is None or range_end > current:
+        range_end = current
+    
+    # Месяцы с остатком к оплате активных учеников с тарифом - по индексу student_month_dues,
+    # с месяца принятия (без даты - с января текущего года)
+    period = month_period(StudentMonthDue.year, StudentMonthDue.month)
+    dues_query = db.session.query(StudentMonthDue).join(
+        Student, Student.id == StudentMonthDue.student_id
+    ).join(Tariff, Tariff.id == Student.tariff_id).filter(
         Student.status == 'active',
-        Student.tariff_id.isnot(None)
-    ).all()
-    
-    current_year = date.today().year
-    current_month = date.today().month
-    
-    debtors_list = []
-    total_debt = 0
-    
-    for student in students:
-        if not student.tariff:
-            continue
-            
-        tariff_price = float(student.tariff.price)
-        
-        # Определить с какого месяца начинать проверку
-        if student.admission_date:
-            start_year = student.admission_date.year
-            start_month = student.admission_date.month
-        else:
-            start_year = current_year
-            start_month = 1
-        
-        # Проверить каждый месяц от даты принятия до текущего месяца
-        year = start_year
-        month = start_month
-        
-        while (year < current_year) or (year == current_year and month <= current_month):
-            month_key = f"{year}-{str(month).zfill(2)}"
-            
-            # Получить платежи за этот месяц
-            month_payments = Payment.query.filter(
-                Payment.student_id == student.id,
-                Payment.payment_year == year,
-                Payment.payment_month == month
-            ).all()
-            
-            total_paid = sum(p.amount_paid for p in month_payments)
-            debt = max(0, tariff_price - total_paid)
-            
-            if debt > 0:
-                total_debt += debt
-                debtors_list.append({
-                    'student_id': student.id,
-                    'student_name': student.full_name,
-                    'student_phone': student.phone or student.parent_phone or '-',
-                    'tariff_name': student.tariff.name,
-                    'tariff_price': tariff_price,
-                    'amount_paid': total_paid,
-                    'amount_due': debt,
-                    'month': month,
-                    'year': year,
-                    'month_label': f"{month}/{year}"
-                })
-            
-            # Следующий месяц
-            month += 1
-            if month > 12:
-                month = 1
-                year += 1
+        StudentMonthDue.remainder > 0,
+        period <= range_end[0] * 12 + range_end[1],
+        period >= billable_start_period(Student.admission_date, today)
+    )
+    if group_id:
+        dues_query = dues_query.filter(Student.group_id == group_id)
+    if range_start is not None:
+        dues_query = dues_query.filter(period >= range_start[0] * 12 + range_start[1])
+    if min_debt > 0:
+        dues_query = dues_query.filter(StudentMonthDue.remainder >= min_debt)
+    
+    # Итоги - одним агрегатом, строки - только текущей страницы
+    total, total_debt, students_count = dues_query.with_entities(
+        db.func.count(),
+        db.func.sum(StudentMonthDue.remainder),
+        db.func.count(db.distinct(StudentMonthDue.student_id))
+    ).one()
+    rows = dues_query.with_entities(
+        Student.id, Student.full_name, Student.phone, Student.parent_phone, Tariff.name, Tariff.price,
+        StudentMonthDue.year, StudentMonthDue.month, StudentMonthDue.paid, StudentMonthDue.remainder
+    ).order_by(
+        Student.full_name.asc(), Student.id.asc(), StudentMonthDue.year.asc(), StudentMonthDue.month.asc()
+    ).limit(per_page).offset((page - 1) * per_page).all()
+    
+    debtors_list = [{
+        'student_id': student_id,
+        'student_name': full_name,
+        'student_phone': phone or parent_phone or '-',
+        'tariff_name': tariff_name,
+        'tariff_price': float(tariff_price or 0),
+        'amount_paid': total_paid,
+        'amount_due': debt,
+        'month': month,
+        'year': year,
+        'month_label': f"{month}/{year}"
+    } for student_id, full_name, phone, parent_phone, tariff_name, tariff_price, year, month, total_paid, debt in rows]
     
     return jsonify({
-        'total_debt': total_debt,
-        'count': len(debtors_list),
+        'total_debt': total_debt or 0,
+        'count': total,
+        'students_count': students_count,
+        'page': page,
+        'per_page': per_page,
+        'pages': (total + per_page - 1) // per_page,
         'debtors': debtors_list
     })
 
@@ -1782,6 +2142,13 @@ def update_tariff(tariff_id):
         if 'description' in data:
             tariff.description = data['description']
         
+        # Пересчитать балансы учеников на этом тарифе
+        if 'lessons_count' in data or 'price' in data:
+            student_ids = [row[0] for row in db.session.query(Student.id).filter_by(tariff_id=tariff.id).all()]
+            refresh_balances(student_ids)
+            if 'price' in data:
+                sync_month_dues(student_ids)
+        
         db.session.commit()
         return jsonify({'success': True})
     except Exception as e:
@@ -2094,6 +2461,7 @@ def get_group_rating(group_id):
                     'student_id': student.id,
                     'full_name': student.full_name,
                     'photo_path': student.photo_path,
+                    'photo_url': student_photo_url(student),
                     'points': total_points
                 })
         
@@ -2143,6 +2511,7 @@ def get_all_groups_rating():
                         'student_id': student.id,
                         'full_name': student.full_name,
                         'photo_path': student.photo_path,
+                        'photo_url': student_photo_url(student),
                         'points': total_points
                     })
             
@@ -2201,6 +2570,7 @@ def get_winners_history():
                             'student_id': student.id,
                             'full_name': student.full_name,
                             'photo_path': student.photo_path,
+                            'photo_url': student_photo_url(student),
                             'points': total_points
                         })
                 
@@ -2255,82 +2625,373 @@ def get_districts_list(city):
 @login_required
 def camera_page():
     """Страница с камерой для распознавания"""
-    return render_template('camera.html')
+    groups = Group.query.order_by(Group.name.asc()).all()
+    return render_template('camera.html', groups=groups)
+
+
+def timed_recognition(endpoint):
+    """
+    Замер этапов эндпоинта распознавания: StageTimer доступен во view как g.recognition_timer,
+    итог попадает в recognition_metrics и - если включено или запрошено заголовком
+    X-Recognition-Timing - в одноимённый заголовок ответа
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g.recognition_timer = StageTimer()
+            response = make_response(view(*args, **kwargs))
+            timer = g.recognition_timer
+            recognition_metrics.record(endpoint, timer)
+            if RECOGNITION_TIMING_HEADER or request.headers.get('X-Recognition-Timing'):
+                response.headers['X-Recognition-Timing'] = timer.header_value()
+            return response
+        return wrapper
+    return decorator
+
+
+def read_uploaded_image():
+    """
+    Прочитать кадр камеры из запроса целиком в памяти (без временных файлов).
+    По умолчанию поле 'image' - JPEG/PNG. При pixel_format=rgb|rgba в форме
+    поле 'image' содержит несжатые пиксели размера width x height.
+    Returns: payload для decode_frame_payload или None, если изображения нет
+    """
+    image_file = request.files.get('image')
+    if image_file is None:
+        return None
+    
+    return {
+        'data': image_file.read(),
+        'pixel_format': request.form.get('pixel_format') or None,
+        'width': request.form.get('width', type=int),
+        'height': request.form.get('height', type=int)
+    }
+
+
+def recognition_busy_response(error):
+    """Ответ при перегрузке пула распознавания: камера просто пришлёт следующий кадр"""
+    return jsonify({'success': False, 'busy': True, 'message': str(error)}), 503
+
+
+def frame_unchanged_response(error):
+    """Ответ на кадр, не изменившийся с последнего обработанного"""
+    return jsonify({'success': False, 'unchanged': True, 'message': str(error)})
 
 
 @app.route('/api/recognize', methods=['POST'])
+@timed_recognition('recognize')
 def recognize_face():
     """Распознать лицо из кадра камеры"""
+    timer = g.recognition_timer
     try:
-        # Получить изображение (base64 или файл)
-        if 'image' in request.files:
-            image_file = request.files['image']
-            temp_path = os.path.join(app.config['UPLOAD_FOLDER'], 'temp_recognize.jpg')
-            image_file.save(temp_path)
-            
-            student_id = face_service.recognize_face_from_image(temp_path)
-            os.remove(temp_path)
-            
-            if student_id:
-                student = Student.query.get(student_id)
-                return jsonify({
-                    'success': True,
-                    'student_id': student.id,
-                    'student_name': student.full_name,
-                    'balance': calculate_student_balance(student),
-                    'photo': student.photo_path
-                })
-            else:
-                return jsonify({'success': False, 'message': 'Лицо не распознано'})
-        
-        return jsonify({'success': False, 'message': 'Нет изображения'}), 400
+        with timer.stage('upload'):
+            payload = read_uploaded_image()
+        if payload is None:
+            return jsonify({'success': False, 'message': 'Нет изображения'}), 400
+        
+        gallery_sync.ensure()
+        recognized = recognition_executor.recognize(payload, roi=parse_roi(request.form.get('roi')), timer=timer)
+        
+        if recognized:
+            with timer.stage('students'):
+                student = Student.query.get(recognized[0]['student_id'])
+            with timer.stage('balance'):
+                balance = calculate_student_balance(student)
+            return jsonify({
+                'success': True,
+                'student_id': student.id,
+                'student_name': student.full_name,
+                'balance': balance,
+                'photo': student.photo_path,
+                'photo_url': student_photo_url(student, 'face')
+            })
+        else:
+            return jsonify({'success': False, 'message': 'Лицо не распознано'})
     
+    except RecognitionBusy as e:
+        return recognition_busy_response(e)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
 @app.route('/api/recognize_multiple', methods=['POST'])
+@timed_recognition('recognize_multiple')
 def recognize_multiple_faces():
     """Распознать несколько лиц из кадра камеры"""
+    timer = g.recognition_timer
     try:
-        if 'image' in request.files:
-            image_file = request.files['image']
-            temp_path = os.path.join(app.config['UPLOAD_FOLDER'], 'temp_recognize.jpg')
-            image_file.save(temp_path)
-            
-            recognized = face_service.recognize_multiple_faces_from_image(temp_path)
-            os.remove(temp_path)
+        with timer.stage('upload'):
+            payload = read_uploaded_image()
+        if payload is None:
+            return jsonify({'success': False, 'message': 'Нет изображения'}), 400
+        
+        gallery_sync.ensure()
+        recognized = recognition_executor.recognize(
+            payload,
+            roi=parse_roi(request.form.get('roi')),
+            camera_id=request.form.get('camera_id'),
+            timer=timer
+        )
+        
+        if len(recognized) > 0:
+            student_ids = [item['student_id'] for item in recognized]
+            with timer.stage('students'):
+                students = {s.id: s for s in Student.query.filter(Student.id.in_(student_ids)).all()}
+            with timer.stage('balance'):
+                balances = student_balances(students.keys())
+            students_data = []
+            for item in recognized:
+                student = students.get(item['student_id'])
+                if student:
+                    students_data.append({
+                        'student_id': student.id,
+                        'student_name': student.full_name,
+                        'balance': balances[student.id],
+                        'photo': student.photo_path,
+                        'photo_url': student_photo_url(student, 'face')
+                    })
             
-            if len(recognized) > 0:
-                students_data = []
-                for item in recognized:
-                    student = Student.query.get(item['student_id'])
-                    if student:
-                        students_data.append({
-                            'student_id': student.id,
-                            'student_name': student.full_name,
-                            'balance': calculate_student_balance(student),
-                            'photo': student.photo_path
-                        })
-                
-                return jsonify({
-                    'success': True,
-                    'count': len(students_data),
-                    'students': students_data
+            return jsonify({
+                'success': True,
+                'count': len(students_data),
+                'students': students_data
+            })
+        else:
+            return jsonify({'success': False, 'message': 'Лица не распознаны'})
+    
+    except RecognitionBusy as e:
+        return recognition_busy_response(e)
+    except FrameUnchanged as e:
+        return frame_unchanged_response(e)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/api/recognize_burst', methods=['POST'])
+@timed_recognition('recognize_burst')
+def recognize_burst():
+    """
+    Распознать серию кадров (поле 'images', 3-5 снимков подряд):
+    ученик засчитывается, если опознан в нескольких кадрах или с высокой уверенностью
+    """
+    timer = g.recognition_timer
+    try:
+        with timer.stage('upload'):
+            image_files = request.files.getlist('images')
+            payloads = [{'data': image_file.read()} for image_file in image_files[:BURST_MAX_FRAMES]]
+        if not image_files:
+            return jsonify({'success': False, 'message': 'Нет изображений'}), 400
+        if len(image_files) > BURST_MAX_FRAMES:
+            return jsonify({'success': False, 'message': f'Не больше {BURST_MAX_FRAMES} кадров в серии'}), 400
+        
+        gallery_sync.ensure()
+        recognized = recognition_executor.recognize_burst(
+            payloads, roi=parse_roi(request.form.get('roi')), timer=timer
+        )
+        
+        student_ids = [item['student_id'] for item in recognized]
+        students = {}
+        balances = {}
+        if student_ids:
+            with timer.stage('students'):
+                students = {s.id: s for s in Student.query.filter(Student.id.in_(student_ids)).all()}
+            with timer.stage('balance'):
+                balances = student_balances(students.keys())
+        students_data = []
+        for item in recognized:
+            student = students.get(item['student_id'])
+            if student:
+                students_data.append({
+                    'student_id': student.id,
+                    'student_name': student.full_name,
+                    'balance': balances[student.id],
+                    'photo': student.photo_path,
+                    'photo_url': student_photo_url(student, 'face'),
+                    'votes': item['votes'],
+                    'distance': round(item['distance'], 4)
                 })
-            else:
-                return jsonify({'success': False, 'message': 'Лица не распознаны'})
         
-        return jsonify({'success': False, 'message': 'Нет изображения'}), 400
+        if students_data:
+            return jsonify({
+                'success': True,
+                'count': len(students_data),
+                'frames': len(payloads),
+                'students': students_data
+            })
+        else:
+            return jsonify({'success': False, 'message': 'Лица не распознаны'})
+    
+    except RecognitionBusy as e:
+        return recognition_busy_response(e)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/api/recognize_checkin', methods=['POST'])
+@timed_recognition('recognize_checkin')
+def recognize_checkin():
+    """
+    Распознать лица кадра и сразу отметить приход всех опознанных учеников
+    (один запрос с киоска вместо распознавания и отдельной отметки каждого)
+    """
+    timer = g.recognition_timer
+    try:
+        with timer.stage('upload'):
+            payload = read_uploaded_image()
+        if payload is None:
+            return jsonify({'success': False, 'message': 'Нет изображения'}), 400
+        
+        gallery_sync.ensure()
+        recognized = recognition_executor.recognize(
+            payload,
+            roi=parse_roi(request.form.get('roi')),
+            camera_id=request.form.get('camera_id'),
+            timer=timer
+        )
+        if not recognized:
+            return jsonify({'success': False, 'message': 'Лица не распознаны'})
+        
+        with timer.stage('students'):
+            student_ids = {item['student_id'] for item in recognized}
+            students = Student.query.filter(Student.id.in_(student_ids)).all()
+        with timer.stage('checkin'):
+            results = check_in_students(students)
+        
+        return jsonify({
+            'success': True,
+            'count': len(results),
+            'checked_in': sum(1 for r in results if r['checked_in']),
+            'students': results
+        })
     
+    except RecognitionBusy as e:
+        return recognition_busy_response(e)
+    except FrameUnchanged as e:
+        return frame_unchanged_response(e)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
+        db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+@app.route('/api/recognition/stats')
+@login_required
+def recognition_stats():
+    """
+    Состояние распознавания: пул, индекс галереи, камеры (треки, пропущенные кадры)
+    и скользящие перцентили времени этапов (мс) в этом процессе
+    """
+    return jsonify({
+        'success': True,
+        'executor': recognition_executor.stats(),
+        'index': face_service.index_stats(),
+        'cameras': {camera_id: tracker.stats() for camera_id, tracker in face_service.camera_sessions.items()},
+        'gallery': gallery_sync.stats(),
+        'modules_loaded': recognition_modules_loaded(),
+        'latency': recognition_metrics.snapshot()
+    })
+
+
 def reload_face_encodings():
-    """Перезагрузить все face encodings в память"""
-    students = Student.query.filter_by(status='active').all()
-    face_service.load_student_encodings(students)
+    """Перезагрузить все face encodings в память одним запросом (без разбора JSON)"""
+    rows = db.session.query(Student.id, Student.face_encoding_bin, Student.face_encoding).filter(
+        Student.status == 'active',
+        db.or_(Student.face_encoding_bin.isnot(None), Student.face_encoding.isnot(None))
+    ).all()
+    
+    student_ids = []
+    blobs = []
+    legacy_encodings = []
+    for student_id, blob, legacy_value in rows:
+        if blob is not None:
+            student_ids.append(student_id)
+            blobs.append(blob)
+        else:
+            # Запись ещё не мигрирована (см. migrate_face_encodings.py)
+            encoding = decode_legacy_face_encoding(legacy_value)
+            if encoding is not None:
+                legacy_encodings.append((student_id, encoding))
+    
+    face_service.load_encoding_blobs(student_ids, blobs, legacy_encodings)
+
+
+# Галерея загружается в процесс при первом распознавании: из снимка на диске (mmap)
+# той версии, что записана в БД, или - если снимка нет - из БД с записью снимка
+gallery_sync = GallerySync(
+    face_service,
+    GallerySnapshotStore(os.environ.get('FACE_GALLERY_DIR') or os.path.join(basedir, 'database', 'face_gallery')),
+    rebuild=reload_face_encodings,
+    check_interval=float(os.environ.get('FACE_GALLERY_CHECK_INTERVAL', 5))
+)
+
+
+def enroll_student_photo(student_id, photo_path):
+    """
+    Фоновая задача: посчитать face encoding и уменьшенные копии сохранённого фото ученика
+    (в процессе пула задач) и обновить запись ученика в галерее
+    """
+    with open(photo_path, 'rb') as f:
+        data = f.read()
+    encoding, error, rendered = job_queue.run_in_process(process_photo, data)
+    
+    student = db.session.get(Student, student_id)
+    if student is None:
+        raise JobFailed('Ученик удалён')
+    if student.photo_path != photo_path:
+        # Пока задача считалась, загрузили другое фото - его обработает своя задача
+        return {'message': 'Фото заменено более новым'}
+    if rendered:
+        # Копии для интерфейса нужны, даже если лицо не найдено
+        old_variants = student.get_photo_variants()
+        variants = save_photo_variants(rendered, student.id, photo_digest(data))
+        student.set_photo_variants(variants)
+        db.session.commit()
+        remove_photo_variants(old_variants, keep=variants)
+    if error:
+        raise JobFailed(error)
+    
+    student.set_face_encoding(encoding)
+    db.session.commit()
+    sync_student_face(student)
+    return {'message': 'Лицо добавлено в распознавание'}
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    """Состояние фоновой задачи"""
+    job = JobQueue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Задача не найдена'}), 404
+    return jsonify({'success': True, 'job': job})
+
+
+def sync_student_face(student):
+    """
+    Обновить запись одного ученика в галерее без полной перезагрузки:
+    активный ученик с encoding добавляется/заменяется, остальные (inactive, blacklist) удаляются
+    """
+    encoding = student.get_face_encoding() if student.status == 'active' else None
+    if encoding is not None:
+        face_service.upsert_student_encoding(student.id, encoding)
+    else:
+        face_service.remove_student_encoding(student.id)
+        if not student_has_face(student):
+            # Ученика без encoding нет ни в одной галерее - версию поднимать незачем
+            return
+    gallery_sync.changed()
+
+
+def student_has_face(student):
+    """Сохранён ли у ученика face encoding (в любом формате)"""
+    return student.face_encoding_bin is not None or bool(student.face_encoding)
 
 
 # ===== ИНИЦИАЛИЗАЦИЯ =====
@@ -2339,6 +3000,7 @@ def init_db():
     """Создать таблицы и первого админа"""
     with app.app_context():
         db.create_all()
+        ensure_student_columns()
         
         # Проверить, есть ли админ
         admin = User.query.filter_by(username='admin').first()
@@ -2352,8 +3014,17 @@ def init_db():
             db.session.commit()
             print("Создан администратор: admin / admin123")
         
-        # Загрузить encodings
-        reload_face_encodings()
+        # Заполнить итоги балансов при первом запуске после обновления
+        if ledger_needs_rebuild():
+            rebuild_ledger()
+        if month_dues_need_rebuild():
+            rebuild_month_dues()
+        
+        # Потоки фоновых задач не пережили перезапуск сервера
+        fail_stale_jobs(all_jobs=True)
+        
+        # Загрузить галерею (из снимка, если он соответствует версии в БД)
+        gallery_sync.ensure()
 
 
 # ===== ПОМЕСЯЧНЫЕ ОПЛАТЫ =====
@@ -2372,12 +3043,20 @@ def get_monthly_payments(student_id):
         
         # Получить все платежи ученика с метаданными месяца
         payments = Payment.query.filter_by(student_id=student_id).order_by(Payment.payment_date.desc()).all()
+        # Суммы по payment_month/payment_year - из помесячных начислений
+        month_totals = {
+            f"{year}-{str(month).zfill(2)}": paid
+            for year, month, paid in db.session.query(
+                StudentMonthDue.year, StudentMonthDue.month, StudentMonthDue.paid
+            ).filter(StudentMonthDue.student_id == student_id).all()
+        }
         
         # Группировать по месяцам используя payment_month и payment_year
         payments_by_month = {}
         for payment in payments:
             # Использовать payment_month/payment_year если есть, иначе брать из payment_date
-            if payment.payment_month and payment.payment_year:
+            by_month = bool(payment.payment_month and payment.payment_year)
+            if by_month:
                 month_key = f"{payment.payment_year}-{str(payment.payment_month).zfill(2)}"
             elif payment.payment_date:
                 month_key = payment.payment_date.strftime('%Y-%m')
@@ -2387,7 +3066,7 @@ def get_monthly_payments(student_id):
             if month_key not in payments_by_month:
                 payments_by_month[month_key] = {
                     'payments': [],
-                    'total_paid': 0,
+                    'total_paid': float(month_totals.get(month_key, 0)),
                     'tariff_price': tariff_price,
                     'remainder': tariff_price
                 }
@@ -2398,7 +3077,8 @@ def get_monthly_payments(student_id):
                 'amount': float(payment.amount_paid),
                 'notes': payment.notes or ''
             })
-            payments_by_month[month_key]['total_paid'] += float(payment.amount_paid)
+            if not by_month:
+                payments_by_month[month_key]['total_paid'] += float(payment.amount_paid)
         
         # Рассчитать остаток для каждого месяца
         for month_key in payments_by_month:
@@ -2444,11 +3124,7 @@ def add_monthly_payment():
             tariff_price = float(tariff.price) if tariff and tariff.price is not None else None
 
         if tariff_price is not None:
-            existing_paid = db.session.query(db.func.sum(Payment.amount_paid)).filter(
-                Payment.student_id == student_id,
-                Payment.payment_year == year,
-                Payment.payment_month == month
-            ).scalar() or 0
+            existing_paid = month_paid(student_id, year, month)
             if existing_paid + amount > tariff_price:
                 remainder = max(0, tariff_price - existing_paid)
                 return jsonify({
@@ -2473,6 +3149,8 @@ def add_monthly_payment():
         )
         
         db.session.add(payment)
+        ledger_add(student.id, paid=amount)
+        dues_add(student.id, year, month, amount)
         db.session.commit()
         
         return jsonify({
@@ -2511,16 +3189,17 @@ def update_payment(payment_id):
                 tariff_obj = Tariff.query.get(payment.tariff_id)
                 tariff_price = float(tariff_obj.price) if tariff_obj and tariff_obj.price is not None else None
             if tariff_price is not None:
-                existing_paid = db.session.query(db.func.sum(Payment.amount_paid)).filter(
-                    Payment.student_id == payment.student_id,
-                    Payment.payment_year == payment.payment_year,
-                    Payment.payment_month == payment.payment_month,
-                    Payment.id != payment.id
-                ).scalar() or 0
+                existing_paid = 0
+                if payment.payment_year and payment.payment_month:
+                    existing_paid = month_paid(payment.student_id, payment.payment_year, payment.payment_month) \
+                        - (payment.amount_paid or 0)
                 if existing_paid + new_amount > tariff_price:
                     remainder = max(0, tariff_price - existing_paid)
                     return jsonify({'success': False, 'message': f'Сумма превышает стоимость тарифа. Доступно не более {remainder:.0f} сум'}), 400
+            old_amount = payment.amount_paid or 0
             payment.amount_paid = new_amount
+            ledger_add(payment.student_id, paid=new_amount - old_amount)
+            dues_add(payment.student_id, payment.payment_year, payment.payment_month, new_amount - old_amount)
 
         if 'payment_date' in data and data.get('payment_date'):
             payment.payment_date = datetime.fromisoformat(data.get('payment_date'))
@@ -2549,6 +3228,8 @@ def delete_payment(payment_id):
 
         student = payment.student
         db.session.delete(payment)
+        ledger_add(payment.student_id, paid=-(payment.amount_paid or 0))
+        dues_add(payment.student_id, payment.payment_year, payment.payment_month, -(payment.amount_paid or 0))
         db.session.commit()
 
         return jsonify({
@@ -0,0 +1,91 @@
+"""
+Бинарный формат хранения face encoding
+
+Запись фиксированного размера: 8-байтовый заголовок + 128 float32 (little-endian).
+Заголовок: магия b'FE', версия формата, код типа данных, размерность, 2 байта выравнивания.
+"""
+import json
+import struct
+
+import numpy as np
+
+# Размерность face encoding (dlib ResNet)
+ENCODING_DIM = 128
+
+MAGIC = b'FE'
+FORMAT_VERSION = 1
+DTYPE_FLOAT32_LE = 1
+
+HEADER = struct.Struct('<2sBBH2x')
+HEADER_BYTES = HEADER.pack(MAGIC, FORMAT_VERSION, DTYPE_FLOAT32_LE, ENCODING_DIM)
+RECORD_SIZE = HEADER.size + ENCODING_DIM * 4
+
+
+def encode_face_encoding(encoding):
+    """Упаковать encoding в бинарную запись фиксированного размера"""
+    vector = np.asarray(encoding, dtype='<f4').reshape(-1)
+    if vector.size != ENCODING_DIM:
+        raise ValueError(f'Ожидался encoding из {ENCODING_DIM} чисел, получено {vector.size}')
+    return HEADER_BYTES + vector.tobytes()
+
+
+def decode_face_encoding(blob):
+    """
+    Распаковать бинарную запись
+    Returns: numpy array float32 (128,) или None, если запись повреждена
+    """
+    if blob is None:
+        return None
+    blob = bytes(blob)
+    if len(blob) != RECORD_SIZE or blob[:HEADER.size] != HEADER_BYTES:
+        return None
+    return np.frombuffer(blob, dtype='<f4', offset=HEADER.size).astype(np.float32)
+
+
+def decode_legacy_face_encoding(value):
+    """
+    Прочитать encoding в старых форматах:
+    JSON-строка со списком чисел или сырые байты numpy (float64/float32) без заголовка
+    Returns: numpy array float32 (128,) или None
+    """
+    if value is None:
+        return None
+    try:
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            raw = bytes(value)
+            if len(raw) == ENCODING_DIM * 8:
+                return np.frombuffer(raw, dtype='<f8').astype(np.float32)
+            if len(raw) == ENCODING_DIM * 4:
+                return np.frombuffer(raw, dtype='<f4').astype(np.float32)
+            value = raw.decode('utf-8')
+        data = json.loads(value)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    vector = np.asarray(data, dtype=np.float32).reshape(-1)
+    return vector if vector.size == ENCODING_DIM else None
+
+
+def stack_face_encodings(blobs):
+    """
+    Собрать матрицу галереи из списка бинарных записей одним np.frombuffer
+    Returns: (матрица float32 N x 128, булева маска корректных записей длины len(blobs))
+    """
+    count = len(blobs)
+    if count == 0:
+        return np.empty((0, ENCODING_DIM), dtype=np.float32), np.zeros(0, dtype=bool)
+
+    joined = b''.join(bytes(b) if b is not None else b'' for b in blobs)
+    if len(joined) != count * RECORD_SIZE:
+        # Есть записи нестандартной длины - разбираем по одной
+        decoded = [decode_face_encoding(b) for b in blobs]
+        valid = np.array([d is not None for d in decoded], dtype=bool)
+        rows = [d for d in decoded if d is not None]
+        matrix = np.vstack(rows) if rows else np.empty((0, ENCODING_DIM), dtype=np.float32)
+        return matrix, valid
+
+    records = np.frombuffer(joined, dtype=np.uint8).reshape(count, RECORD_SIZE)
+    header = np.frombuffer(HEADER_BYTES, dtype=np.uint8)
+    valid = (records[:, :HEADER.size] == header).all(axis=1)
+    payload = np.ascontiguousarray(records[valid, HEADER.size:])
+    matrix = payload.view('<f4').astype(np.float32, copy=False).reshape(-1, ENCODING_DIM)
+    return matrix, valid
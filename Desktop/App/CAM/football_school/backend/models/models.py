@@ -3,6 +3,8 @@ from flask_login import UserMixin
 from datetime import datetime, time
 import json
 
+from backend.models.face_encoding import encode_face_encoding, decode_face_encoding, decode_legacy_face_encoding
+
 db = SQLAlchemy()
 
 class User(UserMixin, db.Model):
@@ -118,7 +120,9 @@ class Student(db.Model):
     phone = db.Column(db.String(20))
     parent_phone = db.Column(db.String(20))
     photo_path = db.Column(db.String(300))
-    face_encoding = db.Column(db.Text)  # JSON строка с encoding лица
+    photo_variants = db.Column(db.Text)  # JSON: уменьшенные копии фото (см. backend/services/photo_variants.py)
+    face_encoding = db.Column(db.Text)  # Устаревший формат: JSON строка с encoding лица
+    face_encoding_bin = db.Column(db.LargeBinary)  # Бинарный encoding лица (см. backend/models/face_encoding.py)
     balance = db.Column(db.Integer, default=0)  # Оставшиеся занятия
     tariff_type = db.Column(db.String(50))  # Например: "8 занятий"
     tariff_id = db.Column(db.Integer, db.ForeignKey('tariffs.id'), nullable=True)  # Связь с тарифом
@@ -152,17 +156,35 @@ class Student(db.Model):
     payments = db.relationship('Payment', backref='student', lazy=True, cascade='all, delete-orphan')
     attendances = db.relationship('Attendance', backref='student', lazy=True, cascade='all, delete-orphan')
     tariff = db.relationship('Tariff', backref='students', lazy=True)
+    ledger = db.relationship('StudentLedger', uselist=False, lazy=True, cascade='all, delete-orphan')
+    month_dues = db.relationship('StudentMonthDue', lazy=True, cascade='all, delete-orphan')
     
     def get_face_encoding(self):
         """Получить face encoding как numpy array"""
+        if self.face_encoding_bin:
+            return decode_face_encoding(self.face_encoding_bin)
         if self.face_encoding:
-            return json.loads(self.face_encoding)
+            return decode_legacy_face_encoding(self.face_encoding)
         return None
     
     def set_face_encoding(self, encoding):
-        """Сохранить face encoding"""
+        """Сохранить face encoding в бинарном формате"""
         if encoding is not None:
-            self.face_encoding = json.dumps(encoding.tolist())
+            self.face_encoding_bin = encode_face_encoding(encoding)
+            self.face_encoding = None
+    
+    def get_photo_variants(self):
+        """Получить уменьшенные копии фото: {'digest': хеш оригинала, 'avatar': имя файла, ...}"""
+        if not self.photo_variants:
+            return {}
+        try:
+            return json.loads(self.photo_variants)
+        except Exception:
+            return {}
+    
+    def set_photo_variants(self, variants):
+        """Сохранить уменьшенные копии фото как JSON"""
+        self.photo_variants = json.dumps(variants, ensure_ascii=False) if variants else None
     
     def __repr__(self):
         return f'<Student {self.full_name}>'
@@ -306,3 +328,92 @@ class CashTransfer(db.Model):
     
     def __repr__(self):
         return f'<CashTransfer {self.amount} to {self.recipient} on {self.transfer_date}>'
+
+
+class BackgroundJob(db.Model):
+    """Фоновая задача (например, расчёт face encoding по фото ученика)"""
+    __tablename__ = 'background_jobs'
+    
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    kind = db.Column(db.String(50), nullable=False)  # Тип задачи: 'enroll_photo', 'import_students'
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    student_id = db.Column(db.Integer)  # Ученик, к которому относится задача (без FK: ученика могут удалить)
+    message = db.Column(db.Text)  # Результат или причина ошибки для пользователя
+    result = db.Column(db.Text)  # JSON: подробный результат (например, отчёт импорта)
+    worker = db.Column(db.String(100))  # Процесс, выполняющий задачу: 'хост:pid'
+    heartbeat_at = db.Column(db.DateTime)  # Последняя отметка о ходе работы (постановка, запуск, прогресс)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'student_id': self.student_id,
+            'message': self.message,
+            'result': json.loads(self.result) if self.result else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+    
+    def __repr__(self):
+        return f'<BackgroundJob {self.id} {self.kind}: {self.status}>'
+
+
+class FaceGalleryState(db.Model):
+    """Версия галереи распознавания: растёт при каждом изменении encodings учеников"""
+    __tablename__ = 'face_gallery_state'
+    
+    id = db.Column(db.Integer, primary_key=True)  # Единственная строка, id = 1
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<FaceGalleryState v{self.version}>'
+
+
+class StudentLedger(db.Model):
+    """Накопленные итоги ученика для расчёта баланса (см. backend/services/ledger.py)"""
+    __tablename__ = 'student_ledger'
+    
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id'), primary_key=True)
+    total_paid = db.Column(db.Float, nullable=False, default=0)  # Сумма всех оплат
+    lessons_attended = db.Column(db.Integer, nullable=False, default=0)  # Число посещений
+    balance = db.Column(db.Integer, index=True)  # Баланс в занятиях (пересчитывается вместе с итогами)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<StudentLedger {self.student_id}: {self.balance} ({self.total_paid} / {self.lessons_attended})>'
+
+
+class CacheVersion(db.Model):
+    """Версии кешируемых сводок (dashboard и т.п.): растут при изменении исходных данных"""
+    __tablename__ = 'cache_versions'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<CacheVersion {self.name} v{self.version}>'
+
+
+class StudentMonthDue(db.Model):
+    """Начислено и оплачено учеником за месяц (см. backend/services/month_dues.py)"""
+    __tablename__ = 'student_month_dues'
+    __table_args__ = (
+        db.Index('ix_student_month_dues_period', 'year', 'month'),
+    )
+    
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, primary_key=True)
+    due = db.Column(db.Float, nullable=False, default=0)  # Цена тарифа ученика
+    paid = db.Column(db.Float, nullable=False, default=0)  # Сумма оплат за этот месяц
+    remainder = db.Column(db.Float, nullable=False, default=0, index=True)  # Сколько осталось доплатить
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<StudentMonthDue {self.student_id} {self.month}/{self.year}: {self.paid}/{self.due}>'
@@ -0,0 +1,216 @@
+"""
+Индексы поиска ближайших лиц в галерее
+
+BruteForceIndex - точный перебор всей галереи (по умолчанию, для одного клуба его хватает).
+IVFIndex - галерея разбита на кластеры k-means (inverted file): запрос сравнивается
+с центроидами, а точные расстояния считаются только до строк nprobe ближайших кластеров.
+
+Индекс хранит только номера строк матрицы галереи FaceRecognitionService;
+сами векторы и точное сравнение кандидатов остаются в сервисе.
+"""
+import itertools
+
+import numpy as np
+
+FACE_INDEX_KINDS = ('brute', 'ivf')
+# Сколько ближайших кластеров просматривается на каждый запрос
+DEFAULT_NPROBE = 8
+# Для галереи меньше этого размера IVF не обучается - перебор и так быстрый
+IVF_MIN_TRAIN_SIZE = 2000
+# Сколько строк галереи используется для обучения k-means
+IVF_TRAIN_SAMPLE = 20000
+IVF_KMEANS_ITERATIONS = 10
+# Строки сравниваются с центроидами пачками, чтобы не держать в памяти матрицу N x K целиком
+ASSIGN_CHUNK = 8192
+
+
+def nearest_centroids(data, centroids):
+    """Номер ближайшего центроида для каждой строки data"""
+    centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+    assignment = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), ASSIGN_CHUNK):
+        chunk = data[start:start + ASSIGN_CHUNK]
+        # |x|^2 одинаков для всех центроидов строки и на argmin не влияет
+        scores = chunk @ centroids.T
+        scores *= -2.0
+        scores += centroid_sq_norms[None, :]
+        assignment[start:start + len(chunk)] = np.argmin(scores, axis=1)
+    return assignment
+
+
+def kmeans(data, n_clusters, iterations=IVF_KMEANS_ITERATIONS, sample_size=IVF_TRAIN_SAMPLE, rng=None):
+    """
+    Центроиды k-means (алгоритм Ллойда) на случайной выборке строк
+    Returns: float32 массив (n_clusters x 128)
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    data = np.asarray(data, dtype=np.float32)
+    if len(data) > sample_size:
+        data = data[rng.choice(len(data), sample_size, replace=False)]
+    n_clusters = max(1, min(int(n_clusters), len(data)))
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = nearest_centroids(data, centroids)
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=n_clusters)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        sums = np.add.reduceat(data[order], starts, axis=0)
+        centroids[filled] = sums / counts[filled, None]
+        # Пустые кластеры получают случайные точки выборки
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+    return centroids
+
+
+class BruteForceIndex:
+    """Точный перебор: кандидаты - вся галерея"""
+
+    kind = 'brute'
+
+    def build(self, matrix):
+        pass
+
+    def add(self, row, vector):
+        pass
+
+    def remove(self, row, last_row):
+        pass
+
+    def needs_rebuild(self, size):
+        return False
+
+    def candidates(self, queries):
+        """None - сравнивать со всей галереей"""
+        return None
+
+    def stats(self):
+        return {'kind': self.kind}
+
+    def options(self):
+        """Параметры create_face_index для такого же индекса (в процессах пула)"""
+        return {'kind': self.kind}
+
+
+class IVFIndex:
+    """Inverted file: кластеры k-means и списки строк галереи в каждом кластере"""
+
+    kind = 'ivf'
+
+    def __init__(self, nprobe=DEFAULT_NPROBE, n_lists=None, min_train_size=IVF_MIN_TRAIN_SIZE, seed=0):
+        self.nprobe = max(1, int(nprobe))
+        # Число кластеров; по умолчанию ~sqrt(N)
+        self.n_lists = n_lists
+        self.min_train_size = max(1, int(min_train_size))
+        self._rng = np.random.default_rng(seed)
+        self.centroids = None
+        self.lists = []
+        # Номер кластера для каждой строки галереи
+        self._list_by_row = np.empty(0, dtype=np.int32)
+        self.trained_size = 0
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def build(self, matrix):
+        """Обучить кластеры и разложить по ним все строки галереи"""
+        size = len(matrix)
+        self._list_by_row = np.full(max(16, size), -1, dtype=np.int32)
+        if size < self.min_train_size:
+            self.centroids = None
+            self.lists = []
+            self.trained_size = 0
+            return
+
+        n_lists = self.n_lists or int(np.sqrt(size))
+        self.centroids = kmeans(matrix, n_lists, rng=self._rng)
+        assignment = nearest_centroids(matrix, self.centroids)
+        self._list_by_row[:size] = assignment
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[k]:bounds[k + 1]].tolist() for k in range(len(self.centroids))]
+        self.trained_size = size
+
+    def add(self, row, vector):
+        """Новая строка галереи или новый вектор в существующей строке"""
+        if not self.trained:
+            return
+        if row >= len(self._list_by_row):
+            grown = np.full(max(16, len(self._list_by_row) * 2, row + 1), -1, dtype=np.int32)
+            grown[:len(self._list_by_row)] = self._list_by_row
+            self._list_by_row = grown
+        old = self._list_by_row[row]
+        if old >= 0:
+            self.lists[old].remove(row)
+        k = int(nearest_centroids(np.asarray(vector, dtype=np.float32).reshape(1, -1), self.centroids)[0])
+        self.lists[k].append(row)
+        self._list_by_row[row] = k
+
+    def remove(self, row, last_row):
+        """Строка row удалена, на её место перенесена last_row (как в галерее сервиса)"""
+        if not self.trained:
+            return
+        k = self._list_by_row[row]
+        if k >= 0:
+            self.lists[k].remove(row)
+        if row != last_row:
+            moved = self._list_by_row[last_row]
+            if moved >= 0:
+                members = self.lists[moved]
+                members[members.index(last_row)] = row
+            self._list_by_row[row] = moved
+        else:
+            self._list_by_row[row] = -1
+        self._list_by_row[last_row] = -1
+
+    def needs_rebuild(self, size):
+        """Галерея доросла до обучения или сильно изменилась с момента обучения"""
+        if not self.trained:
+            return size >= self.min_train_size
+        return size > 2 * self.trained_size or size * 2 < self.trained_size
+
+    def candidates(self, queries):
+        """
+        Строки галереи из nprobe ближайших кластеров для каждого запроса
+        Returns: список массивов номеров строк или None (индекс не обучен - полный перебор)
+        """
+        if not self.trained:
+            return None
+        nprobe = min(self.nprobe, len(self.centroids))
+        scores = queries @ self.centroids.T
+        scores *= -2.0
+        scores += np.einsum('ij,ij->i', self.centroids, self.centroids)[None, :]
+        if nprobe < len(self.centroids):
+            probes = np.argpartition(scores, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.broadcast_to(np.arange(len(self.centroids)), scores.shape)
+        return [
+            np.fromiter(itertools.chain.from_iterable(self.lists[k] for k in probe), dtype=np.intp)
+            for probe in probes
+        ]
+
+    def stats(self):
+        return {
+            'kind': self.kind,
+            'trained': self.trained,
+            'lists': len(self.lists),
+            'nprobe': self.nprobe,
+            'trained_size': self.trained_size
+        }
+
+    def options(self):
+        """Параметры create_face_index для такого же индекса (в процессах пула)"""
+        return {'kind': self.kind, 'nprobe': self.nprobe, 'n_lists': self.n_lists}
+
+
+def create_face_index(kind='brute', nprobe=DEFAULT_NPROBE, n_lists=None):
+    """Создать индекс по имени: 'brute' (точный перебор) или 'ivf'"""
+    kind = (kind or 'brute').lower()
+    if kind == 'brute':
+        return BruteForceIndex()
+    if kind == 'ivf':
+        return IVFIndex(nprobe=nprobe, n_lists=n_lists)
+    raise ValueError(f'Неизвестный тип индекса: {kind} (допустимо: {", ".join(FACE_INDEX_KINDS)})')
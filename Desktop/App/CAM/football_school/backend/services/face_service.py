@@ -1,15 +1,164 @@
-import face_recognition
-import cv2
 import numpy as np
-from PIL import Image
 import os
+import threading
+import time
+
+from backend.models.face_encoding import ENCODING_DIM, stack_face_encodings
+from backend.services.face_index import BruteForceIndex
+from backend.services.face_tracker import CameraSessions, plan_encoding
+from backend.services.frame_gate import THUMBNAIL_SIZE
+from backend.services.lazy_import import LazyModule
+from backend.services.metrics import StageTimer
+
+# dlib с моделями и OpenCV импортируются при первом использовании (см. lazy_import.py)
+face_recognition = LazyModule('face_recognition')
+cv2 = LazyModule('cv2')
+
+# Порог расстояния, ниже которого лица считаются совпадающими
+DEFAULT_TOLERANCE = 0.6
+
+
+# Детекция по умолчанию идёт на полном кадре: с одним апсемплингом HOG находит лица от ~40px.
+# Масштаб 0.5 вдвое уменьшает копию кадра (детекция в ~4 раза быстрее), но минимальное лицо
+# в исходном кадре становится ~80px; прежний минимум даёт только апсемплинг 2 - по цене полного кадра
+DEFAULT_DETECTION_SCALE = 1.0
+# Число апсемплингов в HOG-детекторе (1 = как в face_recognition по умолчанию)
+DEFAULT_DETECTION_UPSAMPLE = 1
+
+# Серия кадров: ученик принимается, если опознан минимум в BURST_MIN_VOTES кадрах
+# или хотя бы в одном кадре с расстоянием не больше BURST_STRONG_DISTANCE
+BURST_MIN_VOTES = 2
+BURST_STRONG_DISTANCE = 0.45
+# Максимальное число кадров в одной серии
+BURST_MAX_FRAMES = 8
+
+# Поддерживаемые форматы "сырых" кадров: число каналов на пиксель
+RAW_PIXEL_FORMATS = {'rgb': 3, 'rgba': 4}
+
+
+def decode_image_bytes(data):
+    """
+    Декодировать JPEG/PNG из байтов в памяти (без временного файла)
+    Returns: numpy array (BGR) или None, если декодировать не удалось
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+
+def frame_from_raw_pixels(data, width, height, pixel_format='rgb'):
+    """
+    Собрать кадр из несжатых пикселей (например, ImageData с canvas) без JPEG-декодирования
+    Returns: numpy array (RGB, uint8, H x W x 3)
+    """
+    channels = RAW_PIXEL_FORMATS.get(pixel_format)
+    if channels is None:
+        raise ValueError(f'Неподдерживаемый формат пикселей: {pixel_format}')
+    if not width or not height or width <= 0 or height <= 0:
+        raise ValueError('Для сырого кадра нужно указать width и height')
+    if len(data) != width * height * channels:
+        raise ValueError(f'Размер данных не совпадает с {width}x{height} {pixel_format}')
+    frame = np.frombuffer(data, dtype=np.uint8).reshape(height, width, channels)
+    # dlib требует непрерывный массив из 3 каналов
+    return np.ascontiguousarray(frame[:, :, :3])
+
+
+def decode_frame_payload(payload):
+    """
+    Декодировать кадр, принятый из запроса (см. read_uploaded_image в app.py)
+    payload: {'data': bytes, 'pixel_format': None|'rgb'|'rgba', 'width', 'height'}
+    Returns: (frame, is_rgb)
+    """
+    if payload.get('pixel_format'):
+        frame = frame_from_raw_pixels(payload['data'], payload.get('width'), payload.get('height'),
+                                      payload['pixel_format'])
+        return frame, True
+    frame = decode_image_bytes(payload['data'])
+    if frame is None:
+        raise ValueError('Не удалось декодировать изображение')
+    return frame, False
+
+
+def payload_thumbnail(payload):
+    """
+    Серая миниатюра кадра для FrameChangeGate без полного декодирования
+    (JPEG декодируется сразу в 1/8 разрешения)
+    Returns: uint8 массив THUMBNAIL_SIZE или None, если кадр не читается
+    """
+    if payload.get('pixel_format'):
+        try:
+            frame = frame_from_raw_pixels(payload['data'], payload.get('width'), payload.get('height'),
+                                          payload['pixel_format'])
+        except ValueError:
+            return None
+        small = cv2.resize(frame, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+    buffer = np.frombuffer(payload['data'], dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    gray = cv2.imdecode(buffer, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gray is None:
+        return None
+    return cv2.resize(gray, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+
+
+def parse_roi(value):
+    """
+    Разобрать область интереса из строки "left,top,right,bottom" (доли кадра 0..1)
+    Returns: кортеж из 4 float или None, если область не задана
+    """
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    parts = value.split(',') if isinstance(value, str) else list(value)
+    if len(parts) != 4:
+        raise ValueError('Область интереса задаётся как left,top,right,bottom')
+    left, top, right, bottom = (float(p) for p in parts)
+    if not (0 <= left < right <= 1 and 0 <= top < bottom <= 1):
+        raise ValueError('Область интереса должна быть в пределах 0..1 и не пустой')
+    return left, top, right, bottom
+
 
 class FaceRecognitionService:
     """Сервис для распознавания лиц"""
     
-    def __init__(self):
-        self.known_encodings = []
-        self.known_student_ids = []
+    def __init__(self, tolerance=DEFAULT_TOLERANCE, detection_scale=DEFAULT_DETECTION_SCALE,
+                 detection_upsample=DEFAULT_DETECTION_UPSAMPLE, detection_roi=None, index=None,
+                 frame_gate=None):
+        self.tolerance = tolerance
+        # Параметры детекции: масштаб уменьшенной копии, апсемплинг HOG и область интереса
+        self.detection_scale = min(1.0, max(0.1, float(detection_scale)))
+        self.detection_upsample = max(0, int(detection_upsample))
+        self.detection_roi = parse_roi(detection_roi)
+        # Трекеры лиц по камерам (см. face_tracker.py);
+        # frame_gate - параметры FrameChangeGate или None (без пропуска неизменных кадров)
+        self.camera_sessions = CameraSessions(gate_options=frame_gate)
+        # Галерея хранится одной непрерывной float32 матрицей (capacity x 128),
+        # заполнены первые _size строк
+        self._matrix = np.empty((0, ENCODING_DIM), dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+        # Предрасчитанные квадраты норм строк галереи
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self._size = 0
+        # student_id -> номер строки в матрице
+        self._row_by_id = {}
+        # Индекс кандидатов для сопоставления (см. face_index.py); по умолчанию полный перебор
+        self._index = index or BruteForceIndex()
+        # Счётчик изменений галереи (по нему пул распознавания публикует новую копию)
+        self.generation = 0
+        # Защищает галерею: изменения и матричное сравнение занимают микросекунды,
+        # детекция и encoding выполняются без блокировки
+        self._lock = threading.RLock()
+    
+    @property
+    def known_encodings(self):
+        """Матрица encodings галереи (N x 128)"""
+        return self._matrix[:self._size]
+    
+    @property
+    def known_student_ids(self):
+        """id учеников, соответствующие строкам known_encodings"""
+        return self._ids[:self._size]
     
     def extract_face_encoding(self, image_path):
         """
@@ -33,81 +182,417 @@ class FaceRecognitionService:
         Загрузить все encodings учеников в память
         students: список объектов Student из БД
         """
-        self.known_encodings = []
-        self.known_student_ids = []
+        encodings = []
+        student_ids = []
         
         for student in students:
             encoding = student.get_face_encoding()
             if encoding is not None:
-                self.known_encodings.append(np.array(encoding))
-                self.known_student_ids.append(student.id)
+                encodings.append(encoding)
+                student_ids.append(student.id)
         
-        print(f"Загружено {len(self.known_encodings)} encodings учеников")
+        self.set_gallery(encodings, student_ids)
+        print(f"Загружено {len(self.known_student_ids)} encodings учеников")
+    
+    def load_encoding_blobs(self, student_ids, blobs, extra_encodings=None):
+        """
+        Собрать галерею из бинарных записей (одна выборка из БД, один np.frombuffer)
+        student_ids, blobs: параллельные последовательности из запроса (Student.id, Student.face_encoding_bin)
+        extra_encodings: список (student_id, encoding) в старом формате, ещё не мигрированных
+        """
+        matrix, valid = stack_face_encodings(blobs)
+        ids = np.asarray(student_ids, dtype=np.int64)[valid]
+        if extra_encodings:
+            matrix = np.vstack([matrix] + [np.asarray(e, dtype=np.float32).reshape(1, ENCODING_DIM) for _, e in extra_encodings])
+            ids = np.concatenate([ids, np.asarray([sid for sid, _ in extra_encodings], dtype=np.int64)])
+        self.set_gallery(matrix, ids)
+        print(f"Загружено {len(self.known_student_ids)} encodings учеников")
+    
+    def set_gallery(self, encodings, student_ids):
+        """
+        Заменить галерею целиком
+        encodings: массив (N x 128) или список векторов
+        student_ids: последовательность id учеников той же длины
+        """
+        # Копия: строки галереи меняются на месте при upsert/remove
+        matrix = np.array(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        ids = np.asarray(student_ids, dtype=np.int64).reshape(-1)
+        with self._lock:
+            self._matrix = matrix
+            self._ids = ids.copy()
+            self._sq_norms = np.einsum('ij,ij->i', matrix, matrix)
+            self._size = len(ids)
+            self._row_by_id = {int(student_id): row for row, student_id in enumerate(ids)}
+            self._index.build(matrix)
+            self.generation += 1
+    
+    def set_gallery_views(self, matrix, student_ids, sq_norms):
+        """
+        Подключить готовые массивы галереи без копирования,
+        например из разделяемой памяти в процессе пула распознавания или снимка на диске
+        (массивы только для чтения копируются в память при первом изменении галереи)
+        """
+        with self._lock:
+            self._matrix = matrix
+            self._ids = student_ids
+            self._sq_norms = sq_norms
+            self._size = len(student_ids)
+            self._row_by_id = {int(student_id): row for row, student_id in enumerate(student_ids)}
+            self._index.build(matrix)
+            self.generation += 1
+    
+    def gallery_snapshot(self):
+        """
+        Согласованная копия галереи
+        Returns: (generation, student_ids, sq_norms, matrix)
+        """
+        with self._lock:
+            size = self._size
+            return (self.generation, self._ids[:size].copy(), self._sq_norms[:size].copy(),
+                    self._matrix[:size].copy())
+    
+    def has_student(self, student_id):
+        """Есть ли ученик в галерее"""
+        return student_id in self._row_by_id
+    
+    def upsert_student_encoding(self, student_id, encoding):
+        """Добавить или заменить encoding одного ученика в галерее"""
+        vector = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_DIM)
+        student_id = int(student_id)
+        with self._lock:
+            self._ensure_writable()
+            row = self._row_by_id.get(student_id)
+            if row is None:
+                if self._size == len(self._matrix):
+                    self._grow()
+                row = self._size
+                self._size += 1
+                self._row_by_id[student_id] = row
+            self._matrix[row] = vector
+            self._ids[row] = student_id
+            self._sq_norms[row] = float(vector @ vector)
+            self._sync_index_row(row, vector)
+            self.generation += 1
+    
+    def remove_student_encoding(self, student_id):
+        """Убрать ученика из галереи (на его место переносится последняя строка)"""
+        with self._lock:
+            row = self._row_by_id.pop(int(student_id), None)
+            if row is None:
+                return False
+            self._ensure_writable()
+            last = self._size - 1
+            if row != last:
+                self._matrix[row] = self._matrix[last]
+                self._ids[row] = self._ids[last]
+                self._sq_norms[row] = self._sq_norms[last]
+                self._row_by_id[int(self._ids[row])] = row
+            self._size = last
+            self._index.remove(row, last)
+            self.generation += 1
+            return True
+    
+    def _sync_index_row(self, row, vector):
+        """Обновить строку в индексе; перестроить индекс, если галерея сильно выросла"""
+        if self._index.needs_rebuild(self._size):
+            self._index.build(self._matrix[:self._size])
+        else:
+            self._index.add(row, vector)
     
-    def recognize_face_from_frame(self, frame):
+    def index_options(self):
+        """Параметры индекса галереи (create_face_index) - чтобы процессы пула строили такой же"""
+        return self._index.options()
+    
+    def index_stats(self):
+        """Состояние индекса галереи"""
+        with self._lock:
+            stats = self._index.stats()
+            stats['size'] = self._size
+            return stats
+    
+    def _ensure_writable(self):
+        """Скопировать в память галерею, подключенную только для чтения (mmap снимка)"""
+        if not self._matrix.flags.writeable:
+            self._matrix = np.array(self._matrix[:self._size])
+            self._ids = np.array(self._ids[:self._size])
+            self._sq_norms = np.array(self._sq_norms[:self._size])
+    
+    def _grow(self):
+        """Увеличить ёмкость матрицы вдвое (амортизированно O(1) на добавление)"""
+        capacity = max(16, len(self._matrix) * 2)
+        matrix = np.empty((capacity, ENCODING_DIM), dtype=np.float32)
+        ids = np.empty(capacity, dtype=np.int64)
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        ids[:self._size] = self._ids[:self._size]
+        sq_norms[:self._size] = self._sq_norms[:self._size]
+        self._matrix, self._ids, self._sq_norms = matrix, ids, sq_norms
+    
+    def match_encodings(self, encodings):
+        """
+        Сопоставить все лица кадра с галереей одним матричным вычислением
+        (при IVF-индексе - точное сравнение только с кандидатами из ближайших кластеров)
+        encodings: список/массив face encodings (M x 128)
+        Returns: список словарей {'student_id', 'distance', 'margin'} на каждое лицо;
+                 student_id = None, если лучшее расстояние больше tolerance.
+                 margin - отрыв лучшего совпадения от второго (inf, если в галерее одно лицо)
+        """
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        with self._lock:
+            size = self._size
+            if len(queries) == 0 or size == 0:
+                return [{'student_id': None, 'distance': float('inf'), 'margin': 0.0} for _ in range(len(queries))]
+            
+            candidates = self._index.candidates(queries)
+            if candidates is None:
+                best_rows, best, second = self._nearest_rows(queries)
+            else:
+                # Точное сравнение только с кандидатами индекса; пустой список - полный перебор
+                best_rows = np.empty(len(queries), dtype=np.intp)
+                best = np.empty(len(queries), dtype=np.float32)
+                second = np.empty(len(queries), dtype=np.float32)
+                for i, rows in enumerate(candidates):
+                    found = self._nearest_rows(queries[i:i + 1], rows if len(rows) else None)
+                    best_rows[i], best[i], second[i] = found[0][0], found[1][0], found[2][0]
+            best_ids = self._ids[best_rows]
+        
+        results = []
+        for i in range(len(queries)):
+            distance = float(best[i])
+            results.append({
+                'student_id': int(best_ids[i]) if distance <= self.tolerance else None,
+                'distance': distance,
+                'margin': float(second[i] - best[i])
+            })
+        return results
+    
+    def _nearest_rows(self, queries, rows=None):
+        """
+        Точные лучшая и вторая по близости строки галереи для каждого запроса (под self._lock)
+        rows: номера строк-кандидатов или None (вся галерея)
+        Returns: (номера лучших строк, лучшие расстояния, вторые расстояния)
+        """
+        if rows is None:
+            gallery = self._matrix[:self._size]
+            sq_norms = self._sq_norms[:self._size]
+        else:
+            gallery = self._matrix[rows]
+            sq_norms = self._sq_norms[rows]
+        
+        # |q - g|^2 = |q|^2 + |g|^2 - 2 q.g  для всех пар (M x N) за один проход
+        sq_dist = queries @ gallery.T
+        sq_dist *= -2.0
+        sq_dist += np.einsum('ij,ij->i', queries, queries)[:, None]
+        sq_dist += sq_norms[None, :]
+        np.maximum(sq_dist, 0.0, out=sq_dist)
+        
+        index = np.arange(len(queries))
+        if len(gallery) > 1:
+            top_two = np.argpartition(sq_dist, 1, axis=1)[:, :2]
+            best_index = top_two[:, 0]
+            second = np.sqrt(sq_dist[index, top_two[:, 1]])
+        else:
+            best_index = np.zeros(len(queries), dtype=np.intp)
+            second = np.full(len(queries), np.inf, dtype=np.float32)
+        best = np.sqrt(sq_dist[index, best_index])
+        best_rows = best_index if rows is None else rows[best_index]
+        return best_rows, best, second
+    
+    def detect_faces(self, rgb_frame, roi=None):
+        """
+        Найти лица на уменьшенной копии кадра (только внутри области интереса)
+        и вернуть рамки в координатах исходного кадра
+        rgb_frame: numpy array (RGB)
+        roi: область интереса (left, top, right, bottom) в долях кадра; по умолчанию detection_roi
+        Returns: список (top, right, bottom, left) в полном разрешении
+        """
+        height, width = rgb_frame.shape[:2]
+        roi = roi or self.detection_roi
+        if roi:
+            x0, y0 = int(roi[0] * width), int(roi[1] * height)
+            x1, y1 = int(round(roi[2] * width)), int(round(roi[3] * height))
+        else:
+            x0, y0, x1, y1 = 0, 0, width, height
+        region = rgb_frame[y0:y1, x0:x1]
+        if region.size == 0:
+            return []
+        
+        if self.detection_scale < 1.0:
+            small = cv2.resize(region, (0, 0), fx=self.detection_scale, fy=self.detection_scale,
+                               interpolation=cv2.INTER_AREA)
+        else:
+            small = np.ascontiguousarray(region)
+        
+        small_locations = face_recognition.face_locations(
+            small, number_of_times_to_upsample=self.detection_upsample
+        )
+        
+        # Пересчитать рамки обратно в координаты полного кадра
+        scale_y = region.shape[0] / small.shape[0]
+        scale_x = region.shape[1] / small.shape[1]
+        locations = []
+        for top, right, bottom, left in small_locations:
+            locations.append((
+                max(0, int(top * scale_y) + y0),
+                min(width, int(round(right * scale_x)) + x0),
+                min(height, int(round(bottom * scale_y)) + y0),
+                max(0, int(left * scale_x) + x0)
+            ))
+        return locations
+    
+    def recognize_face_from_frame(self, frame, is_rgb=False, roi=None):
         """
         Распознать лицо из видеокадра
-        frame: numpy array (BGR from OpenCV)
+        frame: numpy array (BGR from OpenCV, или RGB при is_rgb=True)
+        roi: область интереса (left, top, right, bottom) в долях кадра, см. detect_faces
         Returns: student_id или None
         """
         if len(self.known_encodings) == 0:
             return None
         
         # Конвертация BGR -> RGB
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        rgb_frame = frame if is_rgb else cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         
-        # Найти все лица в кадре
-        face_locations = face_recognition.face_locations(rgb_frame)
+        # Найти все лица в кадре (детекция на уменьшенной копии, encoding - в полном разрешении)
+        face_locations = self.detect_faces(rgb_frame, roi=roi)
         face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
         
-        for encoding in face_encodings:
-            # Сравнить с известными encodings
-            matches = face_recognition.compare_faces(self.known_encodings, encoding, tolerance=0.6)
-            face_distances = face_recognition.face_distance(self.known_encodings, encoding)
-            
-            if len(face_distances) > 0:
-                best_match_index = np.argmin(face_distances)
-                
-                if matches[best_match_index]:
-                    return self.known_student_ids[best_match_index]
+        for match in self.match_encodings(face_encodings):
+            if match['student_id'] is not None:
+                return match['student_id']
         
         return None
     
-    def recognize_multiple_faces_from_frame(self, frame):
+    def recognize_multiple_faces_from_frame(self, frame, is_rgb=False, roi=None, camera_id=None, timer=None):
         """
         Распознать несколько лиц из видеокадра
-        frame: numpy array (BGR from OpenCV)
+        frame: numpy array (BGR from OpenCV, или RGB при is_rgb=True)
+        roi: область интереса (left, top, right, bottom) в долях кадра, см. detect_faces
+        camera_id: идентификатор камеры; если задан, лица сопровождаются между кадрами
+                   и encoding считается только для новых и неуверенных лиц
+        timer: StageTimer запроса для замера этапов (см. metrics.py)
         Returns: список словарей с информацией о распознанных учениках
         """
         if len(self.known_encodings) == 0:
             return []
+        timer = timer if timer is not None else StageTimer()
         
         # Конвертация BGR -> RGB
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        with timer.stage('decode'):
+            rgb_frame = frame if is_rgb else cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         
-        # Найти все лица в кадре
-        face_locations = face_recognition.face_locations(rgb_frame)
-        face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+        if camera_id:
+            tracker = self.camera_sessions.get(camera_id)
+            with tracker.lock:
+                now = time.monotonic()
+                tracks_plan = tracker.prepare(now, is_known=self.has_student)
+                face_locations, assigned, fresh_matches = self.analyze_frame(
+                    rgb_frame, roi=roi, tracks_plan=tracks_plan, timer=timer
+                )
+                matches = tracker.update(face_locations, assigned, fresh_matches, now)
+        else:
+            face_locations, _, fresh_matches = self.analyze_frame(rgb_frame, roi=roi, timer=timer)
+            matches = [fresh_matches[i] for i in range(len(face_locations))]
         
+        return self.collect_recognized(face_locations, matches)
+    
+    def analyze_frame(self, rgb_frame, roi=None, tracks_plan=None, timer=None):
+        """
+        Детекция, encoding и сопоставление с галереей для одного RGB кадра
+        tracks_plan: описание треков камеры (FaceTracker.prepare); лица уверенных треков не кодируются
+        timer: StageTimer для этапов detect / encode / match и счётчиков faces / encoded
+        Returns: (рамки лиц, индексы треков для рамок, {индекс рамки: результат match_encodings})
+        """
+        timer = timer if timer is not None else StageTimer()
+        # Найти все лица в кадре (детекция на уменьшенной копии, encoding - в полном разрешении)
+        with timer.stage('detect'):
+            face_locations = self.detect_faces(rgb_frame, roi=roi)
+        assigned, pending = plan_encoding(tracks_plan, face_locations)
+        timer.count('faces', len(face_locations))
+        timer.count('encoded', len(pending))
+        fresh_matches = {}
+        if pending:
+            with timer.stage('encode'):
+                face_encodings = face_recognition.face_encodings(rgb_frame, [face_locations[i] for i in pending])
+            with timer.stage('match'):
+                fresh_matches = dict(zip(pending, self.match_encodings(face_encodings)))
+        return face_locations, assigned, fresh_matches
+    
+    @staticmethod
+    def collect_recognized(face_locations, matches):
+        """Оставить только опознанные лица"""
         recognized_students = []
         
-        for encoding, location in zip(face_encodings, face_locations):
-            # Сравнить с известными encodings
-            matches = face_recognition.compare_faces(self.known_encodings, encoding, tolerance=0.6)
-            face_distances = face_recognition.face_distance(self.known_encodings, encoding)
-            
-            if len(face_distances) > 0:
-                best_match_index = np.argmin(face_distances)
-                
-                if matches[best_match_index]:
-                    student_id = self.known_student_ids[best_match_index]
-                    recognized_students.append({
-                        'student_id': student_id,
-                        'location': location  # (top, right, bottom, left)
-                    })
+        for match, location in zip(matches, face_locations):
+            if match['student_id'] is not None:
+                recognized_students.append({
+                    'student_id': match['student_id'],
+                    'distance': match['distance'],
+                    'margin': match['margin'],
+                    'location': location  # (top, right, bottom, left)
+                })
         
         return recognized_students
     
+    def recognize_burst(self, rgb_frames, roi=None, timer=None):
+        """
+        Распознать серию кадров (3-5 снимков подряд) за один проход:
+        детекция и encoding по всем кадрам, одно матричное сопоставление, слияние голосованием
+        rgb_frames: список numpy array (RGB)
+        Returns: список словарей {'student_id', 'votes', 'frames', 'distance', 'mean_distance'},
+                 отсортированный по числу голосов и расстоянию
+        """
+        if len(self.known_encodings) == 0 or not rgb_frames:
+            return []
+        timer = timer if timer is not None else StageTimer()
+        
+        face_encodings = []
+        frame_indexes = []
+        for index, rgb_frame in enumerate(rgb_frames):
+            with timer.stage('detect'):
+                face_locations = self.detect_faces(rgb_frame, roi=roi)
+            timer.count('faces', len(face_locations))
+            if face_locations:
+                with timer.stage('encode'):
+                    encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+                face_encodings.extend(encodings)
+                frame_indexes.extend([index] * len(encodings))
+        
+        with timer.stage('match'):
+            matches = self.match_encodings(face_encodings)
+        return self.fuse_burst_matches(frame_indexes, matches, len(rgb_frames))
+    
+    @staticmethod
+    def fuse_burst_matches(frame_indexes, matches, frames_count):
+        """
+        Слить совпадения из нескольких кадров: голос ученика - кадр, где он лучший кандидат
+        в пределах tolerance (в одном кадре ученик голосует не больше одного раза)
+        """
+        votes = {}
+        for frame_index, match in zip(frame_indexes, matches):
+            student_id = match['student_id']
+            if student_id is None:
+                continue
+            per_frame = votes.setdefault(student_id, {})
+            if match['distance'] < per_frame.get(frame_index, float('inf')):
+                per_frame[frame_index] = match['distance']
+        
+        min_votes = min(BURST_MIN_VOTES, frames_count)
+        fused = []
+        for student_id, per_frame in votes.items():
+            distances = list(per_frame.values())
+            best = min(distances)
+            if len(distances) >= min_votes or best <= BURST_STRONG_DISTANCE:
+                fused.append({
+                    'student_id': student_id,
+                    'votes': len(distances),
+                    'frames': frames_count,
+                    'distance': best,
+                    'mean_distance': sum(distances) / len(distances)
+                })
+        fused.sort(key=lambda item: (-item['votes'], item['mean_distance']))
+        return fused
+    
     def recognize_face_from_image(self, image_path):
         """
         Распознать лицо из файла изображения
@@ -141,14 +626,28 @@ class FaceRecognitionService:
         Сохранить фото ученика
         Returns: путь к сохранённому файлу (с прямыми слэшами для URL)
         """
-        upload_dir = "frontend/static/uploads"
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Убрать пробелы и небезопасные символы из имени файла
-        safe_filename = photo_file.filename.replace(' ', '_').replace('%', '')
-        filename = f"student_{student_id}_{safe_filename}"
-        filepath = os.path.join(upload_dir, filename)
+        filepath = self.student_photo_path(photo_file.filename, student_id)
         photo_file.save(filepath)
         
         # Вернуть путь с прямыми слэшами для URL
         return filepath.replace('\\', '/')
+    
+    def save_student_photo_bytes(self, data, filename, student_id):
+        """
+        Сохранить фото ученика из байтов (массовый импорт)
+        Returns: путь к сохранённому файлу (с прямыми слэшами для URL)
+        """
+        filepath = self.student_photo_path(filename, student_id)
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        return filepath.replace('\\', '/')
+    
+    @staticmethod
+    def student_photo_path(filename, student_id):
+        """Путь файла фото ученика в папке загрузок"""
+        upload_dir = "frontend/static/uploads"
+        os.makedirs(upload_dir, exist_ok=True)
+        
+        # Убрать пробелы и небезопасные символы из имени файла
+        safe_filename = os.path.basename(filename).replace(' ', '_').replace('%', '')
+        return os.path.join(upload_dir, f"student_{student_id}_{safe_filename}")
@@ -0,0 +1,218 @@
+"""
+Сопровождение лиц между кадрами одной камеры
+
+Камера присылает кадр каждые 2 секунды. Ребёнок, стоящий перед камерой,
+попадает в десятки кадров подряд, поэтому лица связываются с треками по
+перекрытию рамок (IoU), а 128-мерный encoding пересчитывается только для
+новых треков, неуверенных совпадений и периодической перепроверки.
+"""
+import itertools
+import threading
+import time
+
+from backend.services.frame_gate import FrameChangeGate
+
+# Минимальное перекрытие рамок, чтобы считать лицо продолжением трека
+DEFAULT_IOU_THRESHOLD = 0.3
+# Трек удаляется, если лицо не появлялось столько секунд (кадры идут раз в 2 с)
+DEFAULT_MAX_TRACK_AGE = 5.0
+# Даже уверенный трек перепроверяется encoder-ом не реже, чем раз в N секунд
+DEFAULT_REENCODE_INTERVAL = 10.0
+# Совпадение считается уверенным при расстоянии не больше этого порога
+DEFAULT_CONFIDENT_DISTANCE = 0.5
+# Сессия камеры удаляется после N секунд без кадров
+DEFAULT_SESSION_TTL = 600.0
+
+
+def box_iou(a, b):
+    """Перекрытие двух рамок (top, right, bottom, left)"""
+    top = max(a[0], b[0])
+    right = min(a[1], b[1])
+    bottom = min(a[2], b[2])
+    left = max(a[3], b[3])
+    if right <= left or bottom <= top:
+        return 0.0
+    intersection = (right - left) * (bottom - top)
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    union = area_a + area_b - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def associate_boxes(track_boxes, locations, iou_threshold=DEFAULT_IOU_THRESHOLD):
+    """
+    Жадно сопоставить рамки кадра с рамками треков по убыванию IoU
+    Returns: список индексов треков (или None) для каждой рамки кадра
+    """
+    pairs = []
+    for t, track_box in enumerate(track_boxes):
+        for i, location in enumerate(locations):
+            iou = box_iou(track_box, location)
+            if iou >= iou_threshold:
+                pairs.append((iou, t, i))
+    pairs.sort(reverse=True)
+
+    assigned = [None] * len(locations)
+    used_tracks = set()
+    for _, t, i in pairs:
+        if assigned[i] is None and t not in used_tracks:
+            assigned[i] = t
+            used_tracks.add(t)
+    return assigned
+
+
+def plan_encoding(tracks_plan, locations):
+    """
+    Решить, каким лицам кадра нужен encoding
+    tracks_plan: результат FaceTracker.prepare() или None (без сопровождения)
+    Returns: (индексы треков или None для каждой рамки, индексы рамок для encoder-а)
+    """
+    if tracks_plan is None:
+        return [None] * len(locations), list(range(len(locations)))
+    assigned = associate_boxes(tracks_plan['boxes'], locations, tracks_plan['iou_threshold'])
+    confirmed = tracks_plan['confirmed']
+    pending = [i for i, t in enumerate(assigned) if t is None or not confirmed[t]]
+    return assigned, pending
+
+
+class FaceTrack:
+    """Одно лицо, сопровождаемое между кадрами"""
+
+    __slots__ = ('track_id', 'location', 'student_id', 'distance', 'margin', 'last_seen', 'last_encoded')
+
+    def __init__(self, track_id, location, now):
+        self.track_id = track_id
+        self.location = location
+        self.student_id = None
+        self.distance = float('inf')
+        self.margin = 0.0
+        self.last_seen = now
+        self.last_encoded = None
+
+
+class FaceTracker:
+    """Треки лиц одной камеры"""
+
+    def __init__(self, iou_threshold=DEFAULT_IOU_THRESHOLD, max_track_age=DEFAULT_MAX_TRACK_AGE,
+                 reencode_interval=DEFAULT_REENCODE_INTERVAL, confident_distance=DEFAULT_CONFIDENT_DISTANCE,
+                 gate=None):
+        self.iou_threshold = iou_threshold
+        self.max_track_age = max_track_age
+        self.reencode_interval = reencode_interval
+        self.confident_distance = confident_distance
+        self.tracks = []
+        self.last_frame_at = time.monotonic()
+        # Кадры одной камеры обрабатываются последовательно
+        self.lock = threading.Lock()
+        self._track_ids = itertools.count(1)
+        # Счётчики: сколько лиц прошло через encoder, а сколько взято из треков
+        self.encoded_faces = 0
+        self.reused_faces = 0
+        # Пропуск неизменившихся кадров камеры (FrameChangeGate или None)
+        self.gate = gate
+
+    def prepare(self, now=None, is_known=None):
+        """
+        Отбросить устаревшие треки и описать живые для plan_encoding()
+        is_known: функция student_id -> bool; трек ученика, которого больше нет в галерее, перепроверяется
+        Returns: словарь {'boxes', 'confirmed', 'iou_threshold'} (сериализуемый, годится для другого процесса)
+        """
+        now = time.monotonic() if now is None else now
+        self.tracks = [t for t in self.tracks if now - t.last_seen <= self.max_track_age]
+        return {
+            'boxes': [t.location for t in self.tracks],
+            'confirmed': [
+                self.is_confirmed(t, now) and (is_known is None or is_known(t.student_id))
+                for t in self.tracks
+            ],
+            'iou_threshold': self.iou_threshold
+        }
+
+    def is_confirmed(self, track, now=None):
+        """Трек уверенно опознан и перепроверялся недавно - encoding можно не считать"""
+        if track is None or track.student_id is None or track.last_encoded is None:
+            return False
+        now = time.monotonic() if now is None else now
+        return track.distance <= self.confident_distance and now - track.last_encoded < self.reencode_interval
+
+    def update(self, locations, assigned, fresh_matches, now=None):
+        """
+        Записать результаты кадра в треки (треки не должны меняться после prepare())
+        assigned: индексы треков из plan_encoding()
+        fresh_matches: {индекс рамки: результат match_encodings} для лиц, прошедших через encoder
+        Returns: список словарей {'student_id', 'distance', 'margin', 'track_id', 'tracked'} на каждую рамку
+        """
+        now = time.monotonic() if now is None else now
+        self.last_frame_at = now
+        tracks_before = list(self.tracks)
+        results = []
+        for i, (location, t) in enumerate(zip(locations, assigned)):
+            track = tracks_before[t] if t is not None else None
+            if track is None:
+                track = FaceTrack(next(self._track_ids), location, now)
+                self.tracks.append(track)
+            track.location = location
+            track.last_seen = now
+
+            match = fresh_matches.get(i)
+            if match is not None:
+                track.student_id = match['student_id']
+                track.distance = match['distance']
+                track.margin = match['margin']
+                track.last_encoded = now
+                self.encoded_faces += 1
+            else:
+                self.reused_faces += 1
+
+            results.append({
+                'student_id': track.student_id,
+                'distance': track.distance,
+                'margin': track.margin,
+                'track_id': track.track_id,
+                'tracked': match is None
+            })
+        return results
+
+
+    def stats(self):
+        """Счётчики камеры для мониторинга"""
+        stats = {
+            'tracks': len(self.tracks),
+            'encoded_faces': self.encoded_faces,
+            'reused_faces': self.reused_faces,
+            'idle_seconds': round(time.monotonic() - self.last_frame_at, 1)
+        }
+        if self.gate is not None:
+            stats['gate'] = self.gate.stats()
+        return stats
+
+
+class CameraSessions:
+    """Реестр трекеров по идентификатору камеры"""
+
+    def __init__(self, session_ttl=DEFAULT_SESSION_TTL, gate_options=None, **tracker_options):
+        self.session_ttl = session_ttl
+        # Параметры FrameChangeGate для каждой камеры (None - без пропуска кадров)
+        self.gate_options = gate_options
+        self.tracker_options = tracker_options
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, camera_id):
+        """Получить (или создать) трекер камеры; заодно удалить давно молчащие сессии"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [cid for cid, tracker in self._sessions.items() if now - tracker.last_frame_at > self.session_ttl]
+            for cid in expired:
+                del self._sessions[cid]
+            tracker = self._sessions.get(camera_id)
+            if tracker is None:
+                gate = FrameChangeGate(**self.gate_options) if self.gate_options is not None else None
+                tracker = FaceTracker(gate=gate, **self.tracker_options)
+                self._sessions[camera_id] = tracker
+            return tracker
+
+    def items(self):
+        """Снимок (camera_id, трекер) для статистики"""
+        with self._lock:
+            return list(self._sessions.items())
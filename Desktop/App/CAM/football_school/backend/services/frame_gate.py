@@ -0,0 +1,73 @@
+"""
+Пропуск неизменившихся кадров камеры
+
+Киоск присылает кадр каждые 2 секунды весь день, в том числе в пустой коридор.
+Перед детекцией кадр сжимается до маленькой серой миниатюры (см. payload_thumbnail
+в face_service.py) и сравнивается с миниатюрой последнего обработанного кадра
+этой камеры: если изменилась малая доля пикселей, детекция не запускается.
+"""
+import threading
+import time
+
+import numpy as np
+
+# Размер миниатюры (ширина, высота)
+THUMBNAIL_SIZE = (32, 24)
+# Изменение яркости пикселя миниатюры (0-255), которое считается изменением
+DEFAULT_PIXEL_DELTA = 20
+# Доля изменившихся пикселей, начиная с которой кадр обрабатывается
+DEFAULT_CHANGED_FRACTION = 0.02
+# Даже неизменный кадр обрабатывается не реже, чем раз в N секунд
+DEFAULT_REFRESH_INTERVAL = 10.0
+
+
+class FrameChangeGate:
+    """Детектор изменений кадров одной камеры"""
+
+    def __init__(self, pixel_delta=DEFAULT_PIXEL_DELTA, changed_fraction=DEFAULT_CHANGED_FRACTION,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        self.pixel_delta = pixel_delta
+        self.changed_fraction = changed_fraction
+        self.refresh_interval = refresh_interval
+        # Миниатюра последнего обработанного кадра
+        self.reference = None
+        self.reference_at = None
+        # Счётчики для мониторинга
+        self.frames_seen = 0
+        self.frames_skipped = 0
+        self.last_change = None
+        self._lock = threading.Lock()
+
+    def is_changed(self, thumbnail, now=None):
+        """
+        Отличается ли кадр от последнего обработанного
+        (True, если сравнивать не с чем или пора обновить эталон)
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.frames_seen += 1
+            if (thumbnail is None or self.reference is None or self.reference.shape != thumbnail.shape
+                    or now - self.reference_at >= self.refresh_interval):
+                self.last_change = None
+                return True
+            diff = np.abs(thumbnail.astype(np.int16) - self.reference)
+            self.last_change = np.count_nonzero(diff > self.pixel_delta) / diff.size
+            if self.last_change >= self.changed_fraction:
+                return True
+            self.frames_skipped += 1
+            return False
+
+    def mark_processed(self, thumbnail, now=None):
+        """Запомнить миниатюру кадра, который прошёл детекцию"""
+        if thumbnail is None:
+            return
+        with self._lock:
+            self.reference = thumbnail.astype(np.int16)
+            self.reference_at = time.monotonic() if now is None else now
+
+    def stats(self):
+        return {
+            'frames_seen': self.frames_seen,
+            'frames_skipped': self.frames_skipped,
+            'last_change': self.last_change
+        }
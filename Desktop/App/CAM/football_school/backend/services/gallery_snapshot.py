@@ -0,0 +1,202 @@
+"""
+Снимок галереи распознавания на диске
+
+Сборка галереи из БД (выборка всех активных учеников и разбор encodings) занимает
+секунды на десятках тысяч учеников и повторяется в каждом процессе gunicorn.
+Вместо этого галерея сохраняется в один .npy файл с номером версии в имени
+(подряд id учеников, матрица encodings и квадраты норм), а процессы подключают
+его через mmap только для чтения: страницы файла общие для всех процессов, новый
+процесс готов к распознаванию сразу. Снимок публикуется одним os.replace, поэтому
+при одновременной записи одной версии двумя процессами читатель видит целиком
+один из снимков, а не части разных (строки которых могут идти в разном порядке).
+
+Актуальная версия хранится в таблице face_gallery_state и увеличивается при
+каждом изменении галереи (добавление фото, смена статуса, удаление, импорт).
+Если снимка нужной версии нет, галерея собирается из БД и снимок записывается.
+"""
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy.exc import IntegrityError
+
+from backend.models.face_encoding import ENCODING_DIM
+from backend.models.models import db, FaceGalleryState
+
+# Байт на ученика в снимке: id (int64), encoding (float32), квадрат нормы (float32)
+ROW_BYTES = 8 + ENCODING_DIM * 4 + 4
+# Сколько последних версий снимка хранится (старую ещё может дочитывать другой процесс)
+KEEP_VERSIONS = 2
+# Как часто процесс сверяет свою версию галереи с БД (секунды)
+DEFAULT_CHECK_INTERVAL = 5.0
+
+# gallery_v<версия>.npy (и части снимков старого формата gallery_v<версия>_<часть>.npy)
+SNAPSHOT_FILE = re.compile(r'^gallery_v(\d+)(?:_\w+)?\.npy$')
+
+
+def current_gallery_version():
+    """Текущая версия галереи в БД (0, если галерея ещё не менялась)"""
+    version = db.session.query(FaceGalleryState.version).filter_by(id=1).scalar()
+    return version or 0
+
+
+def bump_gallery_version():
+    """
+    Отметить изменение галереи (отдельной транзакцией)
+    Returns: новая версия
+    """
+    for _ in range(2):
+        updated = FaceGalleryState.query.filter_by(id=1).update(
+            {FaceGalleryState.version: FaceGalleryState.version + 1}, synchronize_session=False
+        )
+        if updated == 0:
+            db.session.add(FaceGalleryState(id=1, version=1))
+        try:
+            db.session.commit()
+            break
+        except IntegrityError:
+            # Строку одновременно создал другой процесс - повторить через UPDATE
+            db.session.rollback()
+    return current_gallery_version()
+
+
+class GallerySnapshotStore:
+    """Файлы снимков галереи в одной папке"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, version):
+        return os.path.join(self.directory, f'gallery_v{version}.npy')
+
+    def write(self, version, student_ids, sq_norms, matrix):
+        """Записать снимок: один файл, собранный во временном и опубликованный os.replace"""
+        os.makedirs(self.directory, exist_ok=True)
+        ids = np.ascontiguousarray(student_ids, dtype=np.int64)
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        sq_norms = np.ascontiguousarray(sq_norms, dtype=np.float32)
+        if not len(ids) == len(sq_norms) == len(matrix):
+            raise ValueError('Размеры частей снимка галереи не совпадают')
+        # Части подряд в байтовом массиве: id с начала (выравнивание 8), дальше float32
+        packed = np.concatenate([ids.view(np.uint8), matrix.reshape(-1).view(np.uint8), sq_norms.view(np.uint8)])
+        path = self._path(version)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.save(f, packed)
+        os.replace(temp_path, path)
+        self._cleanup(version)
+
+    def load(self, version):
+        """
+        Подключить снимок через mmap (только чтение)
+        Returns: (student_ids, sq_norms, matrix) или None, если снимка нет или он повреждён
+        """
+        try:
+            packed = np.load(self._path(version), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if packed.dtype != np.uint8 or packed.ndim != 1 or len(packed) % ROW_BYTES:
+            return None
+        count = len(packed) // ROW_BYTES
+        ids_end = count * 8
+        matrix_end = ids_end + count * ENCODING_DIM * 4
+        ids = packed[:ids_end].view(np.int64)
+        matrix = packed[ids_end:matrix_end].view(np.float32).reshape(count, ENCODING_DIM)
+        sq_norms = packed[matrix_end:].view(np.float32)
+        return ids, sq_norms, matrix
+
+    def _cleanup(self, current_version):
+        for name in os.listdir(self.directory):
+            match = SNAPSHOT_FILE.match(name)
+            if match and int(match.group(1)) <= current_version - KEEP_VERSIONS:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+
+class GallerySync:
+    """Держит галерею сервиса этого процесса в соответствии с версией в БД"""
+
+    def __init__(self, service, store, rebuild, check_interval=DEFAULT_CHECK_INTERVAL):
+        self.service = service
+        self.store = store
+        # rebuild() - собрать галерею сервиса из БД (reload_face_encodings в app.py)
+        self.rebuild = rebuild
+        self.check_interval = check_interval
+        # Версия, которой соответствует галерея в памяти (None - не загружена или неизвестна)
+        self.version = None
+        self.source = None
+        self.loaded_at = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _fresh(self, now):
+        return (self.version is not None and self._checked_at is not None
+                and now - self._checked_at < self.check_interval)
+
+    def ensure(self):
+        """Загрузить галерею или перейти на новую версию (нужен контекст приложения)"""
+        now = time.monotonic()
+        if self._fresh(now):
+            return
+        with self._lock:
+            if self._fresh(now):
+                return
+            version = current_gallery_version()
+            self._checked_at = now
+            if version != self.version:
+                self._load(version)
+
+    def _load(self, version):
+        arrays = self.store.load(version)
+        if arrays is not None:
+            student_ids, sq_norms, matrix = arrays
+            self.service.set_gallery_views(matrix, student_ids, sq_norms)
+            self.source = 'snapshot'
+        else:
+            self.rebuild()
+            self._write(version)
+            self.source = 'db'
+        self.version = version
+        self.loaded_at = datetime.utcnow().isoformat(timespec='seconds')
+
+    def _write(self, version):
+        _, student_ids, sq_norms, matrix = self.service.gallery_snapshot()
+        try:
+            self.store.write(version, student_ids, sq_norms, matrix)
+        except OSError as e:
+            print(f"Не удалось сохранить снимок галереи: {e}")
+
+    def changed(self):
+        """
+        Галерея в памяти этого процесса уже изменена (upsert/remove) - поднять версию в БД.
+        Если до изменения галерея соответствовала предыдущей версии, снимок новой версии
+        пишется из памяти; иначе остальные изменения подтянутся при следующей проверке.
+        """
+        with self._lock:
+            previous = self.version
+            version = bump_gallery_version()
+            if previous is not None and version == previous + 1:
+                self.version = version
+                self._write(version)
+            else:
+                self.version = None
+            self._checked_at = time.monotonic()
+
+    def invalidate(self):
+        """Галерея изменена в обход памяти (импорт) - поднять версию и перезагрузить при следующем распознавании"""
+        with self._lock:
+            bump_gallery_version()
+            self.version = None
+
+    def stats(self):
+        return {
+            'version': self.version,
+            'source': self.source,
+            'loaded_at': self.loaded_at,
+            'check_interval': self.check_interval
+        }
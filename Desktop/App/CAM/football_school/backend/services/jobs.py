@@ -0,0 +1,218 @@
+"""
+Фоновые задачи веб-процесса
+
+Задача выполняется в пуле потоков, а тяжёлые вычисления (dlib) - в отдельном
+процессе через run_in_process, чтобы не отнимать GIL у потоков, которые
+обслуживают отметки с камеры. Состояние задачи хранится в таблице
+background_jobs, поэтому статус может запросить любой процесс gunicorn.
+
+Задача живёт в потоке процесса, который её поставил (worker: хост и pid). Пока она
+работает, heartbeat_at обновляется при запуске и при каждом progress() из задачи; вместе с
+ней обновляются задачи этого процесса, ждущие в очереди. Если процесс завершился
+(перезапуск gunicorn или сервера), задача помечается как failed: при запуске сервера -
+все незавершённые (fail_stale_jobs(all_jobs=True) в init_db), иначе - при запросе статуса
+и постановке новых задач, если процесса-владельца на этом хосте больше нет или отметка
+не обновлялась дольше JOB_STALE_AFTER (процесс на другом хосте).
+"""
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+from backend.models.models import db, BackgroundJob
+
+# Завершённые задачи старше этого срока удаляются при постановке новых
+JOB_TTL = timedelta(days=7)
+# Незавершённая задача без отметки о ходе работы дольше этого срока считается прерванной
+JOB_STALE_AFTER = timedelta(hours=1)
+STALE_MESSAGE = 'Задача прервана перезапуском сервера, повторите попытку'
+
+
+def worker_id():
+    """Процесс, выполняющий задачи: 'хост:pid'"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _worker_gone(worker):
+    """Процесс-владелец задачи завершён (проверяется только на этом хосте)"""
+    host, _, pid = (worker or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    if int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        return False
+    return False
+
+
+def _is_stale(job, now):
+    if job.status not in ('queued', 'running'):
+        return False
+    if _worker_gone(job.worker):
+        return True
+    # Задачи до появления heartbeat_at - по времени постановки
+    beat = job.heartbeat_at or job.created_at
+    return beat is not None and beat < now - JOB_STALE_AFTER
+
+
+def fail_stale_jobs(all_jobs=False):
+    """
+    Пометить прерванные задачи как failed (коммитит)
+    all_jobs: при запуске сервера - все незавершённые задачи (их потоки не пережили перезапуск)
+    Returns: число помеченных задач
+    """
+    now = datetime.utcnow()
+    jobs = [
+        job for job in BackgroundJob.query.filter(BackgroundJob.status.in_(['queued', 'running'])).all()
+        if all_jobs or _is_stale(job, now)
+    ]
+    for job in jobs:
+        job.status = 'failed'
+        job.message = STALE_MESSAGE
+        job.finished_at = now
+    db.session.commit()
+    return len(jobs)
+
+
+class JobFailed(Exception):
+    """Ожидаемая ошибка задачи: сообщение показывается пользователю"""
+
+
+class JobQueue:
+    """Очередь фоновых задач с состоянием в БД"""
+
+    def __init__(self, app, workers=2, processes=1):
+        self.app = app
+        self.workers = max(1, int(workers))
+        # Процессов для тяжёлых вычислений (0 - считать прямо в потоке задачи)
+        self.processes = max(0, int(processes))
+        self._threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # id задачи, которую выполняет текущий поток (для progress)
+        self._current = threading.local()
+
+    def submit(self, kind, function, *args, student_id=None):
+        """
+        Поставить задачу в очередь (строка задачи коммитится в текущей сессии)
+        function(*args) выполняется в контексте приложения и возвращает словарь с 'message'
+        (и 'result' - данные для клиента, сохраняются в JSON) или None; долгая задача
+        вызывает progress(), иначе через JOB_STALE_AFTER она считается прерванной
+        Returns: id задачи
+        """
+        BackgroundJob.query.filter(
+            BackgroundJob.status.in_(['done', 'failed']),
+            BackgroundJob.created_at < datetime.utcnow() - JOB_TTL
+        ).delete(synchronize_session=False)
+        fail_stale_jobs()
+        job = BackgroundJob(id=uuid.uuid4().hex, kind=kind, status='queued', student_id=student_id,
+                            worker=worker_id(), heartbeat_at=datetime.utcnow())
+        db.session.add(job)
+        db.session.commit()
+        self._threads.submit(self._run, job.id, function, args)
+        return job.id
+
+    def _run(self, job_id, function, args):
+        with self.app.app_context():
+            self._beat(job_id, status='running', started_at=datetime.utcnow())
+            self._current.job_id = job_id
+            try:
+                result = function(*args) or {}
+            except JobFailed as e:
+                db.session.rollback()
+                self._update(job_id, status='failed', message=str(e), finished_at=datetime.utcnow())
+                return
+            except Exception as e:
+                db.session.rollback()
+                print(f"Ошибка фоновой задачи {job_id}: {e}")
+                self._update(job_id, status='failed', message=f'Ошибка обработки: {e}', finished_at=datetime.utcnow())
+                return
+            finally:
+                self._current.job_id = None
+            self._update(
+                job_id, status='done', message=result.get('message'),
+                result=json.dumps(result['result'], ensure_ascii=False) if result.get('result') is not None else None,
+                finished_at=datetime.utcnow()
+            )
+
+    def progress(self, message=None):
+        """
+        Отметить ход текущей задачи (из потока задачи; коммитит текущую сессию)
+        message: что показать пользователю, например 'Обработано 100 из 500'
+        """
+        job_id = getattr(self._current, 'job_id', None)
+        if job_id is None:
+            return
+        fields = {'message': message} if message is not None else {}
+        self._beat(job_id, **fields)
+
+    @classmethod
+    def _beat(cls, job_id, **fields):
+        now = datetime.utcnow()
+        # Задачи этого процесса в очереди ждут живую задачу - они тоже не прерваны
+        BackgroundJob.query.filter(
+            BackgroundJob.status == 'queued', BackgroundJob.worker == worker_id(), BackgroundJob.id != job_id
+        ).update({BackgroundJob.heartbeat_at: now}, synchronize_session=False)
+        cls._update(job_id, heartbeat_at=now, **fields)
+
+    @staticmethod
+    def _update(job_id, **fields):
+        job = db.session.get(BackgroundJob, job_id)
+        if job is None:
+            return
+        for key, value in fields.items():
+            setattr(job, key, value)
+        db.session.commit()
+
+    @staticmethod
+    def get(job_id):
+        """Returns: состояние задачи (словарь) или None; прерванная задача помечается как failed"""
+        job = db.session.get(BackgroundJob, job_id)
+        if job is None:
+            return None
+        now = datetime.utcnow()
+        if _is_stale(job, now):
+            job.status = 'failed'
+            job.message = STALE_MESSAGE
+            job.finished_at = now
+            db.session.commit()
+        return job.to_dict()
+
+    def run_in_process(self, function, *args):
+        """Выполнить функцию модуля в процессе пула и дождаться результата (из потока задачи)"""
+        if self.processes == 0:
+            return function(*args)
+        try:
+            return self._get_pool().submit(function, *args).result()
+        except BrokenProcessPool:
+            self._reset_pool()
+            raise JobFailed('Процесс обработки перезапущен, повторите попытку')
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn: процессы не наследуют потоки и соединения с БД веб-процесса
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._pool
+
+    def _reset_pool(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def shutdown(self):
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        self._reset_pool()
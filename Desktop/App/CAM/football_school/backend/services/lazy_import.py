@@ -0,0 +1,56 @@
+"""
+Отложенный импорт тяжёлых модулей распознавания
+
+import face_recognition загружает dlib и его модели (сотни МБ и несколько секунд),
+import cv2 - ещё десятки МБ. Процессам, которые не видят кадров камеры (миграции,
+создание админа, gunicorn-воркеры с финансами и админкой), это не нужно, поэтому
+модули подключаются при первом обращении к атрибуту:
+
+    cv2 = LazyModule('cv2')
+    ...
+    cv2.resize(...)  # здесь происходит настоящий import
+"""
+import importlib
+import sys
+import threading
+
+# Модули стека распознавания (см. preload_recognition_modules)
+RECOGNITION_MODULES = ('cv2', 'face_recognition')
+
+
+class LazyModule:
+    """Заместитель модуля: импортирует его при первом обращении к атрибуту"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    @property
+    def loaded(self):
+        return self._module is not None or self._name in sys.modules
+
+    def __repr__(self):
+        state = 'загружен' if self.loaded else 'не загружен'
+        return f'<LazyModule {self._name} ({state})>'
+
+
+def preload_recognition_modules():
+    """Импортировать стек распознавания заранее (процессы пула, киоск с FACE_PRELOAD=1)"""
+    for name in RECOGNITION_MODULES:
+        importlib.import_module(name)
+
+
+def recognition_modules_loaded():
+    """Какие модули распознавания уже импортированы в этом процессе"""
+    return {name: name in sys.modules for name in RECOGNITION_MODULES}
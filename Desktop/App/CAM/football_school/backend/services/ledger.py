@@ -0,0 +1,179 @@
+"""
+Итоги для расчёта баланса учеников
+
+Баланс = (сумма оплат / стоимость 1 занятия) - количество посещений. Раньше сумма
+и количество пересчитывались по всей истории при каждом чтении; теперь они хранятся
+в строке student_ledger и меняются в той же транзакции, что и оплата или посещение:
+
+    db.session.add(payment)
+    ledger_add(student_id, paid=payment.amount_paid)
+    db.session.commit()
+
+Чтение баланса - одна строка по первичному ключу. Вместе с итогами хранится сам
+баланс в занятиях (по индексу строится список учеников с низким балансом); он
+пересчитывается при изменении итогов, тарифа ученика или цены тарифа
+(refresh_balances). Если итоги разошлись с историей (правка БД вручную, старые
+версии приложения), их пересобирает reconcile_ledger.py.
+"""
+from datetime import datetime
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from backend.models.models import db, Student, Payment, Attendance, Tariff, StudentLedger
+
+# Больше id в одном IN (...) не передаётся (ограничение SQLite на число параметров)
+CHUNK_SIZE = 500
+
+
+def lesson_balance(total_paid, lessons_attended, price, lessons_count, legacy_balance):
+    """
+    Баланс в занятиях = (сумма оплат / стоимость 1 занятия) - количество посещений
+    Стоимость 1 занятия = цена тарифа / кол-во занятий в тарифе
+    """
+    lesson_price = 0
+    if price and lessons_count and lessons_count > 0:
+        lesson_price = float(price) / float(lessons_count)
+    if lesson_price <= 0:
+        # Если тариф не задан или некорректный, возвращаем старый баланс
+        return legacy_balance if legacy_balance else 0
+    # Баланс в занятиях = оплачено занятий - посещено занятий
+    return int((total_paid or 0) / lesson_price) - (lessons_attended or 0)
+
+
+def history_totals(student_ids=None):
+    """
+    Итоги по истории оплат и посещений
+    student_ids: id учеников (None - все ученики)
+    Returns: словарь {student_id: (сумма оплат, число посещений)}
+    """
+    paid = db.session.query(
+        Payment.student_id.label('student_id'),
+        db.func.sum(Payment.amount_paid).label('total_paid')
+    )
+    visits = db.session.query(
+        Attendance.student_id.label('student_id'),
+        db.func.count(Attendance.id).label('visits')
+    )
+    if student_ids is not None:
+        paid = paid.filter(Payment.student_id.in_(student_ids))
+        visits = visits.filter(Attendance.student_id.in_(student_ids))
+    paid = paid.group_by(Payment.student_id).subquery()
+    visits = visits.group_by(Attendance.student_id).subquery()
+
+    query = db.session.query(Student.id, paid.c.total_paid, visits.c.visits) \
+        .outerjoin(paid, paid.c.student_id == Student.id) \
+        .outerjoin(visits, visits.c.student_id == Student.id)
+    if student_ids is not None:
+        query = query.filter(Student.id.in_(student_ids))
+    return {
+        student_id: (float(total_paid or 0), int(visit_count or 0))
+        for student_id, total_paid, visit_count in query.all()
+    }
+
+
+def ledger_add(student_id, paid=0.0, lessons=0):
+    """
+    Изменить итоги ученика в текущей транзакции (коммитит вызывающий код).
+    Вызывается после изменения оплаты/посещения в сессии: если строки итогов ещё нет,
+    она создаётся по истории, которая уже включает это изменение.
+    """
+    values = {
+        StudentLedger.total_paid: StudentLedger.total_paid + paid,
+        StudentLedger.lessons_attended: StudentLedger.lessons_attended + lessons,
+        StudentLedger.updated_at: datetime.utcnow()
+    }
+    if not StudentLedger.query.filter_by(student_id=student_id).update(values, synchronize_session=False):
+        try:
+            with db.session.begin_nested():
+                refresh_balances([student_id])
+            return
+        except IntegrityError:
+            # Строку одновременно создал другой запрос - применить изменение к ней
+            StudentLedger.query.filter_by(student_id=student_id).update(values, synchronize_session=False)
+    refresh_balances([student_id])
+
+
+def refresh_balances(student_ids):
+    """
+    Пересчитать сохранённый баланс учеников (после изменения итогов, тарифа ученика
+    или цены тарифа) в текущей транзакции; недостающие строки создаются по истории
+    """
+    student_ids = sorted(set(student_ids))
+    if not student_ids:
+        return
+    db.session.flush()
+    for start in range(0, len(student_ids), CHUNK_SIZE):
+        chunk = student_ids[start:start + CHUNK_SIZE]
+        rows = db.session.query(
+            Student.id, Student.balance, Tariff.price, Tariff.lessons_count,
+            StudentLedger.student_id, StudentLedger.total_paid, StudentLedger.lessons_attended
+        ).outerjoin(Tariff, Tariff.id == Student.tariff_id) \
+         .outerjoin(StudentLedger, StudentLedger.student_id == Student.id) \
+         .filter(Student.id.in_(chunk)).all()
+        missing = [row[0] for row in rows if row[4] is None]
+        history = history_totals(missing) if missing else {}
+
+        changes = []
+        for student_id, legacy_balance, price, lessons_count, ledger_id, total_paid, lessons_attended in rows:
+            if ledger_id is None:
+                total_paid, lessons_attended = history[student_id]
+                db.session.add(StudentLedger(
+                    student_id=student_id,
+                    total_paid=total_paid,
+                    lessons_attended=lessons_attended,
+                    balance=lesson_balance(total_paid, lessons_attended, price, lessons_count, legacy_balance)
+                ))
+            else:
+                changes.append({
+                    'student_id': student_id,
+                    'balance': lesson_balance(total_paid, lessons_attended, price, lessons_count, legacy_balance)
+                })
+        if changes:
+            db.session.execute(update(StudentLedger), changes)
+    db.session.flush()
+
+
+def rebuild_ledger(dry_run=False):
+    """
+    Сверить итоги и балансы всех учеников с историей и исправить расхождения
+    (отдельной транзакцией)
+    dry_run: только найти расхождения, ничего не записывая
+    Returns: список (student_id, (оплачено, посещений, баланс) в таблице или None, ожидаемые)
+    """
+    totals = history_totals()
+    tariffs = {
+        student_id: (legacy_balance, price, lessons_count)
+        for student_id, legacy_balance, price, lessons_count in db.session.query(
+            Student.id, Student.balance, Tariff.price, Tariff.lessons_count
+        ).outerjoin(Tariff, Tariff.id == Student.tariff_id).all()
+    }
+    stored = {row.student_id: row for row in StudentLedger.query.all()}
+    mismatches = []
+    for student_id, (total_paid, lessons_attended) in sorted(totals.items()):
+        legacy_balance, price, lessons_count = tariffs[student_id]
+        expected = (total_paid, lessons_attended,
+                    lesson_balance(total_paid, lessons_attended, price, lessons_count, legacy_balance))
+        row = stored.get(student_id)
+        current = (row.total_paid, row.lessons_attended, row.balance) if row else None
+        if (current is not None and abs(current[0] - expected[0]) < 0.005
+                and current[1:] == expected[1:]):
+            continue
+        mismatches.append((student_id, current, expected))
+        if dry_run:
+            continue
+        if row is None:
+            row = StudentLedger(student_id=student_id)
+            db.session.add(row)
+        row.total_paid, row.lessons_attended, row.balance = expected
+
+    if not dry_run:
+        db.session.commit()
+    return mismatches
+
+
+def ledger_needs_rebuild():
+    """Итоги ещё не заполнялись или без баланса (первый запуск после обновления)"""
+    if db.session.query(StudentLedger.student_id).first() is None:
+        return db.session.query(Student.id).first() is not None
+    return db.session.query(StudentLedger.student_id).filter(StudentLedger.balance.is_(None)).first() is not None
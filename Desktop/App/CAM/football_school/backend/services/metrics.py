@@ -0,0 +1,106 @@
+"""
+Замер времени этапов распознавания
+
+StageTimer собирает время этапов одного запроса (загрузка, декодирование,
+детекция, encoding, сопоставление, запросы к БД...) и счётчики (лиц в кадре).
+LatencyMetrics хранит последние N замеров каждого этапа и отдаёт скользящие
+перцентили - по ним подбираются параметры детекции и размер контейнера.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# Сколько последних замеров хранится на каждый этап
+DEFAULT_WINDOW = 1000
+PERCENTILES = (50, 90, 99)
+
+
+class StageTimer:
+    """Время этапов одного запроса (повторные замеры одного этапа суммируются)"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counts = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - started) * 1000)
+
+    def add(self, name, milliseconds):
+        self.stages[name] = self.stages.get(name, 0.0) + milliseconds
+
+    def merge(self, stages):
+        """Добавить замеры, сделанные в другом процессе (словарь этап -> мс)"""
+        for name, milliseconds in stages.items():
+            self.add(name, milliseconds)
+
+    def count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def total(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def header_value(self):
+        """Значение для отладочного заголовка в формате Server-Timing: 'decode;dur=3.1, ...'"""
+        parts = [f'{name};dur={milliseconds:.1f}' for name, milliseconds in self.stages.items()]
+        parts.append(f'total;dur={self.total():.1f}')
+        parts.extend(f'{name};desc={value}' for name, value in self.counts.items())
+        return ', '.join(parts)
+
+
+def _summary(values):
+    data = np.fromiter(values, dtype=np.float64)
+    if data.size == 0:
+        return {'count': 0}
+    summary = {'count': int(data.size), 'mean': round(float(data.mean()), 2), 'max': round(float(data.max()), 2)}
+    for p, value in zip(PERCENTILES, np.percentile(data, PERCENTILES)):
+        summary[f'p{p}'] = round(float(value), 2)
+    return summary
+
+
+class LatencyMetrics:
+    """Скользящее окно замеров по этапам и по эндпоинтам"""
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self._stages = {}
+        self._endpoints = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def _series(self, registry, name):
+        series = registry.get(name)
+        if series is None:
+            series = registry[name] = deque(maxlen=self.window)
+        return series
+
+    def record(self, endpoint, timer):
+        """Сохранить замеры завершённого запроса"""
+        total = timer.total()
+        with self._lock:
+            self._series(self._endpoints, endpoint).append(total)
+            for name, milliseconds in timer.stages.items():
+                self._series(self._stages, name).append(milliseconds)
+            for name, value in timer.counts.items():
+                self._series(self._counts, name).append(value)
+
+    def snapshot(self):
+        """Перцентили (мс) по этапам и эндпоинтам, распределение счётчиков (лиц в кадре и т.п.)"""
+        with self._lock:
+            stages = {name: list(series) for name, series in self._stages.items()}
+            endpoints = {name: list(series) for name, series in self._endpoints.items()}
+            counts = {name: list(series) for name, series in self._counts.items()}
+        return {
+            'window': self.window,
+            'stages': {name: _summary(values) for name, values in stages.items()},
+            'endpoints': {name: _summary(values) for name, values in endpoints.items()},
+            'counts': {name: _summary(values) for name, values in counts.items()}
+        }
@@ -0,0 +1,244 @@
+"""
+Помесячные начисления учеников
+
+Для каждого активного ученика с тарифом в student_month_dues есть строка на каждый
+месяц с месяца принятия (без даты - с января текущего года) по текущий: цена тарифа
+(due), сумма оплат за месяц по payment_year/payment_month (paid) и остаток (remainder).
+Месяцы, за которые есть оплаты вне этой сетки, тоже получают строку.
+
+Строки меняются в той же транзакции, что и оплата (dues_add), и пересчитываются при
+смене тарифа, даты принятия или статуса ученика и цены тарифа (sync_month_dues).
+Строки нового месяца создаются при первом обращении в этом месяце (ensure_current_month).
+Список должников, итоги по месяцам и проверка переплаты - выборки по индексу вместо
+сумм по payments. Расхождения с историей исправляет reconcile_ledger.py.
+"""
+import threading
+from datetime import date, datetime
+
+from sqlalchemy import case, extract
+from sqlalchemy.exc import IntegrityError
+
+from backend.models.models import db, Student, Payment, Tariff, StudentMonthDue
+
+# Больше id в одном IN (...) не передаётся (ограничение SQLite на число параметров)
+CHUNK_SIZE = 500
+
+_filled_month = None
+_fill_lock = threading.Lock()
+
+
+def iter_months(start, end):
+    """Месяцы (год, месяц) от start до end включительно"""
+    year, month = start
+    while (year, month) <= end:
+        yield year, month
+        month += 1
+        if month > 12:
+            month = 1
+            year += 1
+
+
+def billable_start(admission_date, today):
+    """Первый оплачиваемый месяц: месяц принятия, без даты - январь текущего года"""
+    if admission_date:
+        return admission_date.year, admission_date.month
+    return today.year, 1
+
+
+def month_period(year_column, month_column):
+    """Порядковый номер месяца (год * 12 + месяц) для сравнения диапазонов в SQL"""
+    return year_column * 12 + month_column
+
+
+def billable_start_period(admission_column, today):
+    """billable_start в SQL: порядковый номер первого оплачиваемого месяца"""
+    return case(
+        (admission_column.isnot(None),
+         month_period(extract('year', admission_column), extract('month', admission_column))),
+        else_=today.year * 12 + 1
+    )
+
+
+def _remainder(due, paid):
+    return case((due > paid, due - paid), else_=0)
+
+
+def month_paid(student_id, year, month):
+    """Сколько уже оплачено за месяц (0, если месяц не указан или оплат нет)"""
+    if not year or not month:
+        return 0
+    paid = db.session.query(StudentMonthDue.paid).filter_by(
+        student_id=student_id, year=year, month=month
+    ).scalar()
+    return paid or 0
+
+
+def month_paid_totals(student_ids=None):
+    """Суммы оплат по истории: {(student_id, год, месяц): сумма}"""
+    query = db.session.query(
+        Payment.student_id, Payment.payment_year, Payment.payment_month, db.func.sum(Payment.amount_paid)
+    ).filter(Payment.payment_year.isnot(None), Payment.payment_month.isnot(None))
+    if student_ids is not None:
+        query = query.filter(Payment.student_id.in_(student_ids))
+    return {
+        (student_id, year, month): float(total or 0)
+        for student_id, year, month, total in query.group_by(
+            Payment.student_id, Payment.payment_year, Payment.payment_month
+        ).all()
+    }
+
+
+def dues_add(student_id, year, month, paid):
+    """
+    Изменить оплату ученика за месяц в текущей транзакции (коммитит вызывающий код).
+    Вызывается после изменения оплаты в сессии; оплаты без месяца пропускаются.
+    """
+    if not year or not month:
+        return
+    new_paid = StudentMonthDue.paid + paid
+    values = {
+        StudentMonthDue.paid: new_paid,
+        StudentMonthDue.remainder: _remainder(StudentMonthDue.due, new_paid),
+        StudentMonthDue.updated_at: datetime.utcnow()
+    }
+    key = {'student_id': student_id, 'year': year, 'month': month}
+    if StudentMonthDue.query.filter_by(**key).update(values, synchronize_session=False):
+        return
+
+    # Строки ещё нет - создать по истории, которая уже включает это изменение
+    db.session.flush()
+    price = db.session.query(Tariff.price).join(Student, Student.tariff_id == Tariff.id) \
+        .filter(Student.id == student_id).scalar()
+    due = float(price or 0)
+    total = month_paid_totals([student_id]).get((student_id, year, month), 0)
+    try:
+        with db.session.begin_nested():
+            db.session.add(StudentMonthDue(due=due, paid=total, remainder=max(0, due - total), **key))
+    except IntegrityError:
+        # Строку одновременно создал другой запрос - применить изменение к ней
+        StudentMonthDue.query.filter_by(**key).update(values, synchronize_session=False)
+
+
+def sync_month_dues(student_ids, today=None):
+    """
+    Привести строки учеников к их тарифу и сетке месяцев в текущей транзакции:
+    due всех строк = текущая цена тарифа, недостающие месяцы создаются
+    """
+    today = today or date.today()
+    current = (today.year, today.month)
+    student_ids = sorted(set(student_ids))
+    if not student_ids:
+        return
+    db.session.flush()
+    for start in range(0, len(student_ids), CHUNK_SIZE):
+        chunk = student_ids[start:start + CHUNK_SIZE]
+        students = db.session.query(
+            Student.id, Student.status, Student.admission_date, Tariff.price
+        ).outerjoin(Tariff, Tariff.id == Student.tariff_id).filter(Student.id.in_(chunk)).all()
+
+        # Цена тарифа во всех строках - одним UPDATE на каждую цену
+        by_price = {}
+        for student_id, _, _, price in students:
+            by_price.setdefault(float(price or 0), []).append(student_id)
+        for price, price_ids in by_price.items():
+            StudentMonthDue.query.filter(StudentMonthDue.student_id.in_(price_ids)).update({
+                StudentMonthDue.due: price,
+                StudentMonthDue.remainder: _remainder(db.literal(price), StudentMonthDue.paid),
+                StudentMonthDue.updated_at: datetime.utcnow()
+            }, synchronize_session=False)
+
+        existing = set(db.session.query(
+            StudentMonthDue.student_id, StudentMonthDue.year, StudentMonthDue.month
+        ).filter(StudentMonthDue.student_id.in_(chunk)).all())
+        totals = None
+        for student_id, status, admission_date, price in students:
+            if status != 'active' or price is None:
+                continue
+            due = float(price)
+            for year, month in iter_months(billable_start(admission_date, today), current):
+                key = (student_id, year, month)
+                if key in existing:
+                    continue
+                if totals is None:
+                    totals = month_paid_totals(chunk)
+                paid = totals.get(key, 0)
+                db.session.add(StudentMonthDue(
+                    student_id=student_id, year=year, month=month,
+                    due=due, paid=paid, remainder=max(0, due - paid)
+                ))
+    db.session.flush()
+
+
+def ensure_current_month():
+    """Создать строки текущего месяца (один раз на процесс в месяц; нужен контекст приложения)"""
+    global _filled_month
+    today = date.today()
+    current = (today.year, today.month)
+    if _filled_month == current:
+        return
+    with _fill_lock:
+        if _filled_month == current:
+            return
+        student_ids = [row[0] for row in db.session.query(Student.id).filter(
+            Student.status == 'active', Student.tariff_id.isnot(None)
+        ).all()]
+        try:
+            sync_month_dues(student_ids, today)
+            db.session.commit()
+        except IntegrityError:
+            # Строки одновременно создал другой процесс
+            db.session.rollback()
+            return
+        _filled_month = current
+
+
+def rebuild_month_dues(dry_run=False):
+    """
+    Сверить строки всех учеников с историей оплат и тарифами и исправить расхождения
+    (отдельной транзакцией)
+    dry_run: только найти расхождения, ничего не записывая
+    Returns: список (student_id, год, месяц, (due, paid) в таблице или None, ожидаемые)
+    """
+    today = date.today()
+    current = (today.year, today.month)
+    students = db.session.query(
+        Student.id, Student.status, Student.admission_date, Tariff.price
+    ).outerjoin(Tariff, Tariff.id == Student.tariff_id).all()
+    prices = {student_id: float(price or 0) for student_id, _, _, price in students}
+
+    totals = month_paid_totals()
+    stored = {(row.student_id, row.year, row.month): row for row in StudentMonthDue.query.all()}
+    keys = set(totals) | set(stored)
+    for student_id, status, admission_date, price in students:
+        if status == 'active' and price is not None:
+            keys.update((student_id, year, month)
+                        for year, month in iter_months(billable_start(admission_date, today), current))
+
+    mismatches = []
+    for key in sorted(keys):
+        student_id, year, month = key
+        expected = (prices.get(student_id, 0), totals.get(key, 0))
+        row = stored.get(key)
+        current_values = (row.due, row.paid) if row else None
+        if (current_values is not None and abs(current_values[0] - expected[0]) < 0.005
+                and abs(current_values[1] - expected[1]) < 0.005):
+            continue
+        mismatches.append((student_id, year, month, current_values, expected))
+        if dry_run:
+            continue
+        if row is None:
+            row = StudentMonthDue(student_id=student_id, year=year, month=month)
+            db.session.add(row)
+        row.due, row.paid = expected
+        row.remainder = max(0, expected[0] - expected[1])
+
+    if not dry_run:
+        db.session.commit()
+    return mismatches
+
+
+def month_dues_need_rebuild():
+    """Строки ещё не заполнялись (первый запуск после обновления)"""
+    if db.session.query(StudentMonthDue.student_id).first() is not None:
+        return False
+    return db.session.query(Student.id).filter(Student.tariff_id.isnot(None)).first() is not None
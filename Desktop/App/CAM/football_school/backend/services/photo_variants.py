@@ -0,0 +1,119 @@
+"""
+Уменьшенные копии фото учеников
+
+Оригинал с телефона (несколько МБ) нужен только для расчёта face encoding,
+в интерфейсе показываются копии фиксированного размера:
+- avatar - квадрат 96x96 (аватары в списках и рейтинге, с запасом под Retina);
+- card - вписано в 320x320 (карточка ученика, превью в форме);
+- face - квадрат 160x160 вокруг найденного лица (экран отметки на камере).
+
+В имени файла - хеш содержимого оригинала, поэтому копии отдаются с бессрочным
+кешем (маршрут /photos/<filename> в app.py): новое фото получает новый URL.
+"""
+import hashlib
+import io
+import os
+
+import numpy as np
+from PIL import Image, ImageOps, features
+
+# Вариант -> (сторона в пикселях, способ кадрирования: center, fit или face)
+PHOTO_VARIANTS = {
+    'avatar': (96, 'center'),
+    'card': (320, 'fit'),
+    'face': (160, 'face')
+}
+# Увеличивается при изменении размеров или качества - у копий меняются имена и URL
+VARIANTS_REVISION = 1
+VARIANT_QUALITY = 82
+# Папка проекта (как basedir в app.py): копии пишутся и отдаются по одному пути из любого рабочего каталога
+basedir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+VARIANTS_FOLDER = os.path.join(basedir, 'frontend', 'static', 'uploads', 'variants')
+# Рамка лица расширяется на эту долю с каждой стороны (волосы, подбородок)
+FACE_MARGIN = 0.4
+
+
+def variant_format():
+    """WebP, если Pillow собран с его поддержкой, иначе JPEG; Returns: (формат PIL, расширение)"""
+    return ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+
+
+def load_photo(data):
+    """
+    Декодировать фото с учётом EXIF-ориентации (снимки с телефона часто повёрнуты)
+    Returns: numpy array RGB
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        return np.asarray(ImageOps.exif_transpose(image).convert('RGB'))
+
+
+def photo_digest(data):
+    """Хеш содержимого оригинала (вместе с ревизией вариантов) для имён файлов копий"""
+    digest = hashlib.sha256(data)
+    digest.update(f'rev{VARIANTS_REVISION}'.encode())
+    return digest.hexdigest()[:16]
+
+
+def _square_box(width, height, face_location):
+    """Квадратная область кадрирования: вокруг лица или по центру"""
+    if face_location is not None:
+        top, right, bottom, left = face_location
+        side = max(bottom - top, right - left) * (1 + 2 * FACE_MARGIN)
+        center_x, center_y = (left + right) / 2, (top + bottom) / 2
+    else:
+        side = min(width, height)
+        center_x, center_y = width / 2, height / 2
+    side = min(side, width, height)
+    left = int(round(min(max(center_x - side / 2, 0), width - side)))
+    top = int(round(min(max(center_y - side / 2, 0), height - side)))
+    return left, top, left + int(side), top + int(side)
+
+
+def render_photo_variants(image, face_location=None):
+    """
+    Сделать уменьшенные копии фото
+    image: numpy array RGB (см. load_photo)
+    face_location: (top, right, bottom, left) лица на image или None (face - по центру)
+    Returns: {вариант: байты файла}
+    """
+    source = Image.fromarray(image)
+    file_format, _ = variant_format()
+    rendered = {}
+    for name, (size, crop) in PHOTO_VARIANTS.items():
+        if crop == 'fit':
+            variant = source.copy()
+            variant.thumbnail((size, size), Image.LANCZOS)
+        else:
+            box = _square_box(source.width, source.height, face_location if crop == 'face' else None)
+            variant = source.resize((size, size), Image.LANCZOS, box=box)
+        buffer = io.BytesIO()
+        variant.save(buffer, file_format, quality=VARIANT_QUALITY)
+        rendered[name] = buffer.getvalue()
+    return rendered
+
+
+def save_photo_variants(rendered, student_id, digest):
+    """
+    Записать копии в VARIANTS_FOLDER
+    Returns: {'digest': digest, вариант: имя файла} - значение для Student.set_photo_variants
+    """
+    os.makedirs(VARIANTS_FOLDER, exist_ok=True)
+    _, extension = variant_format()
+    variants = {'digest': digest}
+    for name, data in rendered.items():
+        filename = f'student_{student_id}_{name}_{digest}.{extension}'
+        with open(os.path.join(VARIANTS_FOLDER, filename), 'wb') as f:
+            f.write(data)
+        variants[name] = filename
+    return variants
+
+
+def remove_photo_variants(variants, keep=None):
+    """Удалить файлы копий (кроме тех, что есть в keep)"""
+    keep_files = set((keep or {}).values())
+    for name in PHOTO_VARIANTS:
+        filename = (variants or {}).get(name)
+        if filename and filename not in keep_files:
+            path = os.path.join(VARIANTS_FOLDER, filename)
+            if os.path.exists(path):
+                os.remove(path)
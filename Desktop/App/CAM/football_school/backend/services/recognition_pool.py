@@ -0,0 +1,356 @@
+"""
+Выполнение распознавания вне потоков gunicorn
+
+RecognitionExecutor принимает кадр из запроса и распознаёт его либо прямо в
+потоке запроса (workers=0), либо в отдельном пуле процессов. В режиме пула:
+- очередь ограничена: при переполнении кадр отклоняется (RecognitionBusy);
+- кадры одной камеры не копятся: пока её кадр в работе, новые пропускаются;
+- кадр камеры, не изменившийся с последнего обработанного, отклоняется
+  (FrameUnchanged) до декодирования и детекции - в обоих режимах;
+- галерея передаётся процессам через разделяемую память и публикуется
+  заново только после изменений (по счётчику generation сервиса).
+"""
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from backend.models.face_encoding import ENCODING_DIM
+from backend.services.face_index import create_face_index
+from backend.services.face_service import FaceRecognitionService, cv2, decode_frame_payload, payload_thumbnail
+from backend.services.lazy_import import preload_recognition_modules
+from backend.services.metrics import StageTimer
+
+# Сколько секунд запрос ждёт результат из пула
+DEFAULT_TIMEOUT = 20.0
+
+
+class RecognitionBusy(Exception):
+    """Пул распознавания перегружен или кадр этой камеры ещё обрабатывается"""
+
+
+class FrameUnchanged(Exception):
+    """Кадр камеры не изменился с последнего обработанного - детекция не нужна"""
+
+
+# ===== РАЗДЕЛЯЕМАЯ ГАЛЕРЕЯ =====
+
+def _gallery_layout(count):
+    """Смещения массивов в сегменте: ids (int64) | sq_norms (float32) | matrix (float32 N x 128)"""
+    ids_bytes = count * 8
+    norms_bytes = count * 4
+    matrix_bytes = count * ENCODING_DIM * 4
+    return ids_bytes, ids_bytes + norms_bytes, ids_bytes + norms_bytes + matrix_bytes
+
+
+def _gallery_views(buffer, count):
+    """Массивы numpy поверх буфера сегмента"""
+    norms_offset, matrix_offset, total = _gallery_layout(count)
+    ids = np.ndarray((count,), dtype=np.int64, buffer=buffer, offset=0)
+    sq_norms = np.ndarray((count,), dtype=np.float32, buffer=buffer, offset=norms_offset)
+    matrix = np.ndarray((count, ENCODING_DIM), dtype=np.float32, buffer=buffer, offset=matrix_offset)
+    return ids, sq_norms, matrix
+
+
+class SharedGallery:
+    """Публикация галереи сервиса в разделяемую память (сторона веб-процесса)"""
+
+    def __init__(self, service):
+        self.service = service
+        self.generation = None
+        self.descriptor = None
+        # Предыдущий сегмент живёт до следующей публикации: его ещё может читать процесс пула
+        self._segments = []
+        self._lock = threading.Lock()
+
+    def current(self):
+        """Описание актуального сегмента (публикует новый, если галерея изменилась)"""
+        with self._lock:
+            if self.generation != self.service.generation:
+                self._publish()
+            return self.descriptor
+
+    def _publish(self):
+        generation, ids, sq_norms, matrix = self.service.gallery_snapshot()
+        count = len(ids)
+        _, _, total = _gallery_layout(count)
+        segment = shared_memory.SharedMemory(create=True, size=max(total, 1))
+        shm_ids, shm_norms, shm_matrix = _gallery_views(segment.buf, count)
+        shm_ids[:] = ids
+        shm_norms[:] = sq_norms
+        shm_matrix[:] = matrix
+        del shm_ids, shm_norms, shm_matrix
+
+        self._segments.append(segment)
+        while len(self._segments) > 2:
+            self._release(self._segments.pop(0))
+        self.generation = generation
+        self.descriptor = {'name': segment.name, 'count': count, 'generation': generation}
+
+    @staticmethod
+    def _release(segment):
+        segment.close()
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments:
+                self._release(segment)
+            self._segments = []
+            self.generation = None
+            self.descriptor = None
+
+
+# ===== ПРОЦЕСС ПУЛА =====
+
+_worker_service = None
+_worker_segment = None
+_worker_generation = None
+
+
+def _init_worker(service_options, index_options):
+    """
+    Инициализация процесса пула: свой сервис без галереи, модели dlib загружаются сразу.
+    Индекс - того же типа, что в веб-процессе; он перестраивается при подключении каждой
+    новой галереи (set_gallery_views)
+    """
+    global _worker_service
+    preload_recognition_modules()
+    _worker_service = FaceRecognitionService(index=create_face_index(**index_options), **service_options)
+
+
+def _attach_gallery(descriptor):
+    """
+    Подключить опубликованную галерею, если она сменилась
+    Returns: False, если сегмент уже удалён (задание пролежало в очереди две публикации)
+    """
+    global _worker_segment, _worker_generation
+    if descriptor['generation'] == _worker_generation:
+        return True
+    try:
+        segment = shared_memory.SharedMemory(name=descriptor['name'])
+    except FileNotFoundError:
+        return False
+    ids, sq_norms, matrix = _gallery_views(segment.buf, descriptor['count'])
+    _worker_service.set_gallery_views(matrix, ids, sq_norms)
+    if _worker_segment is not None:
+        _worker_segment.close()
+    _worker_segment = segment
+    _worker_generation = descriptor['generation']
+    return True
+
+
+def _decode_rgb(payload):
+    """Декодировать кадр запроса в RGB"""
+    frame, is_rgb = decode_frame_payload(payload)
+    return frame if is_rgb else cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+
+def _run_burst_job(job):
+    """Распознать серию кадров в процессе пула"""
+    timer = StageTimer()
+    if not _attach_gallery(job['gallery']):
+        return {'stale_gallery': True}
+    with timer.stage('decode'):
+        rgb_frames = [_decode_rgb(payload) for payload in job['payloads']]
+    fused = _worker_service.recognize_burst(rgb_frames, roi=job['roi'], timer=timer)
+    return {'fused': fused, 'stages': timer.stages, 'counts': timer.counts}
+
+
+def _run_job(job):
+    """Распознать один кадр в процессе пула"""
+    timer = StageTimer()
+    if not _attach_gallery(job['gallery']):
+        return {'stale_gallery': True}
+    with timer.stage('decode'):
+        rgb_frame = _decode_rgb(job['payload'])
+    face_locations, assigned, fresh_matches = _worker_service.analyze_frame(
+        rgb_frame, roi=job['roi'], tracks_plan=job['tracks_plan'], timer=timer
+    )
+    return {'locations': face_locations, 'assigned': assigned, 'fresh_matches': fresh_matches,
+            'stages': timer.stages, 'counts': timer.counts}
+
+
+# ===== ИСПОЛНИТЕЛЬ =====
+
+class RecognitionExecutor:
+    """Распознавание кадров: в потоке запроса или в пуле процессов"""
+
+    def __init__(self, service, workers=0, queue_size=None, timeout=DEFAULT_TIMEOUT):
+        self.service = service
+        self.workers = max(0, int(workers))
+        self.queue_size = max(1, int(queue_size or self.workers * 2 or 1))
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._gallery = SharedGallery(service)
+        # Счётчики для мониторинга
+        self.submitted = 0
+        self.rejected = 0
+        self.coalesced = 0
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def recognize(self, payload, roi=None, camera_id=None, timer=None):
+        """
+        Распознать кадр из запроса
+        payload: см. decode_frame_payload
+        timer: StageTimer запроса (этапы gate, decode, detect, encode, match, pool_wait)
+        Returns: список опознанных лиц (как recognize_multiple_faces_from_frame)
+        Raises: RecognitionBusy, FrameUnchanged, ValueError (некорректный кадр)
+        """
+        timer = timer if timer is not None else StageTimer()
+        tracker = self.service.camera_sessions.get(camera_id) if camera_id else None
+        thumbnail = None
+        if tracker is not None and tracker.gate is not None:
+            with timer.stage('gate'):
+                thumbnail = payload_thumbnail(payload)
+                changed = tracker.gate.is_changed(thumbnail)
+            if not changed:
+                raise FrameUnchanged('Кадр не изменился')
+
+        if not self.enabled:
+            with timer.stage('decode'):
+                frame, is_rgb = decode_frame_payload(payload)
+            recognized = self.service.recognize_multiple_faces_from_frame(
+                frame, is_rgb=is_rgb, roi=roi, camera_id=camera_id, timer=timer
+            )
+        elif len(self.service.known_encodings) == 0:
+            recognized = []
+        else:
+            recognized = self._recognize_in_pool(payload, roi, tracker, timer)
+
+        if thumbnail is not None:
+            tracker.gate.mark_processed(thumbnail)
+        return recognized
+
+    def _recognize_in_pool(self, payload, roi, tracker, timer):
+        if tracker is not None and not tracker.lock.acquire(blocking=False):
+            # Кадр этой камеры уже в работе - новый не ставим в очередь
+            self.coalesced += 1
+            raise RecognitionBusy('Предыдущий кадр камеры ещё обрабатывается')
+        try:
+            now = time.monotonic()
+            tracks_plan = tracker.prepare(now, is_known=self.service.has_student) if tracker else None
+            result = self._submit({
+                'payload': payload,
+                'roi': roi,
+                'tracks_plan': tracks_plan,
+                'gallery': self._gallery.current()
+            }, timer=timer)
+            if tracker is not None:
+                matches = tracker.update(result['locations'], result['assigned'], result['fresh_matches'], now)
+            else:
+                fresh_matches = result['fresh_matches']
+                matches = [fresh_matches[i] for i in range(len(result['locations']))]
+            return self.service.collect_recognized(result['locations'], matches)
+        finally:
+            if tracker is not None:
+                tracker.lock.release()
+
+    def recognize_burst(self, payloads, roi=None, timer=None):
+        """
+        Распознать серию кадров одним заданием (см. FaceRecognitionService.recognize_burst)
+        Raises: RecognitionBusy, ValueError (некорректный кадр)
+        """
+        timer = timer if timer is not None else StageTimer()
+        if not self.enabled:
+            with timer.stage('decode'):
+                rgb_frames = [_decode_rgb(payload) for payload in payloads]
+            return self.service.recognize_burst(rgb_frames, roi=roi, timer=timer)
+
+        if len(self.service.known_encodings) == 0:
+            return []
+        return self._submit({
+            'payloads': payloads,
+            'roi': roi,
+            'gallery': self._gallery.current()
+        }, job_function=_run_burst_job, timer=timer)['fused']
+
+    def _submit(self, job, job_function=_run_job, timer=None):
+        """
+        Выполнить задание в пуле; замеры этапов из процесса пула добавляются в timer,
+        остаток времени ожидания (очередь, передача данных) - этап pool_wait
+        """
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise RecognitionBusy('Очередь распознавания заполнена, кадр пропущен')
+        started = time.perf_counter()
+        try:
+            future = self._get_pool().submit(job_function, job)
+        except BaseException as e:
+            self._slots.release()
+            if isinstance(e, BrokenProcessPool):
+                self._reset_pool()
+                raise RecognitionBusy('Пул распознавания перезапускается')
+            raise
+        # Слот занят, пока задание действительно выполняется: после таймаута запроса
+        # работающее задание не отменить, и оно продолжает занимать место в очереди
+        future.add_done_callback(lambda _: self._slots.release())
+        self.submitted += 1
+        try:
+            result = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise RecognitionBusy('Распознавание не уложилось в отведённое время')
+        except BrokenProcessPool:
+            # Процесс пула упал - пересоздадим пул при следующем кадре
+            self._reset_pool()
+            raise RecognitionBusy('Пул распознавания перезапускается')
+        if result.get('stale_gallery'):
+            raise RecognitionBusy('Галерея обновилась, пока кадр ждал в очереди')
+        if timer is not None:
+            worker_ms = sum(result['stages'].values())
+            timer.merge(result['stages'])
+            for name, value in result['counts'].items():
+                timer.count(name, value)
+            timer.add('pool_wait', max(0.0, (time.perf_counter() - started) * 1000 - worker_ms))
+        return result
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                service_options = {
+                    'tolerance': self.service.tolerance,
+                    'detection_scale': self.service.detection_scale,
+                    'detection_upsample': self.service.detection_upsample,
+                    'detection_roi': self.service.detection_roi
+                }
+                # spawn: процессы не наследуют потоки и соединения с БД веб-процесса
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(service_options, self.service.index_options())
+                )
+            return self._pool
+
+    def _reset_pool(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def shutdown(self):
+        self._reset_pool()
+        self._gallery.close()
+
+    def stats(self):
+        """Состояние пула и очереди"""
+        return {
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'coalesced': self.coalesced
+        }
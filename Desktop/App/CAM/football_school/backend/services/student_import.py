@@ -0,0 +1,360 @@
+"""
+Массовый импорт учеников: CSV-список + папка или zip-архив с фотографиями
+
+- encodings считаются параллельно в пуле процессов (по пачке за раз);
+- ученики пачки вставляются одной транзакцией;
+- галерея распознавания перезагружается один раз в конце (это делает вызывающий код);
+- строка, чей student_number уже есть в базе, пропускается - повторный запуск
+  после прерывания продолжает с первой незаписанной пачки.
+
+Колонки CSV (разделитель , или ;): student_number, full_name - обязательные;
+phone, parent_phone, school_number, birth_year, admission_date (ГГГГ-ММ-ДД),
+group и tariff (id или название), photo - имя файла фото. Без колонки photo
+ищется файл, имя которого (без расширения) совпадает с student_number.
+"""
+import csv
+import io
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from backend.models.models import db, Student, Group, Tariff
+from backend.services.lazy_import import LazyModule
+from backend.services.ledger import refresh_balances
+from backend.services.month_dues import sync_month_dues
+from backend.services.photo_variants import (
+    load_photo, photo_digest, remove_photo_variants, render_photo_variants, save_photo_variants
+)
+
+face_recognition = LazyModule('face_recognition')
+cv2 = LazyModule('cv2')
+
+DEFAULT_BATCH_SIZE = 100
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+# Фото с телефона (12 Мп) уменьшается до этой стороны перед поиском лица -
+# детекция на полном разрешении занимает секунды и точности не добавляет
+MAX_PHOTO_SIDE = 1600
+REPORT_FIELDS = ['row', 'student_number', 'full_name', 'status', 'student_id', 'message']
+
+
+class PhotoSource:
+    """Фотографии из папки или zip-архива: поиск по имени файла и по имени без расширения"""
+
+    def __init__(self, path_or_file):
+        self._zip = None
+        self._files = {}
+        if isinstance(path_or_file, str) and os.path.isdir(path_or_file):
+            for root, _, names in os.walk(path_or_file):
+                for name in names:
+                    self._register(name, os.path.join(root, name))
+        else:
+            self._zip = zipfile.ZipFile(path_or_file)
+            for info in self._zip.infolist():
+                if not info.is_dir():
+                    self._register(os.path.basename(info.filename), info.filename)
+
+    def _register(self, name, location):
+        if not name.lower().endswith(PHOTO_EXTENSIONS) or name.startswith('.'):
+            return
+        self._files.setdefault(name.lower(), (name, location))
+        self._files.setdefault(os.path.splitext(name)[0].lower(), (name, location))
+
+    def find(self, key):
+        """Returns: (имя файла, байты) или None"""
+        if not key:
+            return None
+        entry = self._files.get(os.path.basename(key.strip()).lower())
+        if entry is None:
+            return None
+        name, location = entry
+        if self._zip is not None:
+            return name, self._zip.read(location)
+        with open(location, 'rb') as f:
+            return name, f.read()
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+
+
+def read_roster(csv_file):
+    """
+    Прочитать CSV-список учеников
+    csv_file: путь или байты файла
+    Returns: список словарей (ключи - названия колонок в нижнем регистре)
+    """
+    if isinstance(csv_file, (bytes, bytearray)):
+        text = bytes(csv_file).decode('utf-8-sig')
+    else:
+        with open(csv_file, encoding='utf-8-sig') as f:
+            text = f.read()
+    delimiter = ';' if text.split('\n', 1)[0].count(';') > text.split('\n', 1)[0].count(',') else ','
+    reader = csv.DictReader(io.StringIO(text), delimiter=delimiter)
+    return [
+        {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+        for row in reader
+    ]
+
+
+def process_photo(data, encode=True, variants=True, upsample=1, model='hog', jitters=1):
+    """
+    Разобрать фото ученика (выполняется в процессе пула): face encoding и уменьшенные копии
+    encode=False - только найти лицо (для рамки копии face)
+    upsample, model ('hog' или 'cnn'), jitters - параметры детектора и encoder face_recognition
+    Returns: (encoding float32 или None, сообщение об ошибке или None, {вариант: байты} или None)
+    """
+    try:
+        image = load_photo(data)
+        longest = max(image.shape[:2])
+        if longest > MAX_PHOTO_SIDE:
+            scale = MAX_PHOTO_SIDE / longest
+            image = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        locations = face_recognition.face_locations(image, number_of_times_to_upsample=upsample, model=model)
+        encodings = []
+        if encode and locations:
+            encodings = face_recognition.face_encodings(image, locations[:1], num_jitters=jitters)
+        rendered = render_photo_variants(image, locations[0] if locations else None) if variants else None
+    except Exception as e:
+        return None, f'Не удалось прочитать фото: {e}', None
+    if len(locations) == 0:
+        return None, 'Лицо не обнаружено на фото', rendered
+    if not encode:
+        return None, None, rendered
+    return np.asarray(encodings[0], dtype=np.float32), None, rendered
+
+
+def encode_photo(data):
+    """
+    Посчитать face encoding фото (выполняется в процессе пула)
+    Returns: (encoding float32 или None, сообщение об ошибке или None)
+    """
+    encoding, error, _ = process_photo(data, variants=False)
+    return encoding, error
+
+
+class StudentImporter:
+    """Импорт списка учеников пачками"""
+
+    def __init__(self, face_service, workers=0, batch_size=DEFAULT_BATCH_SIZE, on_progress=None):
+        self.face_service = face_service
+        self.workers = max(0, int(workers))
+        self.batch_size = max(1, int(batch_size))
+        # on_progress(обработано строк, всего строк) - для CLI и фоновых задач
+        self.on_progress = on_progress
+        self._groups = {}
+        self._tariffs = {}
+        self._group_load = {}
+
+    def run(self, rows, photos):
+        """
+        Импортировать строки (нужен контекст приложения)
+        Returns: список строк отчёта (словари с ключами REPORT_FIELDS)
+        """
+        self._load_lookups()
+        report = []
+        pool = None
+        if self.workers > 0:
+            # spawn: процессы не наследуют соединения с БД и потоки веб-процесса
+            pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            for start in range(0, len(rows), self.batch_size):
+                batch = list(enumerate(rows[start:start + self.batch_size], start=start + 1))
+                report.extend(self._import_batch(batch, photos, pool))
+                if self.on_progress:
+                    self.on_progress(min(start + self.batch_size, len(rows)), len(rows))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return report
+
+    def _load_lookups(self):
+        for group in Group.query.all():
+            self._groups[str(group.id)] = group
+            self._groups[group.name.strip().lower()] = group
+        for tariff in Tariff.query.all():
+            self._tariffs[str(tariff.id)] = tariff
+            self._tariffs[tariff.name.strip().lower()] = tariff
+        counts = db.session.query(Student.group_id, db.func.count(Student.id)).filter(
+            Student.status == 'active', Student.group_id.isnot(None)
+        ).group_by(Student.group_id).all()
+        self._group_load = dict(counts)
+
+    def _import_batch(self, batch, photos, pool):
+        numbers = [row.get('student_number', '') for _, row in batch]
+        existing = {
+            number: student_id for number, student_id in db.session.query(Student.student_number, Student.id).filter(
+                Student.student_number.in_([n for n in numbers if n])
+            )
+        }
+
+        results = {}
+        prepared = []
+        seen = set()
+        for line, row in batch:
+            entry = {
+                'row': line,
+                'student_number': row.get('student_number', ''),
+                'full_name': row.get('full_name', ''),
+                'status': 'error',
+                'student_id': None,
+                'message': ''
+            }
+            results[line] = entry
+            number = entry['student_number']
+            if number in existing:
+                entry.update(status='exists', student_id=existing[number], message='Ученик с таким номером уже существует')
+                continue
+            try:
+                fields = self._parse_row(row, seen)
+            except ValueError as e:
+                entry['message'] = str(e)
+                continue
+            seen.add(number)
+            photo = photos.find(row.get('photo') or number) if photos is not None else None
+            prepared.append((line, fields, photo))
+
+        # Encodings всех фото пачки - параллельно
+        photo_data = [photo[1] for _, _, photo in prepared if photo is not None]
+        if pool is not None:
+            processed = iter(list(pool.map(process_photo, photo_data)))
+        else:
+            processed = iter([process_photo(data) for data in photo_data])
+
+        to_insert = []
+        batch_load = {}
+        for line, fields, photo in prepared:
+            encoding = None
+            if photo is not None:
+                encoding, error, rendered = next(processed)
+                if error:
+                    results[line]['message'] = error
+                    continue
+                photo = photo + (rendered,)
+            group = fields.get('group')
+            if group is not None and group.max_students and fields['status'] == 'active':
+                load = self._group_load.get(group.id, 0) + batch_load.get(group.id, 0)
+                if load >= group.max_students:
+                    results[line]['message'] = f'Группа "{group.name}" заполнена ({load}/{group.max_students})'
+                    continue
+                batch_load[group.id] = batch_load.get(group.id, 0) + 1
+            to_insert.append((line, fields, photo, encoding))
+
+        # Заполненность групп учитывает пачку только после её записи
+        if self._insert(to_insert, results):
+            for group_id, count in batch_load.items():
+                self._group_load[group_id] = self._group_load.get(group_id, 0) + count
+        return [results[line] for line, _ in batch]
+
+    def _insert(self, to_insert, results):
+        """Записать пачку учеников одной транзакцией; Returns: True, если пачка записана"""
+        if not to_insert:
+            return True
+        students = []
+        saved_photos = []
+        saved_variants = []
+        try:
+            for line, fields, photo, encoding in to_insert:
+                group = fields.pop('group', None)
+                tariff = fields.pop('tariff', None)
+                student = Student(
+                    balance=0,
+                    group_id=group.id if group else None,
+                    tariff_id=tariff.id if tariff else None,
+                    **fields
+                )
+                db.session.add(student)
+                students.append((line, student, photo, encoding))
+            db.session.flush()
+            student_ids = [student.id for _, student, _, _ in students]
+            refresh_balances(student_ids)
+            sync_month_dues(student_ids)
+
+            for line, student, photo, encoding in students:
+                if photo is not None:
+                    filename, data, rendered = photo
+                    student.photo_path = self.face_service.save_student_photo_bytes(data, filename, student.id)
+                    saved_photos.append(student.photo_path)
+                    student.set_face_encoding(encoding)
+                    variants = save_photo_variants(rendered, student.id, photo_digest(data))
+                    saved_variants.append(variants)
+                    student.set_photo_variants(variants)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            for path in saved_photos:
+                if os.path.exists(path):
+                    os.remove(path)
+            for variants in saved_variants:
+                remove_photo_variants(variants)
+            for line, _, _, _ in to_insert:
+                results[line]['message'] = f'Ошибка записи пачки: {e}'
+            return False
+
+        for line, student, photo, _ in students:
+            results[line].update(
+                status='created',
+                student_id=student.id,
+                message='' if photo is not None else 'Без фото'
+            )
+        return True
+
+    def _parse_row(self, row, seen_numbers):
+        """Проверить строку CSV и собрать поля ученика; Raises: ValueError"""
+        number = row.get('student_number', '')
+        if not number:
+            raise ValueError('Номер ученика обязателен')
+        if number in seen_numbers:
+            raise ValueError('Номер ученика повторяется в файле')
+        if not row.get('full_name'):
+            raise ValueError('ФИО обязательно')
+
+        fields = {
+            'student_number': number,
+            'full_name': row['full_name'],
+            'phone': row.get('phone') or None,
+            'parent_phone': row.get('parent_phone') or None,
+            'school_number': row.get('school_number') or None,
+            'status': row.get('status') or 'active',
+            'admission_date': datetime.utcnow().date()
+        }
+        if fields['status'] not in ('active', 'inactive'):
+            raise ValueError(f'Недопустимый статус: {fields["status"]}')
+        if row.get('birth_year'):
+            try:
+                fields['birth_year'] = int(row['birth_year'])
+            except ValueError:
+                raise ValueError('Некорректный год рождения')
+        if row.get('admission_date'):
+            try:
+                fields['admission_date'] = datetime.strptime(row['admission_date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise ValueError('Некорректная дата принятия')
+        if row.get('group'):
+            fields['group'] = self._groups.get(row['group'].lower())
+            if fields['group'] is None:
+                raise ValueError(f'Группа не найдена: {row["group"]}')
+        if row.get('tariff'):
+            fields['tariff'] = self._tariffs.get(row['tariff'].lower())
+            if fields['tariff'] is None:
+                raise ValueError(f'Тариф не найден: {row["tariff"]}')
+        return fields
+
+
+def summarize_report(report):
+    """Количество строк отчёта по статусам"""
+    summary = {'created': 0, 'exists': 0, 'error': 0}
+    for entry in report:
+        summary[entry['status']] += 1
+    return summary
+
+
+def write_report(report, path):
+    """Сохранить отчёт построчно в CSV"""
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(report)
@@ -0,0 +1,130 @@
+"""
+Кеш сводок (главная панель и т.п.), сбрасываемый записью исходных данных
+
+Сводка считается один раз и отдаётся из памяти, пока не изменятся данные, из которых
+она собрана. Изменения отслеживаются событиями сессии SQLAlchemy: если в коммите
+добавлены, удалены или изменены объекты из sources, после коммита поднимается версия
+сводки в таблице cache_versions. Процессы gunicorn сверяют свою копию с этой версией
+(один запрос по первичному ключу), поэтому запись в одном процессе сбрасывает кеш во всех.
+Записи в обход ORM (ручные правки БД) подхватываются по истечении ttl.
+"""
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError
+
+from backend.models.models import db, CacheVersion
+
+# Сколько секунд сводка живёт без проверки исходных данных
+DEFAULT_TTL = 300.0
+
+
+def current_cache_version(name):
+    """Текущая версия сводки в БД (0, если данные ещё не менялись)"""
+    version = db.session.query(CacheVersion.version).filter_by(name=name).scalar()
+    return version or 0
+
+
+def bump_cache_version(name):
+    """Отметить изменение исходных данных сводки (отдельным соединением, вне сессии)"""
+    table = CacheVersion.__table__
+    for _ in range(2):
+        try:
+            with db.engine.begin() as conn:
+                updated = conn.execute(
+                    table.update().where(table.c.name == name)
+                    .values(version=table.c.version + 1, updated_at=datetime.utcnow())
+                ).rowcount
+                if updated == 0:
+                    conn.execute(table.insert().values(name=name, version=1, updated_at=datetime.utcnow()))
+            return
+        except IntegrityError:
+            # Строку одновременно создал другой процесс - повторить через UPDATE
+            continue
+
+
+class SummaryCache:
+    """Сводка в памяти процесса: пересчитывается после изменения sources, смены дня или ttl"""
+
+    def __init__(self, name, compute, sources, ttl=DEFAULT_TTL):
+        self.name = name
+        # compute() - посчитать сводку (нужен контекст приложения)
+        self.compute = compute
+        # {модель: поля, изменение которых влияет на сводку (None - любые)}
+        self.sources = sources
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._value = None
+        self._key = None
+        self._computed_at = None
+        self._lock = threading.Lock()
+        self._pending_key = f'summary_cache_changed:{name}'
+
+    def get(self):
+        """Сводка из кеша или заново посчитанная"""
+        key = (current_cache_version(self.name), datetime.utcnow().date())
+        now = time.monotonic()
+        with self._lock:
+            if self._key == key and now - self._computed_at < self.ttl:
+                self.hits += 1
+                return self._value
+        value = self.compute()
+        with self._lock:
+            self._value = value
+            self._key = key
+            self._computed_at = now
+            self.misses += 1
+        return value
+
+    def invalidate(self):
+        """Сбросить сводку во всех процессах"""
+        bump_cache_version(self.name)
+        with self._lock:
+            self._key = None
+
+    def watch(self, session):
+        """Подписаться на коммиты сессии: изменения sources сбрасывают сводку"""
+        event.listen(session, 'after_flush', self._after_flush)
+        event.listen(session, 'after_commit', self._after_commit)
+        event.listen(session, 'after_rollback', self._after_rollback)
+
+    def _affects(self, instance, changed):
+        for model, fields in self.sources.items():
+            if not isinstance(instance, model):
+                continue
+            if not changed or fields is None:
+                return True
+            attrs = inspect(instance).attrs
+            return any(attrs[field].history.has_changes() for field in fields)
+        return False
+
+    def _after_flush(self, session, flush_context):
+        if session.info.get(self._pending_key):
+            return
+        if (any(self._affects(instance, False) for instance in session.new)
+                or any(self._affects(instance, False) for instance in session.deleted)
+                or any(self._affects(instance, True) for instance in session.dirty)):
+            session.info[self._pending_key] = True
+
+    def _after_commit(self, session):
+        # События приходят и для точек сохранения (begin_nested) - ждём коммита всей транзакции
+        if session.in_nested_transaction():
+            return
+        if session.info.pop(self._pending_key, False):
+            self.invalidate()
+
+    def _after_rollback(self, session):
+        if session.in_nested_transaction():
+            return
+        session.info.pop(self._pending_key, None)
+
+    def stats(self):
+        return {
+            'version': self._key[0] if self._key else None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'ttl': self.ttl
+        }
@@ -0,0 +1,93 @@
+"""
+Бенчмарк индекса галереи: IVF против точного перебора
+
+Галерея синтетическая: центры "учеников" лежат в подпространстве малой размерности
+(как и настоящие face encodings), запросы - центр + шум с расстоянием ~0.35.
+Для каждого размера галереи и nprobe печатаются:
+- recall - доля запросов, где IVF нашёл того же ученика, что и перебор;
+- время сопоставления одного кадра (batch лиц) в миллисекундах: среднее и p95;
+- время построения индекса.
+
+Пример: python benchmarks/bench_face_index.py --sizes 1000 10000 50000 --nprobe 4 8 16
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.models.face_encoding import ENCODING_DIM
+from backend.services.face_index import BruteForceIndex, IVFIndex
+from backend.services.face_service import FaceRecognitionService
+
+
+def make_gallery(size, intrinsic_dim, rng):
+    """Центры учеников: случайная проекция из пространства размерности intrinsic_dim"""
+    projection = rng.normal(size=(intrinsic_dim, ENCODING_DIM)).astype(np.float32)
+    projection /= np.linalg.norm(projection, axis=1, keepdims=True)
+    latent = rng.normal(scale=0.64 / np.sqrt(intrinsic_dim), size=(size, intrinsic_dim)).astype(np.float32)
+    return latent @ projection
+
+
+def make_queries(gallery, count, noise, rng):
+    """Запросы: случайные ученики галереи + шум заданной нормы"""
+    truth = rng.integers(0, len(gallery), size=count)
+    jitter = rng.normal(scale=noise / np.sqrt(ENCODING_DIM), size=(count, ENCODING_DIM)).astype(np.float32)
+    return gallery[truth] + jitter, truth
+
+
+def time_matching(service, queries, batch):
+    """Сопоставить запросы кадрами по batch лиц; Returns: (student_id по запросам, время кадров в мс)"""
+    found = []
+    timings = []
+    for start in range(0, len(queries), batch):
+        started = time.perf_counter()
+        matches = service.match_encodings(queries[start:start + batch])
+        timings.append((time.perf_counter() - started) * 1000)
+        found.extend(m['student_id'] for m in matches)
+    return np.array(found, dtype=object), np.array(timings)
+
+
+def run(sizes, nprobes, queries_count, batch, noise, intrinsic_dim, seed):
+    rng = np.random.default_rng(seed)
+    print(f"{'N':>7} {'index':>10} {'recall':>7} {'mean ms':>8} {'p95 ms':>7} {'build s':>8}")
+    for size in sizes:
+        gallery = make_gallery(size, intrinsic_dim, rng)
+        ids = np.arange(1, size + 1)
+        queries, _ = make_queries(gallery, queries_count, noise, rng)
+
+        exact = FaceRecognitionService(index=BruteForceIndex())
+        exact.set_gallery(gallery, ids)
+        expected, timings = time_matching(exact, queries, batch)
+        print(f"{size:>7} {'brute':>10} {1.0:>7.3f} {timings.mean():>8.3f} {np.percentile(timings, 95):>7.3f} {0:>8.2f}")
+
+        for nprobe in nprobes:
+            service = FaceRecognitionService(index=IVFIndex(nprobe=nprobe, min_train_size=1))
+            started = time.perf_counter()
+            service.set_gallery(gallery, ids)
+            build_seconds = time.perf_counter() - started
+            found, timings = time_matching(service, queries, batch)
+            recall = float(np.mean(found == expected))
+            label = f'ivf/{nprobe}'
+            print(f"{size:>7} {label:>10} {recall:>7.3f} {timings.mean():>8.3f} "
+                  f"{np.percentile(timings, 95):>7.3f} {build_seconds:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Полнота и задержка IVF-индекса против точного перебора')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000], help='Размеры галереи')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 8, 16], help='Значения nprobe для IVF')
+    parser.add_argument('--queries', type=int, default=2000, help='Число запросов на размер галереи')
+    parser.add_argument('--batch', type=int, default=4, help='Лиц в одном кадре')
+    parser.add_argument('--noise', type=float, default=0.35, help='Расстояние запроса от центра ученика')
+    parser.add_argument('--intrinsic-dim', type=int, default=32, help='Размерность подпространства центров')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args.sizes, args.nprobe, args.queries, args.batch, args.noise, args.intrinsic_dim, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+Бенчмарк FaceRecognitionService
+
+Для каждого размера синтетической галереи (см. bench_face_index.py) измеряется:
+- reload - время load_student_encodings (объекты Student с бинарными encodings)
+  и load_encoding_blobs (путь reload_face_encodings в app.py);
+- memory - байт на запись галереи (матрица, нормы, id, индекс) по tracemalloc;
+- match - задержка сопоставления кадра с 0-10 лицами: на кадр и на лицо;
+- frames - если задан --frames: кадры из папки (снятые с камеры, 0-10 лиц в кадре)
+  проходят полный путь recognize_multiple_faces_from_frame; FPS, задержка на лицо
+  и перцентили этапов decode / detect / encode / match.
+
+Результат печатается (или пишется в --output) одним JSON, чтобы сравнивать запуски
+на разных коммитах.
+
+Пример:
+    python benchmarks/bench_face_service.py --sizes 100 1000 10000 50000 \\
+        --frames benchmarks/frames --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+
+from backend.models.face_encoding import encode_face_encoding
+from backend.models.models import Student
+from backend.services.face_index import FACE_INDEX_KINDS, create_face_index
+from backend.services.face_service import FaceRecognitionService
+from backend.services.metrics import StageTimer
+from benchmarks.bench_face_index import make_gallery, make_queries
+
+FRAME_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+MAX_FACES = 10
+
+
+def summarize(values):
+    """Среднее и перцентили (мс)"""
+    data = np.asarray(values, dtype=np.float64)
+    if data.size == 0:
+        return {'count': 0}
+    return {
+        'count': int(data.size),
+        'mean': round(float(data.mean()), 3),
+        'p50': round(float(np.percentile(data, 50)), 3),
+        'p95': round(float(np.percentile(data, 95)), 3),
+        'max': round(float(data.max()), 3)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_frames(directory):
+    """Кадры из папки (BGR, как их отдаёт cv2 на сервере)"""
+    frames = []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(FRAME_EXTENSIONS):
+            continue
+        frame = cv2.imread(os.path.join(directory, name))
+        if frame is not None:
+            frames.append((name, frame))
+    return frames
+
+
+def time_reload(load, index_kind, nprobe):
+    service = FaceRecognitionService(index=create_face_index(index_kind, nprobe=nprobe))
+    started = time.perf_counter()
+    load(service)
+    return (time.perf_counter() - started) * 1000
+
+
+def bench_reload(gallery, ids, index_kind, nprobe, repeat):
+    """Время перезагрузки галереи из объектов Student и из бинарных записей"""
+    blobs = [encode_face_encoding(row) for row in gallery]
+    students = [Student(id=int(student_id), face_encoding_bin=blob) for student_id, blob in zip(ids, blobs)]
+
+    from_students = []
+    from_blobs = []
+    # Сервис печатает число загруженных encodings - в stdout должен попасть только JSON
+    with redirect_stdout(sys.stderr):
+        for _ in range(repeat):
+            from_students.append(time_reload(lambda service: service.load_student_encodings(students),
+                                             index_kind, nprobe))
+            from_blobs.append(time_reload(lambda service: service.load_encoding_blobs(ids, blobs),
+                                          index_kind, nprobe))
+    return {
+        'load_student_encodings_ms': summarize(from_students),
+        'load_encoding_blobs_ms': summarize(from_blobs)
+    }
+
+
+def bench_memory(gallery, ids, index_kind, nprobe):
+    """Байт на запись галереи: всё, что выделено при set_gallery и осталось жить"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    service = FaceRecognitionService(index=create_face_index(index_kind, nprobe=nprobe))
+    service.set_gallery(gallery, ids)
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return service, {
+        'retained_bytes': retained,
+        'bytes_per_entry': round(retained / max(1, len(ids)), 1)
+    }
+
+
+def bench_match(service, gallery, queries_per_count, noise, rng):
+    """Задержка match_encodings для кадров с 0..MAX_FACES лицами"""
+    by_faces = {}
+    per_face = []
+    for faces in range(MAX_FACES + 1):
+        timings = []
+        for _ in range(queries_per_count):
+            queries, _ = make_queries(gallery, faces, noise, rng)
+            started = time.perf_counter()
+            service.match_encodings(queries)
+            elapsed = (time.perf_counter() - started) * 1000
+            timings.append(elapsed)
+            if faces:
+                per_face.append(elapsed / faces)
+        by_faces[str(faces)] = summarize(timings)
+    return {'frame_ms_by_faces': by_faces, 'per_face_ms': summarize(per_face)}
+
+
+def bench_frames(service, frames, repeat):
+    """Полный путь кадра: BGR -> RGB, детекция, encoding, сопоставление"""
+    totals = []
+    per_face = []
+    stages = {}
+    faces_per_frame = {}
+    for _ in range(repeat):
+        for name, frame in frames:
+            timer = StageTimer()
+            service.recognize_multiple_faces_from_frame(frame, timer=timer)
+            total = timer.total()
+            totals.append(total)
+            for stage, milliseconds in timer.stages.items():
+                stages.setdefault(stage, []).append(milliseconds)
+            faces = timer.counts.get('faces', 0)
+            faces_per_frame[name] = faces
+            if faces:
+                per_face.append(total / faces)
+    seconds = sum(totals) / 1000
+    return {
+        'frames': len(frames),
+        'repeat': repeat,
+        'fps': round(len(totals) / seconds, 2) if seconds else None,
+        'frame_ms': summarize(totals),
+        'per_face_ms': summarize(per_face),
+        'stages_ms': {stage: summarize(values) for stage, values in stages.items()},
+        'faces_per_frame': faces_per_frame
+    }
+
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    frames = load_frames(args.frames) if args.frames else []
+    if args.frames and not frames:
+        print(f"В папке {args.frames} нет кадров", file=sys.stderr)
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'params': {
+            'index': args.index,
+            'nprobe': args.nprobe,
+            'noise': args.noise,
+            'intrinsic_dim': args.intrinsic_dim,
+            'seed': args.seed,
+            'frames_dir': args.frames
+        },
+        'sizes': []
+    }
+    for size in args.sizes:
+        print(f"Галерея {size}...", file=sys.stderr)
+        gallery = make_gallery(size, args.intrinsic_dim, rng)
+        ids = np.arange(1, size + 1)
+        service, memory = bench_memory(gallery, ids, args.index, args.nprobe)
+        entry = {
+            'size': size,
+            'index': service.index_stats(),
+            'memory': memory,
+            'reload': bench_reload(gallery, ids, args.index, args.nprobe, args.reload_repeat),
+            'match': bench_match(service, gallery, args.match_repeat, args.noise, rng)
+        }
+        if frames:
+            entry['frames'] = bench_frames(service, frames, args.frame_repeat)
+        results['sizes'].append(entry)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Производительность FaceRecognitionService (JSON)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 50000], help='Размеры галереи')
+    parser.add_argument('--frames', help='Папка с записанными кадрами камеры (0-10 лиц в кадре)')
+    parser.add_argument('--index', choices=FACE_INDEX_KINDS, default='brute', help='Индекс галереи')
+    parser.add_argument('--nprobe', type=int, default=8, help='nprobe для IVF')
+    parser.add_argument('--match-repeat', type=int, default=200, help='Кадров на каждое число лиц при замере match')
+    parser.add_argument('--frame-repeat', type=int, default=3, help='Сколько раз прогонять папку кадров')
+    parser.add_argument('--reload-repeat', type=int, default=3, help='Повторов замера перезагрузки галереи')
+    parser.add_argument('--noise', type=float, default=0.35, help='Расстояние запроса от центра ученика')
+    parser.add_argument('--intrinsic-dim', type=int, default=32, help='Размерность подпространства центров')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Куда записать JSON (по умолчанию - stdout)')
+    args = parser.parse_args()
+
+    results = run(args)
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"✓ Результаты сохранены в {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,23 @@ let stream = null;
 let recognitionInterval = null;
 let isProcessing = false;
 
+// Идентификатор камеры: сервер сопровождает лица между кадрами этой камеры
+const cameraId = getCameraId();
+
+function getCameraId() {
+    let id = localStorage.getItem('cameraId');
+    if (!id) {
+        id = 'cam-' + Date.now().toString(36) + '-' + Math.random().toString(36).slice(2, 10);
+        localStorage.setItem('cameraId', id);
+    }
+    return id;
+}
+
+// Серия кадров: при BURST_SIZE > 1 снимки отправляются пачкой в /api/recognize_burst,
+// и ученик засчитывается только при совпадении в нескольких кадрах
+const BURST_SIZE = 1;
+const BURST_INTERVAL_MS = 150;
+
 // Запуск камеры
 startBtn.addEventListener('click', async () => {
     try {
@@ -30,50 +47,88 @@ startBtn.addEventListener('click', async () => {
     }
 });
 
+// Захват текущего кадра в JPEG
+function captureFrame() {
+    canvas.width = video.videoWidth;
+    canvas.height = video.videoHeight;
+    ctx.drawImage(video, 0, 0);
+    return new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg'));
+}
+
+// Захват серии кадров с небольшим интервалом
+async function captureBurst() {
+    const frames = [];
+    for (let i = 0; i < BURST_SIZE; i++) {
+        if (i > 0) {
+            await new Promise(resolve => setTimeout(resolve, BURST_INTERVAL_MS));
+        }
+        frames.push(await captureFrame());
+    }
+    return frames;
+}
+
 // Автоматическое распознавание
 async function autoRecognize() {
     if (isProcessing) return;
     
     isProcessing = true;
     
-    // Захватить кадр
-    canvas.width = video.videoWidth;
-    canvas.height = video.videoHeight;
-    ctx.drawImage(video, 0, 0);
-    
-    // Конвертировать в blob
-    canvas.toBlob(async (blob) => {
+    try {
         const formData = new FormData();
-        formData.append('image', blob, 'capture.jpg');
+        let url = '/api/recognize_checkin';
+        if (BURST_SIZE > 1) {
+            const frames = await captureBurst();
+            frames.forEach((blob, i) => formData.append('images', blob, `capture_${i}.jpg`));
+            url = '/api/recognize_burst';
+        } else {
+            // Распознавание и отметка всех учеников кадра - одним запросом
+            formData.append('image', await captureFrame(), 'capture.jpg');
+            formData.append('camera_id', cameraId);
+        }
         
-        try {
-            const response = await fetch('/api/recognize_multiple', {
-                method: 'POST',
-                body: formData
-            });
-            
-            const data = await response.json();
-            
-            if (data.success && data.count > 0) {
-                // Автоматически отметить всех распознанных учеников
+        const response = await fetch(url, {
+            method: 'POST',
+            body: formData
+        });
+        
+        const data = await response.json();
+        
+        if (data.success && data.count > 0) {
+            if (BURST_SIZE > 1) {
+                // Серия кадров только распознаёт - отметить всех распознанных учеников
                 for (const student of data.students) {
                     await autoCheckInStudent(student);
                 }
-                
-                // Пауза 5 секунд перед продолжением сканирования
-                setTimeout(() => {
-                    if (stream) {
-                        isProcessing = false;
+            } else {
+                let anyCheckedIn = false;
+                for (const result of data.students) {
+                    if (result.checked_in) {
+                        announceCheckIn(result.student_name, result.balance, result.remaining_balance, result.low_balance);
+                        anyCheckedIn = true;
+                    } else {
+                        // Тихо пропустить - ученик уже был сегодня
+                        console.log(`${result.student_name} уже отмечен сегодня`);
                     }
-                }, 5000);
-                return;
+                }
+                if (anyCheckedIn) {
+                    loadTodayAttendance();
+                    loadWatchlist();
+                }
             }
-        } catch (error) {
-            console.error('Ошибка распознавания:', error);
+            
+            // Пауза 5 секунд перед продолжением сканирования
+            setTimeout(() => {
+                if (stream) {
+                    isProcessing = false;
+                }
+            }, 5000);
+            return;
         }
-        
-        isProcessing = false;
-    }, 'image/jpeg');
+    } catch (error) {
+        console.error('Ошибка распознавания:', error);
+    }
+    
+    isProcessing = false;
 }
 
 // Автоматическая отметка прихода ученика
@@ -88,17 +143,9 @@ async function autoCheckInStudent(student) {
         const data = await response.json();
         
         if (data.success) {
-            // Звуковое уведомление
-            playBeep();
-            
-            // Показать уведомление
-            if (data.low_balance) {
-                showNotification(student.student_name, student.balance, data.remaining_balance, 'low');
-            } else {
-                showNotification(student.student_name, student.balance, data.remaining_balance, 'success');
-            }
-            
+            announceCheckIn(student.student_name, student.balance, data.remaining_balance, data.low_balance);
             loadTodayAttendance();
+            loadWatchlist();
             return true;
         } else if (data.message === 'Уже отмечен сегодня') {
             // Тихо пропустить - ученик уже был сегодня
@@ -114,6 +161,12 @@ async function autoCheckInStudent(student) {
     }
 }
 
+// Звук и уведомление об отметке прихода
+function announceCheckIn(name, oldBalance, newBalance, lowBalance) {
+    playBeep();
+    showNotification(name, oldBalance, newBalance, lowBalance ? 'low' : 'success');
+}
+
 // Показать уведомление о регистрации
 function showNotification(name, oldBalance, newBalance, type) {
     const resultDiv = document.getElementById('recognitionResult');
@@ -209,6 +262,71 @@ async function loadTodayAttendance() {
     }
 }
 
+// Ученики, у которых заканчиваются занятия (постранично, с фильтром по группе)
+let watchlistPage = 1;
+
+async function loadWatchlist() {
+    try {
+        const params = new URLSearchParams({ page: watchlistPage });
+        const groupId = document.getElementById('watchlistGroup').value;
+        if (groupId) {
+            params.set('group_id', groupId);
+        }
+        const response = await fetch(`/api/students/watchlist?${params}`);
+        const data = await response.json();
+        if (!data.success) {
+            return;
+        }
+        // Страница могла опустеть после оплат - перейти на последнюю
+        if (data.pages > 0 && watchlistPage > data.pages) {
+            watchlistPage = data.pages;
+            return loadWatchlist();
+        }
+        
+        const list = document.getElementById('watchlistItems');
+        document.getElementById('watchlistCounter').textContent =
+            `${data.total} ${data.total === 1 ? 'человек' : 'человека'}`;
+        document.getElementById('watchlistPage').textContent = data.pages > 1 ? `${data.page} / ${data.pages}` : '';
+        document.getElementById('watchlistPrev').disabled = data.page <= 1;
+        document.getElementById('watchlistNext').disabled = data.page >= data.pages;
+        
+        if (data.students.length === 0) {
+            list.innerHTML = '<div class="info-text">У всех достаточно занятий</div>';
+            return;
+        }
+        
+        list.innerHTML = data.students.map(student => `
+            <div class="watchlist-item">
+                <div class="today-avatar">
+                    ${student.photo_url
+                        ? `<img src="${student.photo_url}" alt="${student.student_name}">`
+                        : '<div class="avatar-placeholder">👤</div>'}
+                </div>
+                <div class="today-info">
+                    <span class="today-name">${student.student_name}</span>
+                    <span class="today-meta">${student.group_name || 'Без группы'}${student.parent_phone ? ' · ' + student.parent_phone : ''}</span>
+                </div>
+                <span class="balance-badge low">${student.balance}</span>
+            </div>
+        `).join('');
+    } catch (error) {
+        console.error('Ошибка загрузки списка с низким балансом:', error);
+    }
+}
+
+document.getElementById('watchlistGroup').addEventListener('change', () => {
+    watchlistPage = 1;
+    loadWatchlist();
+});
+document.getElementById('watchlistPrev').addEventListener('click', () => {
+    watchlistPage = Math.max(1, watchlistPage - 1);
+    loadWatchlist();
+});
+document.getElementById('watchlistNext').addEventListener('click', () => {
+    watchlistPage += 1;
+    loadWatchlist();
+});
+
 // Удалить запись посещаемости
 async function deleteAttendance(attendanceId) {
     if (!confirm('Удалить эту запись прихода?')) return;
@@ -222,6 +340,7 @@ async function deleteAttendance(attendanceId) {
         
         if (data.success) {
             loadTodayAttendance();
+            loadWatchlist();
             alert('✓ ' + data.message);
         } else {
             alert('Ошибка: ' + data.message);
@@ -234,6 +353,8 @@ async function deleteAttendance(attendanceId) {
 
 // Загрузить при старте
 loadTodayAttendance();
+loadWatchlist();
 
 // Обновлять каждые 30 секунд
 setInterval(loadTodayAttendance, 30000);
+setInterval(loadWatchlist, 30000);
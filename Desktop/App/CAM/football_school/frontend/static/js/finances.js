@@ -40,16 +40,46 @@ async function loadIncome() {
     }
 }
 
-// Загрузка должников
+// Загрузка должников (фильтры и страницы считаются на сервере)
+let debtorsPage = 1;
+
+function debtorsQuery() {
+    const params = new URLSearchParams({ page: debtorsPage });
+    const groupId = document.getElementById('debtors-group-filter').value;
+    const monthFrom = document.getElementById('debtors-month-from').value;
+    const monthTo = document.getElementById('debtors-month-to').value;
+    const minDebt = document.getElementById('debtors-min-debt').value;
+    if (groupId) params.set('group_id', groupId);
+    if (monthFrom) params.set('from', monthFrom);
+    if (monthTo) params.set('to', monthTo);
+    if (minDebt) params.set('min_debt', minDebt);
+    return params;
+}
+
 async function loadDebtors() {
     try {
-        const response = await fetch('/api/finances/debtors');
+        const response = await fetch(`/api/finances/debtors?${debtorsQuery()}`);
         const data = await response.json();
+        if (!response.ok) {
+            alert('Ошибка: ' + data.message);
+            return;
+        }
+        // Страница могла опустеть после оплат - перейти на последнюю
+        if (data.pages > 0 && debtorsPage > data.pages) {
+            debtorsPage = data.pages;
+            return loadDebtors();
+        }
         
         // Статистика
         document.getElementById('total-debt').textContent = data.total_debt.toLocaleString('ru-RU') + ' сум';
         document.getElementById('debtors-count').textContent = data.count;
         
+        // Страницы
+        document.getElementById('debtors-pager').style.display = data.pages > 1 ? 'flex' : 'none';
+        document.getElementById('debtors-page').textContent = `${data.page} / ${data.pages}`;
+        document.getElementById('debtors-prev').disabled = data.page <= 1;
+        document.getElementById('debtors-next').disabled = data.page >= data.pages;
+        
         // Таблица
         const tbody = document.getElementById('debtors-table-body');
         if (data.debtors.length === 0) {
@@ -74,6 +104,24 @@ async function loadDebtors() {
     }
 }
 
+function filterDebtors() {
+    debtorsPage = 1;
+    loadDebtors();
+}
+
+function resetDebtorsFilters() {
+    document.getElementById('debtors-group-filter').value = '';
+    document.getElementById('debtors-month-from').value = '';
+    document.getElementById('debtors-month-to').value = '';
+    document.getElementById('debtors-min-debt').value = '';
+    filterDebtors();
+}
+
+function changeDebtorsPage(delta) {
+    debtorsPage = Math.max(1, debtorsPage + delta);
+    loadDebtors();
+}
+
 function renderExpenseStats(expenses) {
     const today = new Date();
     const todaySum = expenses
@@ -266,6 +314,11 @@ async function loadIncomeGroups() {
             groupSelect.innerHTML = '<option value="">Выберите группу</option>' +
                 groups.map(g => `<option value="${g.id}">${g.name}</option>`).join('');
         }
+        const debtorsGroupSelect = document.getElementById('debtors-group-filter');
+        if (debtorsGroupSelect) {
+            debtorsGroupSelect.innerHTML = '<option value="">Все группы</option>' +
+                groups.map(g => `<option value="${g.id}">${g.name}</option>`).join('');
+        }
     } catch (error) {
         console.error('Ошибка загрузки групп:', error);
     }
@@ -443,7 +496,7 @@ async function loadIncomeModalStudents(groupId) {
         });
         
         studentSelect.innerHTML = '<option value="">Выберите ученика</option>' +
-            groupStudents.map(s => `<option value="${s.id}" data-photo="${s.photo_path || ''}">${s.full_name} (№${s.student_number || s.id})</option>`).join('');
+            groupStudents.map(s => `<option value="${s.id}" data-photo="${s.photo_url || ''}">${s.full_name} (№${s.student_number || s.id})</option>`).join('');
         
         document.getElementById('student-select-group').style.display = 'block';
     } catch (error) {
@@ -459,9 +512,8 @@ function displayStudentPhoto(studentId) {
     const photoImg = document.getElementById('student-photo-img');
     const photoPlaceholder = document.getElementById('student-photo-placeholder');
     
-    if (student && student.photo_path) {
-        const photoPath = student.photo_path.replace('frontend/static/', '').replace(/\\/g, '/');
-        photoImg.src = `/static/${photoPath}`;
+    if (student && student.photo_url) {
+        photoImg.src = student.photo_url;
         photoImg.style.display = 'block';
         photoPlaceholder.style.display = 'none';
         photoContainer.style.display = 'flex';
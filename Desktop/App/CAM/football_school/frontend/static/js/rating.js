@@ -47,9 +47,7 @@ function renderPodium(rating, groupName) {
                     placeEmoji = '🥉';
                 }
                 
-                const photoUrl = student.photo_path ? 
-                    `/static/${student.photo_path.replace('frontend/static/', '').replace(/\\/g, '/')}` : 
-                    null;
+                const photoUrl = student.photo_url || null;
                 
                 const placeholderId = `placeholder-${student.student_id}-${groupName}`;
                 let medalClass = '';
@@ -44,6 +44,33 @@ function splitFullName(fullName) {
     return { last, first, middle };
 }
 
+// Дождаться фоновой обработки фото: face encoding считается на сервере после сохранения ученика.
+// Опрос заканчивается по таймауту или после нескольких ошибок подряд (сервер перезапускается)
+async function waitForJob(jobId, timeoutMs = 120000, maxErrors = 5) {
+    const started = Date.now();
+    let errors = 0;
+    while (Date.now() - started < timeoutMs) {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        try {
+            const response = await fetch(`/api/jobs/${jobId}`);
+            const data = await response.json();
+            if (!data.success) return null;
+            if (data.job.status === 'done' || data.job.status === 'failed') return data.job;
+            errors = 0;
+        } catch (error) {
+            if (++errors >= maxErrors) return null;
+        }
+    }
+    return null;
+}
+
+// Сообщение о результате обработки фото (job = null - обработка ещё идёт)
+function photoJobMessage(job) {
+    if (!job) return '\nФото ещё обрабатывается, лицо появится в распознавании чуть позже.';
+    if (job.status === 'failed') return '\n⚠️ Фото не обработано: ' + job.message + '. Загрузите другое фото.';
+    return '';
+}
+
 // Загрузка списков при открытии формы
 async function loadFormData() {
     // Загрузить города
@@ -284,7 +311,8 @@ document.getElementById('addStudentForm').addEventListener('submit', async (e) =
         const data = await response.json();
         
         if (data.success) {
-            alert('Ученик успешно добавлен!');
+            const job = data.job_id ? await waitForJob(data.job_id) : { status: 'done' };
+            alert('Ученик успешно добавлен!' + photoJobMessage(job));
             location.reload();
         } else {
             alert('Ошибка: ' + data.message);
@@ -315,7 +343,8 @@ document.getElementById('editStudentForm').addEventListener('submit', async (e)
         const data = await response.json();
         
         if (data.success) {
-            alert('✓ Данные ученика обновлены!');
+            const job = data.job_id ? await waitForJob(data.job_id) : { status: 'done' };
+            alert('✓ Данные ученика обновлены!' + photoJobMessage(job));
             location.reload();
         } else {
             alert('Ошибка: ' + data.message);
@@ -1169,10 +1198,9 @@ document.addEventListener('DOMContentLoaded', () => {
                 
                 const preview = document.getElementById('edit-photo-preview');
                 if (preview) {
-                    if (student.photo_path) {
-                        const photoPath = student.photo_path.replace('frontend/static/', '').replace(/\\/g, '/');
+                    if (student.photo_url) {
                         preview.innerHTML = `
-                            <img src="/static/${photoPath}" alt="Current photo">
+                            <img src="${student.photo_url}" alt="Current photo">
                             <button type="button" class="photo-delete-btn" onclick="deletePhoto('edit-photo-upload', 'edit_photo', 'edit-photo-preview', 'edit-photo-area', 'edit-photo-select-btn')">🗑️ Удалить фото</button>
                         `;
                     } else {
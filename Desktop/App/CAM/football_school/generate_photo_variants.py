@@ -0,0 +1,102 @@
+"""
+Создание уменьшенных копий (avatar, card, face) для уже загруженных фото учеников
+
+Пример:
+    python generate_photo_variants.py --workers 4
+
+Ученики, у которых копии уже соответствуют фото (по хешу содержимого), пропускаются,
+поэтому повторный запуск обрабатывает только новые и заменённые фото.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, db, ensure_student_columns
+from backend.models.models import Student
+from backend.services.photo_variants import (
+    PHOTO_VARIANTS, VARIANTS_FOLDER, photo_digest, remove_photo_variants, save_photo_variants
+)
+from backend.services.student_import import process_photo
+
+BATCH_SIZE = 50
+
+
+def render_photo_file(path):
+    """Сделать копии фото из файла (в процессе пула); Returns: {вариант: байты} или None"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    _, _, rendered = process_photo(data, encode=False)
+    return rendered
+
+
+def variants_up_to_date(student, digest):
+    variants = student.get_photo_variants()
+    if variants.get('digest') != digest:
+        return False
+    return all(
+        variants.get(name) and os.path.exists(os.path.join(VARIANTS_FOLDER, variants[name]))
+        for name in PHOTO_VARIANTS
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Уменьшенные копии фото учеников')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Процессов для обработки фото (0 - в текущем процессе)')
+    parser.add_argument('--force', action='store_true', help='Пересоздать копии для всех фото')
+    args = parser.parse_args()
+
+    with app.app_context():
+        ensure_student_columns()
+        students = Student.query.filter(Student.photo_path.isnot(None)).order_by(Student.id).all()
+
+        pending = []
+        missing = 0
+        for student in students:
+            if not os.path.exists(student.photo_path):
+                missing += 1
+                continue
+            with open(student.photo_path, 'rb') as f:
+                digest = photo_digest(f.read())
+            if args.force or not variants_up_to_date(student, digest):
+                pending.append((student, digest))
+        print(f"Фото: {len(students)}, без файла: {missing}, к обработке: {len(pending)}")
+
+        pool = None
+        if args.workers > 0 and pending:
+            pool = ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context('spawn'))
+        done = 0
+        failed = 0
+        try:
+            for start in range(0, len(pending), BATCH_SIZE):
+                batch = pending[start:start + BATCH_SIZE]
+                paths = [student.photo_path for student, _ in batch]
+                results = pool.map(render_photo_file, paths) if pool else map(render_photo_file, paths)
+                obsolete = []
+                for (student, digest), rendered in zip(batch, results):
+                    if not rendered:
+                        failed += 1
+                        print(f"  ✗ {student.full_name} (id {student.id}): не удалось прочитать фото")
+                        continue
+                    old_variants = student.get_photo_variants()
+                    variants = save_photo_variants(rendered, student.id, digest)
+                    student.set_photo_variants(variants)
+                    obsolete.append((old_variants, variants))
+                    done += 1
+                db.session.commit()
+                for old_variants, variants in obsolete:
+                    remove_photo_variants(old_variants, keep=variants)
+                print(f"  Обработано {min(start + BATCH_SIZE, len(pending))}/{len(pending)}")
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    print(f"✅ Готово! Созданы копии: {done}, ошибок: {failed}")
+
+
+if __name__ == '__main__':
+    main()
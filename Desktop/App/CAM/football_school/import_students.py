@@ -0,0 +1,64 @@
+"""
+Массовый импорт учеников из CSV и папки (или zip-архива) с фотографиями
+
+Пример:
+    python import_students.py roster.csv photos/ --workers 4 --report import_report.csv
+
+Повторный запуск с тем же файлом безопасен: уже записанные ученики
+(по student_number) пропускаются, импорт продолжается с остальных.
+Формат CSV описан в backend/services/student_import.py.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, face_service
+from backend.services.gallery_snapshot import bump_gallery_version
+from backend.services.student_import import (
+    DEFAULT_BATCH_SIZE, PhotoSource, StudentImporter, read_roster, summarize_report, write_report
+)
+
+
+def print_progress(done, total):
+    print(f"  Обработано {done}/{total}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Массовый импорт учеников')
+    parser.add_argument('roster', help='CSV-файл со списком учеников')
+    parser.add_argument('photos', nargs='?', help='Папка или zip-архив с фотографиями')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Процессов для расчёта encodings (0 - в текущем процессе)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Учеников в одной транзакции')
+    parser.add_argument('--report', default='import_report.csv', help='Куда сохранить отчёт по строкам')
+    args = parser.parse_args()
+
+    rows = read_roster(args.roster)
+    print(f"Строк в списке: {len(rows)}")
+    photos = PhotoSource(args.photos) if args.photos else None
+
+    with app.app_context():
+        importer = StudentImporter(face_service, workers=args.workers, batch_size=args.batch_size,
+                                   on_progress=print_progress)
+        try:
+            report = importer.run(rows, photos)
+        finally:
+            if photos is not None:
+                photos.close()
+        summary = summarize_report(report)
+        if summary['created']:
+            # Запущенный сервер увидит новую версию галереи и перезагрузит её
+            bump_gallery_version()
+
+    write_report(report, args.report)
+    print(f"✅ Импорт завершён! Добавлено: {summary['created']}, уже были: {summary['exists']}, "
+          f"ошибок: {summary['error']}")
+    print(f"Отчёт: {args.report}")
+    if summary['created']:
+        print("Сервер подхватит новых учеников при следующем распознавании")
+
+
+if __name__ == '__main__':
+    main()
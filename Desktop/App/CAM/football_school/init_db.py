@@ -5,6 +5,10 @@
 from app import app, db, bcrypt
 from backend.models.models import User, ClubSettings
 from datetime import time
+from migrate_face_encodings import migrate_face_encodings
+from backend.services.ledger import ledger_needs_rebuild, rebuild_ledger
+from backend.services.month_dues import month_dues_need_rebuild, rebuild_month_dues
+from backend.services.jobs import fail_stale_jobs
 
 def init_database():
     """Инициализация базы данных"""
@@ -43,6 +47,22 @@ def init_database():
         else:
             print("ℹ️  Настройки клуба уже существуют")
         
+        # Перевести face encodings в бинарный формат (идемпотентно)
+        migrate_face_encodings()
+        
+        # Заполнить итоги балансов при первом запуске после обновления
+        if ledger_needs_rebuild():
+            print("💰 Заполнение итогов балансов...")
+            print(f"✅ Итоги заполнены: {len(rebuild_ledger())}")
+        if month_dues_need_rebuild():
+            print("📅 Заполнение помесячных начислений...")
+            print(f"✅ Начисления заполнены: {len(rebuild_month_dues())}")
+        
+        # Фоновые задачи выполняются в потоках веб-процессов и не переживают перезапуск
+        interrupted = fail_stale_jobs(all_jobs=True)
+        if interrupted:
+            print(f"⚠️  Прерванных фоновых задач: {interrupted}")
+        
         print("\n🎉 База данных успешно инициализирована!")
         print("📍 Войдите как: admin / admin123")
 
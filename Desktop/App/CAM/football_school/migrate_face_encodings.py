@@ -0,0 +1,57 @@
+"""
+Миграция: перенос face encoding из JSON-колонки в бинарный формат
+(students.face_encoding -> students.face_encoding_bin)
+
+Строки обрабатываются пачками, каждая пачка - отдельная транзакция,
+поэтому миграцию можно безопасно прервать и запустить повторно.
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, db, ensure_student_columns
+from backend.models.face_encoding import encode_face_encoding, decode_legacy_face_encoding
+
+CHUNK_SIZE = 500
+
+
+def migrate_face_encodings(chunk_size=CHUNK_SIZE):
+    with app.app_context():
+        print("Добавление поля face_encoding_bin...")
+        ensure_student_columns()
+
+        converted = 0
+        skipped = 0
+        last_id = 0
+        while True:
+            rows = db.session.execute(db.text("""
+                SELECT id, face_encoding FROM students
+                WHERE id > :last_id AND face_encoding IS NOT NULL AND face_encoding_bin IS NULL
+                ORDER BY id
+                LIMIT :limit
+            """), {'last_id': last_id, 'limit': chunk_size}).fetchall()
+            if not rows:
+                break
+
+            for student_id, legacy_value in rows:
+                encoding = decode_legacy_face_encoding(legacy_value)
+                if encoding is None:
+                    print(f"  Ученик {student_id}: не удалось разобрать encoding, пропущен")
+                    skipped += 1
+                    continue
+                db.session.execute(
+                    db.text("UPDATE students SET face_encoding_bin = :blob, face_encoding = NULL WHERE id = :id"),
+                    {'blob': encode_face_encoding(encoding), 'id': student_id}
+                )
+                converted += 1
+
+            db.session.commit()
+            last_id = rows[-1][0]
+            print(f"  Обработано до id={last_id} (конвертировано: {converted})")
+
+        print(f"✅ Миграция завершена! Конвертировано: {converted}, пропущено: {skipped}")
+
+
+if __name__ == '__main__':
+    migrate_face_encodings()
@@ -0,0 +1,61 @@
+"""
+Сверка итогов и балансов (student_ledger) и помесячных начислений (student_month_dues)
+с историей оплат и посещений
+
+Пример:
+    python reconcile_ledger.py            # найти и исправить расхождения
+    python reconcile_ledger.py --dry-run  # только показать расхождения
+
+Итоги и начисления меняются в тех же транзакциях, что и оплаты/посещения, поэтому расхождения
+появляются только после правок БД в обход приложения. Лучше запускать, когда
+никто не вносит оплаты: изменения во время сверки могут быть перезаписаны.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, db
+from backend.services.ledger import rebuild_ledger
+from backend.services.month_dues import rebuild_month_dues
+
+SHOW_LIMIT = 20
+
+
+def reconcile_ledger(dry_run=False):
+    with app.app_context():
+        db.create_all()
+        mismatches = rebuild_ledger(dry_run=dry_run)
+        for student_id, stored, expected in mismatches[:SHOW_LIMIT]:
+            stored_text = f"{stored[0]:.0f} сум / {stored[1]} зан. / баланс {stored[2]}" if stored else 'нет строки'
+            print(f"  Ученик {student_id}: {stored_text} -> "
+                  f"{expected[0]:.0f} сум / {expected[1]} зан. / баланс {expected[2]}")
+        if len(mismatches) > SHOW_LIMIT:
+            print(f"  ... и ещё {len(mismatches) - SHOW_LIMIT}")
+
+        dues_mismatches = rebuild_month_dues(dry_run=dry_run)
+        for student_id, year, month, stored, expected in dues_mismatches[:SHOW_LIMIT]:
+            stored_text = f"{stored[0]:.0f} / оплачено {stored[1]:.0f}" if stored else 'нет строки'
+            print(f"  Ученик {student_id}, {month}/{year}: {stored_text} -> "
+                  f"{expected[0]:.0f} / оплачено {expected[1]:.0f}")
+        if len(dues_mismatches) > SHOW_LIMIT:
+            print(f"  ... и ещё {len(dues_mismatches) - SHOW_LIMIT}")
+
+        if dry_run:
+            print(f"Найдено расхождений: итоги {len(mismatches)}, начисления {len(dues_mismatches)} "
+                  f"(ничего не изменено)")
+        else:
+            print(f"✅ Сверка завершена! Исправлено: итоги {len(mismatches)}, начисления {len(dues_mismatches)}")
+        return mismatches, dues_mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сверка итогов балансов и начислений с историей')
+    parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения')
+    args = parser.parse_args()
+    reconcile_ledger(dry_run=args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""
+Пересчёт face encodings всех учеников по их фото (после смены параметров детектора
+или encoder, исправления фото и т.п.)
+
+Пример:
+    python reencode_gallery.py --workers 8 --jitters 2
+
+- ученики обрабатываются пачками по id, фото кодируются в пуле процессов;
+- результат каждой пачки сохраняется в папку контрольных точек, поэтому после
+  сбоя повторный запуск продолжает с первой необработанной пачки
+  (--restart - начать заново, в том числе с другими параметрами);
+- encodings в students заменяются только в конце, одной транзакцией, после чего
+  поднимается версия галереи - запущенный сервер перезагрузит её сам.
+  Если фото не удалось обработать, у ученика остаётся прежний encoding.
+  Если фото заменили во время прогона (в том числе файлом с тем же именем - сверяется
+  хеш содержимого), encoding ученика не трогается: новое фото обработала фоновая задача.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, db, ensure_student_columns
+from backend.models.face_encoding import ENCODING_DIM, encode_face_encoding
+from backend.models.models import Student
+from backend.services.gallery_snapshot import bump_gallery_version
+from backend.services.photo_variants import photo_digest
+from backend.services.student_import import process_photo
+
+DEFAULT_CHUNK_SIZE = 200
+DEFAULT_CHECKPOINT_DIR = os.path.join('database', 'reencode')
+REPORT_FIELDS = ['student_id', 'full_name', 'photo_path', 'message']
+# Формат контрольных точек (с хешами фото); прогоны старого формата нужно начать заново
+CHECKPOINT_FORMAT = 2
+
+
+def encode_photo_file(path, options):
+    """
+    Посчитать encoding фото из файла (в процессе пула)
+    Returns: (encoding или None, ошибка или None, хеш содержимого или '')
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        return None, f'Файл фото недоступен: {e}', ''
+    encoding, error, _ = process_photo(data, variants=False, **options)
+    return encoding, error, photo_digest(data)
+
+
+def current_photo_digest(path, photo_variants):
+    """Хеш текущего фото ученика: из копий фото (сбрасываются при замене фото) или по файлу"""
+    try:
+        digest = json.loads(photo_variants).get('digest') if photo_variants else None
+    except ValueError:
+        digest = None
+    if digest:
+        return digest
+    try:
+        with open(path, 'rb') as f:
+            return photo_digest(f.read())
+    except OSError:
+        return None
+
+
+class Checkpoint:
+    """Папка с состоянием прогона (state.json) и результатами готовых пачек (chunk_N.npz)"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.state_path = os.path.join(directory, 'state.json')
+
+    def load(self):
+        if not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_state(self, state):
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.state_path)
+
+    def _chunk_path(self, index):
+        return os.path.join(self.directory, f'chunk_{index}.npz')
+
+    def save_chunk(self, index, student_ids, photo_paths, digests, encodings, errors):
+        temp_path = self._chunk_path(index) + '.tmp.npz'
+        np.savez(
+            temp_path,
+            ids=np.asarray(student_ids, dtype=np.int64),
+            photo_paths=np.asarray(photo_paths, dtype=str),
+            digests=np.asarray(digests, dtype=str),
+            encodings=np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM),
+            errors=np.asarray(errors, dtype=str)
+        )
+        os.replace(temp_path, self._chunk_path(index))
+
+    def chunks(self, count):
+        """Результаты пачек по порядку: (ids, photo_paths, digests, encodings, errors)"""
+        for index in range(count):
+            with np.load(self._chunk_path(index)) as chunk:
+                yield chunk['ids'], chunk['photo_paths'], chunk['digests'], chunk['encodings'], chunk['errors']
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name == 'state.json' or name.startswith('chunk_'):
+                os.remove(os.path.join(self.directory, name))
+
+
+def encode_all(checkpoint, state, options, workers, chunk_size):
+    """Пройти учеников с фото пачками, сохраняя каждую пачку в контрольную точку"""
+    total = Student.query.filter(Student.photo_path.isnot(None), Student.id > state['last_id']).count()
+    print(f"Осталось учеников с фото: {total}")
+    pool = None
+    if workers > 0:
+        # spawn: процессы не наследуют соединения с БД
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    encode = partial(encode_photo_file, options=options)
+    done = 0
+    try:
+        while True:
+            rows = db.session.query(Student.id, Student.photo_path).filter(
+                Student.photo_path.isnot(None), Student.id > state['last_id']
+            ).order_by(Student.id).limit(chunk_size).all()
+            if not rows:
+                break
+            paths = [photo_path for _, photo_path in rows]
+            results = list(pool.map(encode, paths) if pool else map(encode, paths))
+            encodings = [encoding if encoding is not None else np.zeros(ENCODING_DIM, dtype=np.float32)
+                         for encoding, _, _ in results]
+            errors = [error or '' for _, error, _ in results]
+            digests = [digest for _, _, digest in results]
+            checkpoint.save_chunk(state['chunks'], [student_id for student_id, _ in rows], paths, digests,
+                                  encodings, errors)
+            state['chunks'] += 1
+            state['last_id'] = rows[-1][0]
+            checkpoint.save_state(state)
+            done += len(rows)
+            print(f"  Обработано {done}/{total} (до id={state['last_id']})")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def swap_in(checkpoint, state):
+    """
+    Заменить encodings учеников результатами всех пачек одной транзакцией
+    Returns: (обновлено, список ошибок для отчёта)
+    """
+    current = {
+        student_id: (photo_path, full_name, photo_variants)
+        for student_id, photo_path, full_name, photo_variants in db.session.query(
+            Student.id, Student.photo_path, Student.full_name, Student.photo_variants
+        ).all()
+    }
+    updates = []
+    failures = []
+    for ids, photo_paths, digests, encodings, errors in checkpoint.chunks(state['chunks']):
+        for student_id, photo_path, digest, encoding, error in zip(
+            ids.tolist(), photo_paths.tolist(), digests.tolist(), encodings, errors.tolist()
+        ):
+            current_path, full_name, photo_variants = current.get(student_id, (None, None, None))
+            if current_path != photo_path:
+                # Ученика удалили или заменили фото - новое фото уже обработала фоновая задача
+                continue
+            if error:
+                failures.append({'student_id': student_id, 'full_name': full_name,
+                                 'photo_path': photo_path, 'message': error})
+                continue
+            # Фото заменили файлом с тем же именем - encoding уже посчитан по новому
+            if current_photo_digest(photo_path, photo_variants) != digest:
+                continue
+            updates.append({'id': student_id, 'blob': encode_face_encoding(encoding)})
+
+    if updates:
+        db.session.execute(
+            db.text("UPDATE students SET face_encoding_bin = :blob, face_encoding = NULL WHERE id = :id"),
+            updates
+        )
+    db.session.commit()
+    return len(updates), failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пересчёт face encodings всех учеников по фото')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Процессов для расчёта encodings (0 - в текущем процессе)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Учеников в одной пачке')
+    parser.add_argument('--checkpoint-dir', default=DEFAULT_CHECKPOINT_DIR, help='Папка контрольных точек')
+    parser.add_argument('--restart', action='store_true', help='Начать заново, отбросив контрольные точки')
+    parser.add_argument('--upsample', type=int, default=1, help='Апсемплинг детектора лиц')
+    parser.add_argument('--model', choices=['hog', 'cnn'], default='hog', help='Детектор лиц')
+    parser.add_argument('--jitters', type=int, default=1, help='Число искажений фото при расчёте encoding')
+    parser.add_argument('--report', default='reencode_report.csv', help='Куда сохранить список ошибок')
+    args = parser.parse_args()
+
+    options = {'upsample': args.upsample, 'model': args.model, 'jitters': args.jitters}
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+    checkpoint = Checkpoint(args.checkpoint_dir)
+    state = checkpoint.load()
+    if state is not None and args.restart:
+        checkpoint.clear()
+        state = None
+    if state is not None and state.get('format') != CHECKPOINT_FORMAT:
+        print("❌ Незавершённый прогон старой версии скрипта: повторите с --restart")
+        sys.exit(1)
+    if state is not None and state['options'] != options:
+        print(f"❌ Незавершённый прогон с другими параметрами ({state['options']}): "
+              f"повторите с ними или добавьте --restart")
+        sys.exit(1)
+    if state is None:
+        state = {'format': CHECKPOINT_FORMAT, 'options': options, 'last_id': 0, 'chunks': 0, 'started_at': datetime.utcnow().isoformat()}
+        checkpoint.save_state(state)
+    elif state['chunks']:
+        print(f"Продолжение прогона от {state['started_at']}: готово пачек {state['chunks']}")
+
+    with app.app_context():
+        ensure_student_columns()
+        encode_all(checkpoint, state, options, args.workers, max(1, args.chunk_size))
+        updated, failures = swap_in(checkpoint, state)
+        version = bump_gallery_version()
+
+    with open(args.report, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(failures)
+    checkpoint.clear()
+
+    print(f"✅ Пересчёт завершён! Обновлено: {updated}, ошибок: {len(failures)} (отчёт: {args.report})")
+    print(f"Версия галереи: {version} - сервер перезагрузит галерею при следующем распознавании")
+
+
+if __name__ == '__main__':
+    main()
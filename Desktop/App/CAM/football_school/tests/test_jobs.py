@@ -0,0 +1,39 @@
+"""
+Фоновые задачи: прерванной считается задача без отметки о ходе работы, а не долгая
+
+Запуск: python -m pytest tests
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.models.models import BackgroundJob
+from backend.services.jobs import JOB_STALE_AFTER, _is_stale, worker_id
+
+
+def make_job(created_ago, heartbeat_ago):
+    now = datetime.utcnow()
+    return BackgroundJob(
+        id='job', kind='import_students', status='running', worker=f'other-host:{os.getpid()}',
+        created_at=now - created_ago, heartbeat_at=now - heartbeat_ago if heartbeat_ago is not None else None
+    )
+
+
+def test_long_job_with_recent_heartbeat_is_alive():
+    job = make_job(JOB_STALE_AFTER * 3, timedelta(minutes=1))
+    assert not _is_stale(job, datetime.utcnow())
+
+
+def test_job_without_recent_heartbeat_is_stale():
+    job = make_job(JOB_STALE_AFTER * 3, JOB_STALE_AFTER * 2)
+    assert _is_stale(job, datetime.utcnow())
+
+
+def test_job_of_dead_local_worker_is_stale():
+    job = make_job(timedelta(minutes=1), timedelta(minutes=1))
+    host = worker_id().rpartition(':')[0]
+    # pid, которого заведомо нет
+    job.worker = f'{host}:{2 ** 22 + 1}'
+    assert _is_stale(job, datetime.utcnow())
@@ -0,0 +1,42 @@
+"""
+Пул распознавания: процессы пула строят такой же индекс галереи, как веб-процесс
+
+Запуск: python -m pytest tests (нужны face_recognition и opencv - их импортирует процесс пула)
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('face_recognition')
+pytest.importorskip('cv2')
+
+from backend.services.face_index import create_face_index
+from backend.services.face_service import FaceRecognitionService
+from backend.services import recognition_pool
+from backend.services.recognition_pool import RecognitionExecutor
+
+
+def worker_index_options(_):
+    """Выполняется в процессе пула: индекс сервиса этого процесса"""
+    index = recognition_pool._worker_service._index
+    return type(index).__name__, index.options()
+
+
+def test_pool_workers_use_configured_ivf_index(monkeypatch):
+    monkeypatch.setenv('FACE_INDEX', 'ivf')
+    monkeypatch.setenv('FACE_INDEX_NPROBE', '3')
+    # Как в app.py
+    service = FaceRecognitionService(index=create_face_index(
+        os.environ.get('FACE_INDEX', 'brute'),
+        nprobe=int(os.environ.get('FACE_INDEX_NPROBE', 8))
+    ))
+    executor = RecognitionExecutor(service, workers=1)
+    try:
+        name, options = executor._get_pool().submit(worker_index_options, None).result(timeout=60)
+    finally:
+        executor.shutdown()
+    assert name == 'IVFIndex'
+    assert options['nprobe'] == 3
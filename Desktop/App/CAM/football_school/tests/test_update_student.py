@@ -0,0 +1,70 @@
+"""
+Редактирование ученика: версия галереи поднимается только при смене статуса
+
+Запуск: python -m pytest tests (нужны face_recognition и opencv - их импортирует app.py)
+"""
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('face_recognition')
+pytest.importorskip('cv2')
+
+_tmp_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_tmp_dir, 'test.db')
+os.environ['FACE_GALLERY_DIR'] = os.path.join(_tmp_dir, 'face_gallery')
+
+from app import app, ensure_student_columns  # noqa: E402
+from backend.models.models import db, User, Student  # noqa: E402
+from backend.services.gallery_snapshot import current_gallery_version  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        db.create_all()
+        ensure_student_columns()
+        admin = User(username='admin', role='admin', password_hash='-')
+        student = Student(student_number='1', full_name='Тест Ученик', status='active')
+        student.set_face_encoding(np.ones(128))
+        db.session.add_all([admin, student])
+        db.session.commit()
+        ids = admin.id, student.id
+        db.session.commit()
+
+    test_client = app.test_client()
+    with test_client.session_transaction() as sess:
+        sess['_user_id'] = str(ids[0])
+    yield test_client, ids[1]
+
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def gallery_version():
+    with app.app_context():
+        version = current_gallery_version()
+        db.session.commit()
+        return version
+
+
+def test_phone_edit_keeps_gallery_version(client):
+    test_client, student_id = client
+    before = gallery_version()
+    response = test_client.put(f'/api/students/{student_id}', data={'phone': '+998901234567', 'status': 'active'})
+    assert response.get_json()['success']
+    assert gallery_version() == before
+
+
+def test_status_change_bumps_gallery_version(client):
+    test_client, student_id = client
+    before = gallery_version()
+    response = test_client.put(f'/api/students/{student_id}', data={'status': 'inactive'})
+    assert response.get_json()['success']
+    assert gallery_version() == before + 1